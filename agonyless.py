@@ -1,9 +1,16 @@
 #!/usr/bin/env python
+import os
+from contextlib import contextmanager
+from functools import partial
 import ssh_drv
 import ssh_lib
-import yaml
-import pdb
-from cmn_lib import p_trace
+import inventory
+import journal
+import preflight
+import rollout
+import ssh_profile
+import perf_lib
+from cmn_lib import p_trace, load_config
 
 __version__ = '0.1'
 
@@ -12,65 +19,175 @@ A tool to interact with Adaptiv Networks 7.X CPEs.
 """
 
 
-def main():
+def rotate_cpe(ne, ne_conf, run_journal=None):
     """
-    :return:  True or False based on the over all result
+    Update the monitor and admin passwords of a single CPE, verify the new credentials
+    and save the config. Each call uses its own SSH sessions so it is safe to run
+    concurrently for different CPEs.
+    :param ne: The IP address of the CPE
+    :param ne_conf: The parsed config.yml
+    :param run_journal: Optional journal.RunJournal the completed steps are recorded in. The steps
+                        it already holds for the CPE are skipped.
+    :return: A dict with the result and the last step reached, see fleet.run_task
     """
-
-    # Kick it!
-    overall_result = True
-
-    yaml_file = './config.yml'
-    with open(yaml_file, 'r') as agony_yml:
-        ne_conf = yaml.load(agony_yml, Loader=yaml.FullLoader)
-
-    for ne in ne_conf['network_entities']:
-
-        # Prompt between each CPE
-        prompt = input('Are you ready to continue? y to continue:\n')
-        if prompt != 'y':
-            p_trace('Quitting')
-            return False
-
-        # Break out the variables for initial login
-        uname = ne_conf['credentials']['uname']
-        mp = ne_conf['credentials']['monitor']
-        ap = ne_conf['credentials']['admin']
-        port = ne_conf['credentials']['port']
-        role = ne_conf['credentials']['role']
-
-        # Establish the ssh session & memo the version
-        ssh = ssh_drv.SSH()
-        if not ssh.open(ne, role, uname, mp, port=port, role=role, monitor_passwd=mp, admin_passwd=ap):
-            p_trace('Unable to log into host - game over!', 'ERROR')
-            return False
+    # CPEs sharing an address on different ports are journaled as host:port
+    key = ne.key if isinstance(ne, inventory.Target) else ne
+
+    def passed(step):
+        return run_journal is not None and run_journal.passed(key, step)
+
+    def record(step):
+        if run_journal is not None:
+            run_journal.record(key, step)
+
+    # A resumed CPE logs in with the passwords left in place by its completed steps
+    mp = ne_conf['new_passwords' if passed('monitor_password') else 'credentials']['monitor']
+    ap = ne_conf['new_passwords' if passed('admin_password') else 'credentials']['admin']
+
+    # Optionally record the raw sessions, to be replayed offline with transcript.py
+    transcript_dir = ne_conf.get('logging', {}).get('transcript_dir')
+    transcripts = [os.path.join(transcript_dir, f'{key}{suffix}.transcript') if transcript_dir else None
+                   for suffix in ['', '-verify']]
+
+    # Establish the ssh session & memo the version
+    with ssh_drv.SSH() as ssh:
+        opened = ssh_lib.open_cpe(ssh, ne, ne_conf, mp, ap, transcript=transcripts[0])
+        if not opened and passed('monitor_password'):
+            # The changes were never saved, eg the CPE rebooted since. Start over from the original passwords.
+            p_trace(f'CPE {ne} refused the new passwords, retrying with the original ones', 'WARNING')
+            mp = ne_conf['credentials']['monitor']
+            ap = ne_conf['credentials']['admin']
+            opened = ssh_lib.open_cpe(ssh, ne, ne_conf, mp, ap, transcript=transcripts[0])
+            if opened:
+                run_journal.reset(key)
+        if not opened:
+            p_trace(f'Unable to log into host {ne}', 'ERROR')
+            return {'result': False, 'step': 'connect'}
+        record('connected')
 
         # Update the passwords
         for user in ['monitor', 'admin']:
+            if passed(f'{user}_password'):
+                continue
             pw_old = ne_conf['credentials'][user]
             pw_new = ne_conf['new_passwords'][user]
 
             if not ssh_lib.cli_update_password(ssh, user, pw_old, pw_new):
-                overall_result = False
-                break
-
-        # Test to verify the login before doing the save config
-        ssh2 = ssh_drv.SSH()
-        mp_test = ssh.monitor_passwd
-        ap_test = ssh.admin_passwd
-        p_trace('Confirming new usernames and passwords', 'DEBUG2')
-        if ssh2.open(ne, role, uname, mp_test, port=port, role=role, monitor_passwd='agni1234', admin_passwd=ap_test):
-            if not ssh2.send('admin'):
-                overall_result = False
-        else:
-            overall_result = False
-
-        if overall_result:
-            ssh_lib.cli_save_config(ssh)
-        else:
-            p_trace(f'Aborting due to failure updating password for  user {user} on CPE {ne}', 'ERROR')
-
-    return overall_result
+                p_trace(f'Aborting due to failure updating password for user {user} on CPE {ne}', 'ERROR')
+                return {'result': False, 'step': f'{user}_password'}
+            record(f'{user}_password')
+
+        # Test to verify the login before doing the save config.
+        # The new monitor password makes this a separate, freshly authenticated connection.
+        if not passed('verified'):
+            p_trace(f'Confirming new usernames and passwords on CPE {ne}', 'DEBUG2')
+            with ssh_drv.SSH() as ssh2:
+                if not ssh_lib.open_cpe(ssh2, ne, ne_conf, ssh.monitor_passwd, ssh.admin_passwd,
+                                        transcript=transcripts[1]) or not ssh2.send('admin')[0]:
+                    p_trace(f'Aborting due to failure verifying the new passwords on CPE {ne}', 'ERROR')
+                    return {'result': False, 'step': 'verify'}
+            record('verified')
+
+        ssh_lib.cli_save_config(ssh)
+        record('saved')
+    return {'result': True, 'step': 'saved'}
+
+
+def _journal_key(ne_conf):
+    return journal.fingerprint(ne_conf['new_passwords']['monitor'], ne_conf['new_passwords']['admin'])
+
+
+@contextmanager
+def rotate_task(ne_conf):
+    """
+    The rotation task of a fleet run, see fleet.run_sharded. Entered once per process, each
+    having its own handle on the journal started by main.
+    :param ne_conf: The parsed config.yml
+    :return: A context manager yielding the task, taking a target
+    """
+    fleet_conf = ne_conf.get('fleet', {})
+    run_journal = None
+    if fleet_conf.get('journal'):
+        run_journal = journal.RunJournal(fleet_conf['journal'], True, _journal_key(ne_conf), verbose=False)
+    try:
+        yield lambda ne: rotate_cpe(ne, ne.conf(ne_conf), run_journal=run_journal)
+    finally:
+        if run_journal:
+            run_journal.close()
+
+
+def main(yaml_file='./config.yml'):
+    """
+    :param yaml_file: The config file
+    :return:  True or False based on the over all result
+    """
+
+    # Kick it!
+    ne_conf = load_config(yaml_file)
+    transcript_dir = ne_conf.get('logging', {}).get('transcript_dir')
+    if transcript_dir:
+        os.makedirs(transcript_dir, exist_ok=True)
+
+    report = ne_conf.get('profile', {}).get('report')
+    if report:
+        perf_lib.enable_profiling()
+
+    # Known hosts, password only auth and algorithm preferences, shared by every connection
+    try:
+        ssh_profile.apply_profile(ne_conf)
+    except ValueError as error:
+        p_trace(str(error), 'ERROR')
+        return False
+
+    try:
+        waves = rollout.Rollout.from_conf(ne_conf.get('rollout'))
+    except ValueError as error:
+        p_trace(str(error), 'ERROR')
+        return False
+
+    fleet_conf = ne_conf.get('fleet', {})
+    workers = fleet_conf.get('workers', 1)
+    processes = fleet_conf.get('processes', 1)
+    # Inventory files are relative to the config file
+    network_entities = inventory.load_inventory(ne_conf['network_entities'],
+                                                os.path.dirname(os.path.abspath(yaml_file)))
+
+    run_journal = None
+    if fleet_conf.get('journal'):
+        try:
+            run_journal = journal.RunJournal(fleet_conf['journal'], fleet_conf.get('resume', False),
+                                             _journal_key(ne_conf))
+        except ValueError as error:
+            p_trace(str(error), 'ERROR')
+            return False
+        # CPEs done by a previous run are not logged into again
+        network_entities = (ne for ne in network_entities if not run_journal.done(ne.key))
+
+    # Skip the CPEs that don't even accept a TCP connection, rather than waiting on SSH timeouts
+    preflight_conf = ne_conf.get('preflight', {})
+    scanner = None
+    if preflight_conf.get('enabled'):
+        scanner = preflight.Preflight(preflight_conf.get('timeout', 3), preflight_conf.get('slow', 1.0),
+                                      preflight_conf.get('workers', 256))
+        network_entities = scanner.reachable_targets(network_entities, preflight.port_of(ne_conf))
+
+    # A canary wave, then waves growing until the inventory is done or a wave fails too often
+    try:
+        run = waves.run(network_entities, partial(rotate_task, ne_conf), processes, workers)
+    except ValueError as error:
+        p_trace(f'Fleet run aborted - {error}', 'ERROR')
+        return False
+    finally:
+        if run_journal:
+            run_journal.close()
+
+    if scanner:
+        p_trace(scanner.summary(), 'PASS' if not scanner.unreachable_hosts else 'ERROR')
+        for host in scanner.unreachable_hosts:
+            p_trace(f'  Unreachable: {host}', 'ERROR')
+    if report:
+        perf_lib.disable_profiling().write(report)
+    return run.result and not run.stopped and not (scanner and scanner.unreachable_hosts)
 
 
 if __name__ == "__main__":
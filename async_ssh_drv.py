@@ -0,0 +1,225 @@
+import asyncio
+import functools
+import socket
+import time
+import codecs
+from ssh_drv import SSH, RawResponse, RECV_BUFSIZE, _BANNER_PROMPT
+from output_buffer import OutputBuffer
+from cmn_lib import p_trace, trace_enabled
+
+"""
+This file contains the asyncio counterpart of ssh_drv.SSH.
+
+A single event loop can drive many AgniOS shell sessions at once. The raw channel is put
+in non-blocking mode and the loop is told when data arrives via the channel's fileno, so no
+thread is tied up while a CPE is thinking. Output is parsed by the same RawResponse engine
+as ssh_drv.SSH, so prompts and password challenges are handled identically. Long running
+commands are streamed with async for, a line at a time as they arrive.
+
+Paramiko's connect/handshake and the exec_command based standard mode are blocking. Those
+run on the loop's default executor.
+"""
+
+
+class AsyncCommandStream(object):
+    """
+    Iterates over the output lines of one command as they are received, see AsyncSSH.stream
+    """
+
+    def __init__(self, ssh, cmd, suppress_logs=False):
+        self.ssh = ssh
+        self.cmd = cmd
+        self.suppress_logs = suppress_logs
+        self.result = None
+
+    async def __aiter__(self):
+        ssh = self.ssh
+        if ssh.io_mode == 'standard':
+            self.result, lines = await ssh.send(self.cmd, self.suppress_logs)
+            for line in lines or []:
+                yield line
+            return
+
+        p_trace(f"  -->  '{self.cmd}' to {ssh.sys_name} ({ssh.host_id})")
+        log_lines = not self.suppress_logs and trace_enabled()
+        await ssh._write(f'{self.cmd}\n')
+        response = RawResponse(ssh, self.cmd)
+
+        received = True
+        while received and not response.done:
+            received = await ssh._raw_receive(response, once=True)
+
+            # Hand over the complete lines received so far, without keeping them
+            lines = response.lines
+            response.lines = []
+            for line in lines:
+                if log_lines:
+                    p_trace(f'  <--  {line}')
+                yield line
+
+        if self.suppress_logs:
+            p_trace('  <--  output of last cmd intentionally suppressed')
+        self.result = response.result
+
+
+class AsyncSSH(SSH):
+    """
+    Establishes an SSH session to a remote system, and then handles commands and command output
+    from coroutines. The helpers in async_ssh_lib take an AsyncSSH instance.
+    """
+
+    async def open(self, host_id, sys_name, user_name, password, **kwargs):
+        """
+        Opens the SSH session with the remote system. Takes the same args as SSH.open
+        :return: True or False based on success of establishing ssh connection
+        """
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, functools.partial(
+            self._connect, host_id, sys_name, user_name, password, **kwargs))
+
+        if result:
+            if self.role != 'cpe' and self.role != 'cc':
+                await loop.run_in_executor(None, self._detect_os)
+            else:
+                # Adaptiv AgniShell
+                self.os = 'AgniOS'
+                self.cpu = '64Bit'
+                self.io_mode = 'raw'
+                self.channel = self._record(await loop.run_in_executor(None, self.fh_ssh.invoke_shell), password)
+                self.channel.setblocking(0)
+
+                # Wait for the complete welcome banner, which ends with the monitor prompt
+                m_prompt, welcome_msg = await self.expect(_BANNER_PROMPT, self.banner_timeout)
+                self._parse_banner(m_prompt, welcome_msg)
+
+            log_string = f'SSH connection established with {host_id} ({sys_name}) : {self.os}/{self.cpu}'
+            p_trace(log_string, 'PASS')
+        return result
+
+    async def _wait_readable(self):
+        """
+        Suspend until the raw channel has data to read, or has been closed
+        """
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = self.channel.fileno()
+
+        def _wake():
+            if not ready.done():
+                ready.set_result(True)
+
+        loop.add_reader(fd, _wake)
+        try:
+            await ready
+        finally:
+            loop.remove_reader(fd)
+
+    async def _recv(self):
+        """
+        :return: The bytes available on the raw channel, b'' once the channel is closed
+        """
+        while True:
+            try:
+                return self.channel.recv(RECV_BUFSIZE)
+            except socket.timeout:
+                await self._wait_readable()
+
+    async def _write(self, data):
+        """
+        Write all of data to the raw channel without blocking the loop
+        """
+        data = data.encode('utf-8')
+        while data:
+            try:
+                sent = self.channel.send(data)
+            except socket.timeout:
+                sent = 0
+            data = data[sent:]
+            if data:
+                await asyncio.sleep(0.01)
+
+    async def expect(self, pattern, timeout):
+        """
+        Read from the raw channel until the received text matches pattern, or until the
+        deadline passes. Same contract as SSH.expect.
+        :return: A tuple of the match object (None when not found) and the text received
+        """
+        deadline = time.time() + timeout
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        text = ''
+        m = None
+
+        while True:
+            try:
+                data = await asyncio.wait_for(self._recv(), deadline - time.time())
+            except asyncio.TimeoutError:
+                p_trace(f'Timed out after {timeout}s waiting for {pattern.pattern!r} from {self.host_id}', 'WARNING')
+                break
+            if not data:
+                p_trace(f'Channel to {self.host_id} closed while waiting for {pattern.pattern!r}', 'ERROR')
+                break
+            text += decoder.decode(data)
+            m = pattern.search(text)
+            if m:
+                break
+
+        return m, text
+
+    async def send(self, cmd, suppress_logs=False):
+        """
+        Send a command and return the output from that command. Same contract as SSH.send
+        :return: ssh_response - a tuple consisting of the cmd result <True|False> and an
+                 OutputBuffer of the stdout or stderr lines of the provided command
+        """
+        if self.io_mode == 'standard':
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, SSH.send, self, cmd, suppress_logs)
+
+        p_trace(f"  -->  '{cmd}' to {self.sys_name} ({self.host_id})")
+        await self._write(f'{cmd}\n')
+        response = RawResponse(self, cmd, lines=OutputBuffer(self.output_spill))
+
+        await self._raw_receive(response)
+
+        if not suppress_logs and trace_enabled():
+            for line in response.lines:
+                p_trace(f'  <--  {line}')
+        elif suppress_logs:
+            p_trace('  <--  output of last cmd intentionally suppressed')
+
+        return response.result, response.lines
+
+    async def send_batch(self, cmds, suppress_logs=False):
+        """
+        Send several commands, one round trip each. Same contract as SSH.send_batch
+        :return: A list with one (cmd result, output lines) tuple per command, like send
+        """
+        return [await self.send(cmd, suppress_logs) for cmd in cmds]
+
+    async def _raw_receive(self, response, once=False):
+        """
+        Feed the raw channel to response until its closing prompt is seen, without blocking the loop
+        :param response: The RawResponse of the command in flight
+        :param once: When True, return after feeding a single chunk
+        :return: False when the channel closed before the prompt was received
+        """
+        while not response.done:
+            data = await self._recv()
+            if not data:
+                p_trace(f'Channel to {self.host_id} closed before the prompt was received', 'ERROR')
+                response.result = False
+                return False
+            for reply in response.feed(data, self.channel.recv_ready()):
+                await self._write(reply)
+            if once:
+                break
+        return True
+
+    def stream(self, cmd, suppress_logs=False):
+        """
+        Send a command and iterate over its output lines as they arrive, instead of waiting
+        for the prompt. Same contract as SSH.stream, iterated with async for.
+        :return: An AsyncCommandStream yielding the output lines. Its result attribute holds the
+                 cmd result <True|False> once the iteration is complete.
+        """
+        return AsyncCommandStream(self, cmd, suppress_logs)
@@ -0,0 +1,104 @@
+from ssh_lib import cli_nav_plan, calibration_cmd, CalibrationParser
+from cmn_lib import p_trace
+
+"""
+Coroutine versions of the ssh_lib helpers, meant to be used in conjunction with
+async_ssh_drv.AsyncSSH instances. Each helper issues the same commands, in the same
+order, as its ssh_lib namesake, one command per round trip.
+"""
+
+
+async def cli_nav(fh_ssh, cli_node):
+    """
+    Navigate to the correct user level and node in the CLI hierarchy to issue a specific command.
+    The path is planned by ssh_lib.cli_nav_plan from the position tracked by the session.
+    :param fh_ssh: AsyncSSH session created via previous call to AsyncSSH.open
+    :param cli_node: The string that matches which node to navigate to in order to execute
+                     a given command.
+    :return: True or False if the requested node could be navigated to
+    """
+    plan = cli_nav_plan(fh_ssh.cli_state, cli_node, fh_ssh.diag_return)
+    if plan is None:
+        p_trace(f'Unable to find a path from prompt {fh_ssh.prompt} to cli node {cli_node}', 'ERROR')
+        return False
+
+    for cmd in plan:
+        fh_ssh.nav_count += 1
+        result = await fh_ssh.send(cmd)
+        if not result[0]:
+            p_trace(f'Unable to navigate to requested cli node {cli_node} - {result[1]}', 'ERROR')
+            return False
+
+    if fh_ssh.cli_state != cli_node:
+        p_trace(f'Unable to navigate to requested cli node {cli_node} - prompt is {fh_ssh.prompt}', 'ERROR')
+        return False
+
+    return True
+
+
+async def cli_get_ver(fh_ssh):
+    """
+    Obtains the system version running on the Adaptiv NE
+    :param fh_ssh: AsyncSSH session created via previous call to AsyncSSH.open
+    :return: version - a string matching the vesrion string obtained by a show version
+    """
+    await cli_nav(fh_ssh, 'system')
+    output = await fh_ssh.send('show version')
+    version = output[1][0]
+    output = await fh_ssh.send('show uptime')
+    uptime = output[1][0]
+    p_trace(f"{fh_ssh.sys_name} is running:  '{version}'  / System uptime: {uptime}")
+    return version
+
+
+async def cli_update_password(fh_ssh, uname, passwd_old, passwd_new):
+    """
+    Helper function to update the admin password
+    :param fh_ssh: AsyncSSH session created via previous call to AsyncSSH.open
+    :param uname: The user to update
+    :param passwd_old: The existing password
+    :param passwd_new: The password to be set
+    :return: True or False based on success
+    """
+    await cli_nav(fh_ssh, 'system')
+    output = await fh_ssh.send(f'set password {uname} {passwd_old} {passwd_new}')
+
+    if not output[0] or not output[1]:
+        p_trace(f'Something unexpected happened - {output[1]}', 'ERROR')
+        return False
+    else:
+        if uname == 'monitor':
+            fh_ssh.monitor_passwd = passwd_new
+        elif uname == 'admin':
+            fh_ssh.admin_passwd = passwd_new
+
+    return output[0]
+
+
+async def cli_save_config(fh_ssh):
+    await cli_nav(fh_ssh, 'Admin')
+    await fh_ssh.send('save config all')
+    return True
+
+
+async def cli_get_calibration(fh_ssh, aux_srv):
+    """
+    Calibrate the underlay links against a nuttcp server, which takes approx 5 min. The results
+    are parsed as they are reported, while the loop serves other sessions.
+    :param fh_ssh: AsyncSSH session created via previous call to AsyncSSH.open
+    :param aux_srv: The IP address of the server hosting nuttcp
+    :return: The bandwidth and ipde-rla bandwidth commands matching the results, False when
+             the calibration failed
+    """
+    if not await cli_nav(fh_ssh, 'ana2-client'):
+        return False
+    p_trace(f'Be patient for approx 5 min, performing ana2-client link calibration against {aux_srv}')
+
+    parser = CalibrationParser(fh_ssh.sys_name)
+    stream = fh_ssh.stream(calibration_cmd(aux_srv))
+    async for line in stream:
+        parser.feed(line)
+
+    if not stream.result:
+        return False
+    return parser.cmds()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+import os
+import time
+from contextlib import contextmanager
+from functools import partial
+import ssh_drv
+import ssh_lib
+import fact_cache
+import fleet
+import inventory
+import ssh_profile
+from sinks import open_sink
+from cmn_lib import p_trace, load_config
+
+"""
+A read only audit of Adaptiv Networks 7.X CPEs.
+
+The collectors chosen in the audit section of config.yml run against every CPE of the
+inventory, fleet.workers CPEs at a time. Each CPE's facts are written to the output file as
+soon as the CPE is done, one row per CPE and one column per fact, see sinks.py.
+
+The output format follows the output file extension: .csv, .jsonl or .db (SQLite). An
+SQLite database can hold successive audits, every row carries the time it was collected.
+"""
+
+# The columns of every row, ahead of the facts
+RECORD_COLUMNS = ['host', 'ts', 'result', 'step', 'error', 'duration']
+
+
+class Collector(object):
+    """
+    A named set of facts gathered from a CPE
+    """
+
+    def __init__(self, name, columns, collect):
+        """
+        :param name: The name the collector is chosen by in config.yml
+        :param columns: The names of the facts returned by collect
+        :param collect: A callable taking an opened SSH session, returning a dict of facts
+                        or False when the facts could not be gathered
+        """
+        self.name = name
+        self.columns = columns
+        self.collect = collect
+
+
+def _schema_collector(name, schema, get):
+    """
+    :return: A Collector of the objects of a show command parsed with schema, one column per object
+    """
+    columns = [f'{name}.{obj}' for obj in schema.obj_names]
+
+    def collect(ssh):
+        parsed = get(ssh)
+        if not parsed:
+            return False
+        return {f'{name}.{obj}': '; '.join(parsed[obj]) for obj in schema.obj_names if obj in parsed}
+    return Collector(name, columns, collect)
+
+
+def _version(ssh):
+    version = ssh_lib.cli_get_ver(ssh)
+    return {'version': version} if version else False
+
+
+def _underlays(ssh):
+    underlays = ssh_lib.cli_get_underlay_info(ssh)
+    return {'underlays': underlays} if underlays is not None else False
+
+
+COLLECTORS = {collector.name: collector for collector in [
+    Collector('version', ['version'], _version),
+    _schema_collector('ana2_tunnel', ssh_lib.ANA2_TUNNEL_SCHEMA, ssh_lib.cli_get_ana2_tunnel),
+    _schema_collector('ana2_server', ssh_lib.ANA2_SERVER_SCHEMA, ssh_lib.cli_get_ana2_server),
+    _schema_collector('dhcp_link1', ssh_lib.DHCP_PROF_SCHEMA, lambda ssh: ssh_lib.cli_get_dhcp_prof(ssh, 'dhcp-link1')),
+    _schema_collector('dhcp_link2', ssh_lib.DHCP_PROF_SCHEMA, lambda ssh: ssh_lib.cli_get_dhcp_prof(ssh, 'dhcp-link2')),
+    Collector('underlays', ['underlays'], _underlays),
+]}
+
+
+def audit_cpe(ne, ne_conf, collectors, cache=None):
+    """
+    Gather the facts of a single CPE. Nothing is changed on the CPE.
+    :param ne: The IP address of the CPE
+    :param ne_conf: The parsed config.yml
+    :param collectors: The list of Collector to run, in order
+    :param cache: Optional fact_cache.FactCache the collectors take unchanged facts from
+    :return: A dict with the result, the last step reached and the facts, see fleet.run_task
+    """
+    with ssh_drv.SSH() as ssh:
+        if not ssh_lib.open_cpe(ssh, ne, ne_conf, fact_cache=cache):
+            p_trace(f'Unable to log into host {ne}', 'ERROR')
+            return {'result': False, 'step': 'connect'}
+
+        record = {'result': True, 'step': 'done'}
+        for collector in collectors:
+            facts = collector.collect(ssh)
+            if not facts:
+                p_trace(f'Unable to collect {collector.name} from CPE {ne}', 'ERROR')
+                record.update(result=False, step=collector.name)
+                break
+            record.update(facts)
+    return record
+
+
+@contextmanager
+def audit_task(ne_conf, names):
+    """
+    The audit task of a fleet run, see fleet.run_sharded. Entered once per process, each having
+    its own fact cache connection.
+    :param ne_conf: The parsed config.yml
+    :param names: The names of the collectors to run, in order
+    :return: A context manager yielding the task, taking a target
+    """
+    collectors = [COLLECTORS[name] for name in names]
+    cache = fact_cache.open_cache(ne_conf.get('fact_cache'))
+    try:
+        yield lambda ne: audit_cpe(ne, ne.conf(ne_conf), collectors, cache=cache)
+    finally:
+        if cache:
+            cache.close()
+
+
+def main(yaml_file='./config.yml'):
+    """
+    :param yaml_file: The config file
+    :return: True or False based on the over all result
+    """
+    ne_conf = load_config(yaml_file)
+
+    audit_conf = ne_conf.get('audit', {})
+    names = audit_conf.get('collectors') or list(COLLECTORS)
+    unknown = [name for name in names if name not in COLLECTORS]
+    if unknown:
+        p_trace(f'Unknown audit collectors {unknown}, expected some of {list(COLLECTORS)}', 'ERROR')
+        return False
+    collectors = [COLLECTORS[name] for name in names]
+    columns = RECORD_COLUMNS + [column for collector in collectors for column in collector.columns]
+
+    try:
+        ssh_profile.apply_profile(ne_conf)
+    except ValueError as error:
+        p_trace(str(error), 'ERROR')
+        return False
+
+    fleet_conf = ne_conf.get('fleet', {})
+    network_entities = inventory.load_inventory(ne_conf['network_entities'],
+                                                os.path.dirname(os.path.abspath(yaml_file)))
+    output = audit_conf.get('output', './audit.csv')
+    try:
+        sink = open_sink(output, columns)
+    except ValueError as error:
+        p_trace(str(error), 'ERROR')
+        return False
+
+    def on_result(record):
+        record['host'] = str(record['host'])
+        record['ts'] = time.time()
+        sink.write(record)
+
+    try:
+        run = fleet.run_sharded(network_entities, partial(audit_task, ne_conf, names), fleet_conf.get('processes', 1),
+                                fleet_conf.get('workers', 1), on_result=on_result, keep_records=False)
+    except ValueError as error:
+        p_trace(f'Audit aborted - {error}', 'ERROR')
+        return False
+    finally:
+        sink.close()
+
+    p_trace(f'Audit of {run.total} CPEs written to {output}', 'PASS')
+    return run.result
+
+
+if __name__ == "__main__":
+
+    result = main()
+    if result:
+        exit(0)
+    else:
+        exit(1)
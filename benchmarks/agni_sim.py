@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+import argparse
+import errno
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import paramiko
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cmn_lib import p_trace
+
+"""
+A local SSH server emulating the AgniOS shell of an Adaptiv Networks 7.X CPE.
+
+Every listening port is one simulated CPE with its own credentials and config state, so
+ssh_drv.SSH and agonyless workflows can be exercised and benchmarked without real devices.
+Supported: the welcome banner, monitor/Admin/node/diag prompts, the admin and diag password
+challenges, set password, save config all with its confirmations, show version/uptime/profile,
+the calibrate debug-qoe output and a 'show log' of configurable size. A fixed latency can be
+added to every response.
+
+Run standalone to serve CPEs on consecutive ports: python agni_sim.py --count 10 --port 2200
+"""
+
+NODES = ['system', 'ana2-client', 'ana2-server', 'dhcp-client']
+VERSION = '7.2.1-RELEASE'
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# The logger of the server side transports
+TRANSPORT_LOG = 'agni_sim.transport'
+
+
+def _recording(file_name):
+    with open(os.path.join(DATA_DIR, file_name)) as recording:
+        return recording.read().splitlines()
+
+
+# Recorded 'show profile <name>' outputs, per CLI node
+PROFILES = {
+    'ana2-client': _recording('show_profile_ana.txt'),
+    'ana2-server': _recording('show_profile_ana2-server.txt'),
+    'dhcp-client': _recording('show_profile_dhcp-link1.txt'),
+}
+
+CALIBRATE_OUTPUT = [
+    'Starting ana2-client calibration against {aux_srv}',
+    'Max upload bandwidth established for link1 = 9500 Kbps',
+    '   9025 Kbps    95%    0.12%',
+    'Max download bandwidth established for link1 = 48000 Kbps',
+    '  45600 Kbps    95%    0.08%',
+    'Max upload bandwidth established for link2 = 4800 Kbps',
+    '   4560 Kbps    95%    0.31%',
+    'Max download bandwidth established for link2 = 24000 Kbps',
+    '  22800 Kbps    95%    0.22%',
+    'Calibration complete',
+]
+
+
+class SimCPE(object):
+    """
+    The persistent state of one simulated CPE, shared by all its sessions
+    """
+
+    def __init__(self, name, monitor_passwd='agni123', admin_passwd='agni123', diag_passwd='dp9747ST',
+                 latency=0.0, log_size=64 * 1024, calibrate_time=0.0):
+        self.name = name
+        self.passwords = {'monitor': monitor_passwd, 'admin': admin_passwd}
+        self.diag_passwd = diag_passwd
+        self.latency = latency
+        self.log_size = log_size
+        self.calibrate_time = calibrate_time
+        self.saved = 0
+        self.commands = 0
+        self.boot = time.time() - 12 * 86400 - 3 * 3600
+        self.lock = threading.Lock()
+
+    def reboot(self):
+        self.boot = time.time()
+
+    def uptime(self):
+        minutes = int(time.time() - self.boot) // 60
+        days, minutes = divmod(minutes, 1440)
+        hours, minutes = divmod(minutes, 60)
+        up = f'{days} day{"s" if days != 1 else ""}, ' if days else ''
+        up += f'{hours}:{minutes:02},' if hours else f'{minutes} min{"s" if minutes != 1 else ""},'
+        return f' 9:41AM  up {up} 1 user, load averages: 0.10, 0.08, 0.05'
+
+
+class SimServer(paramiko.ServerInterface):
+    """
+    The paramiko server interface of a simulated CPE, password auth as the monitor user only
+    """
+
+    def __init__(self, cpe):
+        self.cpe = cpe
+        self.shell_ready = threading.Event()
+
+    def check_auth_password(self, username, password):
+        if username == 'monitor' and password == self.cpe.passwords['monitor']:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell_ready.set()
+        return True
+
+
+class SimShell(object):
+    """
+    Emulates one AgniOS shell session on a channel
+    """
+
+    def __init__(self, cpe, channel):
+        self.cpe = cpe
+        self.channel = channel
+        self.level = 'monitor'
+        self.node = None
+        self.diag_return = None
+        self.buf = b''
+
+    def prompt(self):
+        name = self.cpe.name
+        if self.level == 'diag':
+            return f'root@{name}:~ # '
+        if self.level == 'monitor':
+            return f'{name}> '
+        if self.node:
+            return f'{name}-{self.node}# '
+        return f'{name}-Admin# '
+
+    def write(self, text):
+        self.channel.sendall(text.encode('utf-8'))
+
+    def write_lines(self, lines):
+        if lines:
+            self.write('\r\n'.join(lines) + '\r\n')
+
+    def readline(self, echo=True):
+        """
+        :param echo: When True the line is echoed back like a terminal does
+        :return: The next line typed by the client, None once the channel is closed
+        """
+        while b'\n' not in self.buf:
+            data = self.channel.recv(4096)
+            if not data:
+                return None
+            self.buf += data
+        line, self.buf = self.buf.split(b'\n', 1)
+        line = line.decode('utf-8').rstrip('\r')
+        self.write(f'{line}\r\n' if echo else '\r\n')
+        return line
+
+    def challenge(self, text, expected):
+        """
+        :return: True when the client answers the password challenge with expected
+        """
+        self.write(text)
+        answer = self.readline(echo=False)
+        return answer == expected
+
+    def run(self):
+        self.write(f'\r\nWelcome to Adaptiv Networks AgniOS\r\nVersion {VERSION} (build 4211)\r\n\r\n')
+        self.write(self.prompt())
+        while True:
+            cmd = self.readline()
+            if cmd is None:
+                break
+            cmd = cmd.strip()
+            with self.cpe.lock:
+                self.cpe.commands += 1
+            if self.cpe.latency:
+                time.sleep(self.cpe.latency)
+            if not self.execute(cmd):
+                break
+            self.write(self.prompt())
+        self.channel.close()
+
+    def execute(self, cmd):
+        """
+        Execute one command line
+        :return: False when the session ends
+        """
+        if not cmd:
+            return True
+        if cmd == 'exit':
+            if self.level == 'diag':
+                self.level, self.node = self.diag_return
+            elif self.node:
+                self.node = None
+            elif self.level == 'Admin':
+                self.level = 'monitor'
+            else:
+                return False
+        elif cmd == 'admin' and self.level == 'monitor':
+            if self.challenge('Admin Password: ', self.cpe.passwords['admin']):
+                self.level = 'Admin'
+            else:
+                self.write_lines(['% Authentication failed'])
+        elif cmd in ['diag', '/diag']:
+            if self.challenge('Password:', self.cpe.diag_passwd):
+                self.diag_return = (self.level, self.node)
+                self.level = 'diag'
+            else:
+                self.write_lines(['% Authentication failed'])
+        elif self.level == 'diag':
+            self.diag_cmd(cmd)
+        elif cmd.startswith('show '):
+            self.show(cmd[5:])
+        elif self.level == 'monitor':
+            self.write_lines([f'% Unknown command: {cmd}'])
+        elif cmd in NODES or cmd == 'Admin':
+            self.node = None if cmd == 'Admin' else cmd
+        elif cmd.startswith('set password '):
+            self.set_password(cmd.split())
+        elif cmd == 'save config all':
+            self.save_config()
+        elif cmd.startswith('set profile-ana2-client ANA calibrate '):
+            self.calibrate(cmd.split()[4])
+        elif cmd.startswith('set '):
+            self.write_lines(['OK'])
+        else:
+            self.write_lines([f'% Unknown command: {cmd}'])
+        return True
+
+    def show(self, what):
+        if what == 'version':
+            self.write_lines([f'AgniOS Version {VERSION} (build 4211) {self.cpe.name}'])
+        elif what == 'uptime':
+            self.write_lines([self.cpe.uptime()])
+        elif what == 'profile all':
+            if self.node == 'dhcp-client':
+                self.write_lines(['dhcp-link1', 'dhcp-link2'])
+            else:
+                self.write_lines(['ANA'])
+        elif what.startswith('profile ') and self.node in PROFILES:
+            self.write_lines(PROFILES[self.node])
+        elif what == 'log':
+            lines = []
+            total = 0
+            i = 0
+            while total < self.cpe.log_size:
+                line = (f'Jan  1 00:{i // 60 % 60:02d}:{i % 60:02d} {self.cpe.name} ana2c[411]: '
+                        f'link{i % 2 + 1} rtt {i % 97} ms')
+                lines.append(line)
+                total += len(line) + 2
+                i += 1
+                if len(lines) >= 512:
+                    self.write_lines(lines)
+                    lines = []
+            self.write_lines(lines)
+        else:
+            self.write_lines([f'% Unknown command: show {what}'])
+
+    def set_password(self, args):
+        if len(args) != 5 or args[2] not in self.cpe.passwords:
+            self.write_lines(['% Invalid arguments'])
+            return
+        user, old, new = args[2:5]
+        if not self.challenge('Admin Password: ', self.cpe.passwords['admin']):
+            self.write_lines(['% Authentication failed'])
+            return
+        with self.cpe.lock:
+            if self.cpe.passwords[user] != old:
+                self.write_lines(['% Old password does not match'])
+                return
+            self.cpe.passwords[user] = new
+        self.write_lines([f'Password for user {user} changed'])
+
+    def save_config(self):
+        self.write('Save the running configuration (Yes/No) ?')
+        if self.readline() not in ['y', 'yes']:
+            return
+        self.write('Proceed with saveconfig ? ')
+        if self.readline() != 'yes':
+            return
+        with self.cpe.lock:
+            self.cpe.saved += 1
+        self.write_lines(['Configuration saved'])
+
+    def calibrate(self, aux_srv):
+        step = self.cpe.calibrate_time / len(CALIBRATE_OUTPUT)
+        for line in CALIBRATE_OUTPUT:
+            if step:
+                time.sleep(step)
+            self.write_lines([line.format(aux_srv=aux_srv)])
+
+    def diag_cmd(self, cmd):
+        if 'ana2.conf' in cmd:
+            self.write_lines(['self 10.1.1.2 link1', 'self 10.1.2.2 link2'])
+        else:
+            self.write_lines([f'{cmd.split()[0]}: Command not found.'])
+
+
+class _ResetFilter(logging.Filter):
+    """
+    Drops the socket exception a transport logs when the client resets the connection, the way
+    a client closing with unread data ends its session
+    """
+
+    RESET = f'Socket exception: {os.strerror(errno.ECONNRESET)} ({errno.ECONNRESET})'
+
+    def filter(self, record):
+        return record.getMessage() != self.RESET
+
+
+logging.getLogger(TRANSPORT_LOG).addFilter(_ResetFilter())
+
+
+class SimFleet(object):
+    """
+    Serves a number of simulated CPEs, one listening port each, from background threads
+    """
+
+    host_key = None
+
+    def __init__(self, count=1, base_port=0, name='CPE', **cpe_args):
+        """
+        :param count: The number of simulated CPEs
+        :param base_port: The port of the first CPE, 0 picks free ports
+        :param name: The system name prefix, the CPE index is appended
+        :param cpe_args: Passed to every SimCPE, eg latency or log_size
+        """
+        if SimFleet.host_key is None:
+            SimFleet.host_key = paramiko.RSAKey.generate(2048)
+        self.cpes = []
+        self.sockets = []
+        self.running = True
+        for i in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('127.0.0.1', base_port + i if base_port else 0))
+            sock.listen(128)
+            cpe = SimCPE(f'{name}{i:04d}', **cpe_args)
+            cpe.port = sock.getsockname()[1]
+            self.cpes.append(cpe)
+            self.sockets.append(sock)
+            threading.Thread(target=self._accept, args=(sock, cpe), daemon=True).start()
+
+    @property
+    def ports(self):
+        return [cpe.port for cpe in self.cpes]
+
+    def _accept(self, sock, cpe):
+        while self.running:
+            try:
+                client, addr = sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._session, args=(client, cpe), daemon=True).start()
+
+    def _session(self, client, cpe):
+        transport = paramiko.Transport(client)
+        transport.set_log_channel(TRANSPORT_LOG)
+        transport.add_server_key(self.host_key)
+        server = SimServer(cpe)
+        try:
+            transport.start_server(server=server)
+        except (paramiko.SSHException, EOFError, OSError):
+            return
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is None:
+                continue
+            threading.Thread(target=self._shell, args=(server, cpe, channel), daemon=True).start()
+
+    def _shell(self, server, cpe, channel):
+        if not server.shell_ready.wait(10):
+            channel.close()
+            return
+        server.shell_ready.clear()
+        try:
+            SimShell(cpe, channel).run()
+        except (OSError, EOFError, paramiko.SSHException):
+            pass
+
+    def close(self):
+        self.running = False
+        for sock in self.sockets:
+            sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve simulated AgniOS CPEs')
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('--port', type=int, default=2200, help='port of the first CPE')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--log-size', type=int, default=64 * 1024, help='bytes returned by show log')
+    args = parser.parse_args()
+
+    fleet = SimFleet(args.count, args.port, latency=args.latency, log_size=args.log_size)
+    p_trace(f'Serving {args.count} simulated CPEs on 127.0.0.1 ports {fleet.ports[0]}-{fleet.ports[-1]}', 'PASS')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fleet.close()
+
+
+if __name__ == '__main__':
+    main()
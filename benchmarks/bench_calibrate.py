@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import calibrate
+import fleet
+from cmn_lib import trace_setup
+from inventory import Target
+from agni_sim import SimFleet
+
+"""
+Benchmark of calibrate.py scheduling calibrations of agni_sim CPEs over aux servers.
+
+Every simulated calibration takes --calibrate-time seconds. The wall time of the run is
+compared with the serial time (CPEs x calibrate time) and the ideal time (CPEs / total
+capacity x calibrate time), and the peak number of calibrations per aux server is checked
+against its capacity.
+"""
+
+
+class PeakAuxServers(calibrate.AuxServers):
+    """
+    AuxServers keeping the peak number of calibrations per server
+    """
+
+    def __init__(self, servers, capacity=1):
+        super().__init__(servers, capacity)
+        self.peak = dict.fromkeys(self.capacity, 0)
+
+    def acquire(self):
+        host = super().acquire()
+        with self.condition:
+            self.peak[host] = max(self.peak[host], self.active[host])
+        return host
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cpes', type=int, default=24, help='number of simulated CPEs')
+    parser.add_argument('--servers', type=int, default=2, help='number of aux servers')
+    parser.add_argument('--capacity', type=int, default=3, help='calibrations per aux server')
+    parser.add_argument('--calibrate-time', type=float, default=1.0, help='seconds per calibration')
+    args = parser.parse_args()
+
+    trace_setup(level='ERROR')
+    servers = PeakAuxServers([f'192.168.110.{i + 2}' for i in range(args.servers)], args.capacity)
+    with SimFleet(args.cpes, calibrate_time=args.calibrate_time) as sim:
+        ne_conf = {'credentials': {'uname': 'monitor', 'monitor': 'agni123', 'admin': 'agni123', 'role': 'cpe'}}
+        targets = [Target('127.0.0.1', {'port': port}) for port in sim.ports]
+        start = time.perf_counter()
+        run = fleet.run_fleet(targets, lambda ne: calibrate.calibrate_cpe(ne, ne.conf(ne_conf), servers),
+                              servers.total_capacity, keep_records=False)
+        wall = time.perf_counter() - start
+        saved = sum(cpe.saved for cpe in sim.cpes)
+
+    serial = args.cpes * args.calibrate_time
+    ideal = -(-args.cpes // servers.total_capacity) * args.calibrate_time
+    print(f'{args.cpes} CPEs, {args.servers} aux servers x {args.capacity}: {run.passed} passed, {saved} saved')
+    print(f'wall {wall:.1f}s / ideal {ideal:.1f}s / serial {serial:.1f}s')
+    print(f'calibrations per server {servers.completed}, peak {servers.peak}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ssh_lib
+
+"""
+Benchmark of the ssh_lib show output parsers against the recorded 'show profile' outputs
+found in benchmarks/data.
+
+The compiled CliSchema parser is compared with the original per line regex parser that
+cli_get_resp used to run.
+"""
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+RECORDINGS = [
+    ('show_profile_ana.txt', ssh_lib.ANA2_TUNNEL_SCHEMA),
+    ('show_profile_ana2-server.txt', ssh_lib.ANA2_SERVER_SCHEMA),
+    ('show_profile_dhcp-link1.txt', ssh_lib.DHCP_PROF_SCHEMA),
+]
+
+
+def legacy_parse(lines, obj_names):
+    """
+    The original cli_get_resp parsing loop, kept as the baseline. Consumes obj_names.
+    """
+    output_parsed = {}
+    for line in lines:
+        if line.startswith('---'):
+            continue
+        line = re.sub(r'([\[\]])', ' ', line)
+        line = line.strip()
+        for obj in obj_names:
+            obj_key = obj
+            if line.startswith(obj):
+                obj_data = []
+                update = True
+                obj_names.pop(0)
+                break
+            else:
+                update = False
+                break
+
+        obj = re.sub(r'([\(\)])', r'\\\1', obj)
+        m = re.search(f'(^{obj} *:)(.*)', line)
+        if m:
+            value = m.group(m.lastindex)
+        else:
+            value = re.sub(r'(^: )', '', line)
+
+        if len(value) > 0:
+            obj_data.append(value.strip())
+        if update:
+            output_parsed.update({obj_key: obj_data})
+
+    return output_parsed
+
+
+def bench(name, func, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = func()
+    elapsed = time.perf_counter() - start
+    print(f'{name:>40}: {elapsed / rounds * 1e6:>8.1f} us/parse')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=5000)
+    args = parser.parse_args()
+
+    for file_name, schema in RECORDINGS:
+        with open(os.path.join(DATA_DIR, file_name)) as recording:
+            lines = recording.read().splitlines()
+        old = bench(f'legacy {file_name}', lambda: legacy_parse(lines, list(schema.obj_names)), args.rounds)
+        new = bench(f'schema {file_name}', lambda: schema.parse(lines), args.rounds)
+        if old != new:
+            print(f'WARNING: the parsers disagree on {file_name}')
+
+
+if __name__ == '__main__':
+    main()
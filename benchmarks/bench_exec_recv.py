@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+import argparse
+import os
+import re
+import sys
+import time
+import paramiko
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ssh_drv
+
+"""
+Throughput benchmark of the standard (exec_command) mode of ssh_drv.SSH.send on
+multi-megabyte outputs, like a large 'cat' or 'dmesg' on a Linux/Cygwin host.
+
+The current reader, which drains the channel in bulk, is compared with the original loop
+that alternated stdout.readline() and stderr.readline() on paramiko's file objects.
+"""
+
+
+class FakeExecChannel(object):
+    """
+    Stand-in for an exec paramiko Channel whose command already wrote all of its output
+    """
+
+    def __init__(self, stdout, stderr):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.out_pos = 0
+        self.err_pos = 0
+        self.eof_received = True
+        self.closed = False
+
+    def recv_ready(self):
+        return self.out_pos < len(self.stdout)
+
+    def recv_stderr_ready(self):
+        return self.err_pos < len(self.stderr)
+
+    def exit_status_ready(self):
+        return True
+
+    def recv(self, nbytes):
+        chunk = self.stdout[self.out_pos:self.out_pos + nbytes]
+        self.out_pos += len(chunk)
+        return chunk
+
+    def recv_stderr(self, nbytes):
+        chunk = self.stderr[self.err_pos:self.err_pos + nbytes]
+        self.err_pos += len(chunk)
+        return chunk
+
+
+class FakeChannelFile(paramiko.BufferedFile):
+    """
+    paramiko's buffered file, the baseline reads lines through it just like ChannelFile
+    """
+
+    def __init__(self, channel, stderr=False):
+        paramiko.BufferedFile.__init__(self)
+        self.channel = channel
+        self.stderr = stderr
+        self._set_mode('r')
+
+    def _read(self, size):
+        if self.stderr:
+            return self.channel.recv_stderr(size)
+        return self.channel.recv(size)
+
+
+class FakeClient(object):
+
+    def __init__(self, stdout, stderr):
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def exec_command(self, cmd):
+        channel = FakeExecChannel(self.stdout, self.stderr)
+        return None, FakeChannelFile(channel), FakeChannelFile(channel, True)
+
+
+def legacy_send(ssh, cmd):
+    """
+    The original readline based loop, kept as the baseline
+    """
+    ssh_response = []
+    stdin, stdout, stderr = ssh.fh_ssh.exec_command(cmd)
+    while True:
+        standard_out = stdout.readline()
+        standard_error = stderr.readline()
+        if standard_out:
+            line = re.sub(r'\r', '', standard_out)
+            ssh_response.append(re.search(r"(.*)(\n)", line).group(1))
+        if standard_error:
+            ssh_response.append(re.search(r"(.*)(\r|\n)", standard_error).group(1))
+        if not standard_out and not standard_error:
+            break
+    return True, ssh_response
+
+
+def make_output(size):
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        line = f'[{i * 0.0131:>12.6f}] eth{i % 4}: rx {i * 1337} tx {i * 7331} drops {i % 7} overruns 0'
+        lines.append(line)
+        total += len(line) + 1
+        i += 1
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def bench(name, func, client, size):
+    ssh = ssh_drv.SSH()
+    ssh.fh_ssh = client
+    start = time.perf_counter()
+    result = func(ssh)
+    elapsed = time.perf_counter() - start
+    print(f'{name:>8}: {len(result[1]):>8} lines {elapsed * 1000:>10.1f} ms {size / elapsed / 1e6:>8.2f} MB/s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=8 * 1024 * 1024, help='bytes of stdout')
+    args = parser.parse_args()
+
+    client = FakeClient(make_output(args.size), b'')
+    cmd = 'dmesg'
+    old = bench('legacy', lambda ssh: legacy_send(ssh, cmd), client, args.size)
+    # The per line trace would dominate the measurement, so it is suppressed
+    new = bench('bulk', lambda ssh: ssh.send(cmd, suppress_logs=True), client, args.size)
+    if old[1] != new[1]:
+        print('WARNING: the readers disagree on the output lines')
+
+
+if __name__ == '__main__':
+    main()
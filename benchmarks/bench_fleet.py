@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import argparse
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import agonyless
+import fleet
+import perf_lib
+import ssh_drv
+import ssh_lib
+from cmn_lib import trace_setup
+from agni_sim import SimFleet
+
+"""
+End to end benchmark of the fleet hot paths against simulated AgniOS CPEs.
+
+N CPEs are served by agni_sim on local ports, then a workflow is run across all of them
+through fleet.run_fleet. The fleet throughput, the per phase and per command latencies
+(from perf_lib) and the peak memory of the process are reported, so regressions can be
+caught without touching real devices.
+
+Workflows:
+    rotate - the agonyless password rotation (login, set password x2, verify, save config)
+    audit  - login, show version/uptime and the parsed ana2-client profile
+    log    - login and a large 'show log', sized with --log-size
+"""
+
+
+def rotate_task(conf):
+    def _task(port):
+        cpe_conf = dict(conf, credentials=dict(conf['credentials'], port=port))
+        return agonyless.rotate_cpe('127.0.0.1', cpe_conf)
+    return _task
+
+
+def audit_task(conf):
+    def _task(port):
+        creds = conf['credentials']
+        with ssh_drv.SSH() as ssh:
+            if not ssh.open('127.0.0.1', 'cpe', creds['uname'], creds['monitor'], port=port, role='cpe',
+                            admin_passwd=creds['admin']):
+                return {'result': False, 'step': 'connect'}
+            ssh_lib.cli_get_ver(ssh)
+            result = bool(ssh_lib.cli_get_ana2_tunnel(ssh))
+        return {'result': result, 'step': 'audit'}
+    return _task
+
+
+def log_task(conf):
+    def _task(port):
+        creds = conf['credentials']
+        with ssh_drv.SSH() as ssh:
+            if not ssh.open('127.0.0.1', 'cpe', creds['uname'], creds['monitor'], port=port, role='cpe'):
+                return {'result': False, 'step': 'connect'}
+            result, lines = ssh.send('show log', suppress_logs=True)
+        return {'result': result and len(lines) > 0, 'step': 'log'}
+    return _task
+
+
+WORKFLOWS = {'rotate': rotate_task, 'audit': audit_task, 'log': log_task}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workflow', choices=sorted(WORKFLOWS), default='rotate')
+    parser.add_argument('--cpes', type=int, default=20, help='number of simulated CPEs')
+    parser.add_argument('--workers', type=int, default=10, help='fleet workers')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every CPE response')
+    parser.add_argument('--log-size', type=int, default=1024 * 1024, help='bytes returned by show log')
+    parser.add_argument('--trace', default='ERROR', help='lowest trace level printed during the run')
+    args = parser.parse_args()
+
+    conf = {'credentials': {'uname': 'monitor', 'monitor': 'agni123', 'admin': 'agni123', 'role': 'cpe'},
+            'new_passwords': {'monitor': 'agni1234', 'admin': 'agni1234'}}
+
+    with SimFleet(args.cpes, latency=args.latency, log_size=args.log_size) as sim:
+        trace_setup(level=args.trace)
+        profile = perf_lib.enable_profiling()
+        start = time.perf_counter()
+        run = fleet.run_fleet(sim.ports, WORKFLOWS[args.workflow](conf), args.workers)
+        elapsed = time.perf_counter() - start
+        perf_lib.disable_profiling()
+        trace_setup()
+
+    print(f'\nworkflow {args.workflow}: {args.cpes} CPEs, {args.workers} workers, {args.latency}s latency')
+    print(f'{run.passed}/{run.total} passed in {elapsed:.2f}s : {run.total / elapsed:.2f} CPE/s')
+    print(f'peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB\n')
+    print(profile.report())
+
+
+if __name__ == '__main__':
+    main()
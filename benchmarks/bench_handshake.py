@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import perf_lib
+import ssh_drv
+import ssh_profile
+from cmn_lib import trace_setup
+from agni_sim import SimFleet
+
+"""
+Micro-benchmark of the SSH handshake (key exchange and authentication) of ssh_drv.SSH
+against agni_sim, per connection profile.
+
+Every profile logs in --rounds times. The p50/p95 of the TCP connect plus the handshake are reported,
+so the gain of password only auth, of the known hosts file and of each kex/cipher
+preference can be compared with paramiko's defaults.
+"""
+
+
+def profiles(known_hosts):
+    return [
+        ('paramiko defaults', None),
+        ('password only', ssh_profile.ConnectionProfile(password_only=True)),
+        ('+ known hosts', ssh_profile.ConnectionProfile(known_hosts=known_hosts, password_only=True)),
+        ('+ curve25519 / aes128-ctr', ssh_profile.ConnectionProfile(
+            known_hosts=known_hosts, password_only=True, kex=['curve25519-sha256@libssh.org'],
+            ciphers=['aes128-ctr'], macs=['hmac-sha2-256'])),
+        ('+ ecdh-nistp256 / aes128-ctr', ssh_profile.ConnectionProfile(
+            known_hosts=known_hosts, password_only=True, kex=['ecdh-sha2-nistp256'], ciphers=['aes128-ctr'])),
+        ('+ dh-group14 / aes256-ctr', ssh_profile.ConnectionProfile(
+            known_hosts=known_hosts, password_only=True, kex=['diffie-hellman-group14-sha256'],
+            ciphers=['aes256-ctr'])),
+        ('+ curve25519 / compression', ssh_profile.ConnectionProfile(
+            known_hosts=known_hosts, password_only=True, kex=['curve25519-sha256@libssh.org'], compress=True)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=30, help='handshakes per profile')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every CPE response')
+    args = parser.parse_args()
+
+    trace_setup(level='ERROR')
+    known_hosts = os.path.join(tempfile.mkdtemp(), 'known_hosts')
+    print(f'{"profile":<32} {"p50 (ms)":>10} {"p95 (ms)":>10} {"total (ms)":>12}')
+    with SimFleet(1, latency=args.latency) as sim:
+        for name, profile in profiles(known_hosts):
+            durations = []
+            for _ in range(args.rounds):
+                # One profile per login, the phases of a profile being aggregated
+                run = perf_lib.enable_profiling()
+                with ssh_drv.SSH() as ssh:
+                    ssh.open('127.0.0.1', 'cpe', 'monitor', 'agni123', port=sim.ports[0], role='cpe', profile=profile)
+                perf_lib.disable_profiling()
+                durations.append(run.phases['tcp_connect'].total + run.phases['ssh_handshake'].total)
+            durations.sort()
+            print(f'{name:<32} {perf_lib.percentile(durations, 50) * 1000:>10.1f} '
+                  f'{perf_lib.percentile(durations, 95) * 1000:>10.1f} {sum(durations) * 1000:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+"""
+Peak memory of holding large command outputs, in memory vs spilled to disk.
+
+agni_sim serves --sessions CPEs from its own process, each answering 'show log' with
+--log-size bytes. For every variant a fresh client process runs one 'show log' per CPE
+concurrently and keeps every output until all of them completed, as a fleet of workers
+parsing long outputs would. The peak RSS of the client once every output is held, the wall
+time and the line count are reported. The outputs are then read back once, so the cost of
+reading spilled lines is included in the time. Spilled lines are read through a memory map,
+whose pages count towards the RSS while they are read but are released by the kernel first.
+
+Variants:
+    memory - connection.output_spill empty, every output is a list in memory
+    spill  - the default connection.output_spill of output_buffer.SPILL_BYTES
+"""
+
+VARIANTS = {'memory': None, 'spill': 'default'}
+
+
+def client(ports, spill):
+    """
+    Run in the client process: one 'show log' per port, the outputs held until all completed
+    :return: A dict with the peak RSS in KiB once the outputs are held, the wall time and the
+             number of lines read back
+    """
+    import ssh_drv
+    from cmn_lib import trace_setup
+    trace_setup(level='ERROR')
+    connection = {} if spill == 'default' else {'output_spill': spill}
+    outputs = [None] * len(ports)
+
+    def _session(index, port):
+        with ssh_drv.SSH() as ssh:
+            if ssh.open('127.0.0.1', 'cpe', 'monitor', 'agni123', port=port, role='cpe', **connection):
+                outputs[index] = ssh.send('show log', suppress_logs=True)[1]
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=_session, args=(i, port)) for i, port in enumerate(ports)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    lines = sum(sum(1 for _ in output) for output in outputs if output)
+    elapsed = time.perf_counter() - start
+    return {'rss_kib': rss_kib, 'seconds': elapsed, 'lines': lines, 'failed': outputs.count(None)}
+
+
+def wait_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=4, help='concurrent sessions, one simulated CPE each')
+    parser.add_argument('--log-size', type=int, default=32 * 1024 * 1024, help='bytes returned by show log')
+    parser.add_argument('--port', type=int, default=2300, help='port of the first simulated CPE')
+    parser.add_argument('--client', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    ports = list(range(args.port, args.port + args.sessions))
+
+    if args.client:
+        print(json.dumps(client(ports, VARIANTS[args.client])))
+        return True
+
+    sim = subprocess.Popen([sys.executable, os.path.join(ROOT, 'benchmarks', 'agni_sim.py'), '--count',
+                            str(args.sessions), '--port', str(args.port), '--log-size', str(args.log_size)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = True
+    try:
+        if not wait_port(ports[-1]):
+            print('agni_sim did not start')
+            return False
+        print(f'{args.sessions} sessions, show log of {args.log_size / 1024 / 1024:.1f} MiB each')
+        for variant in VARIANTS:
+            output = subprocess.run([sys.executable, __file__, '--client', variant, '--sessions', str(args.sessions),
+                                     '--port', str(args.port)], capture_output=True, text=True, check=True).stdout
+            stats = json.loads(output.strip().splitlines()[-1])
+            print(f'{variant:<8} peak RSS {stats["rss_kib"] / 1024:>8.1f} MiB  {stats["seconds"]:>7.2f} s  '
+                  f'{stats["lines"]:>9} lines  {stats["failed"]} failed')
+            result = result and not stats['failed']
+    finally:
+        sim.terminate()
+        sim.wait()
+    return result
+
+
+if __name__ == '__main__':
+    exit(0 if main() else 1)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ssh_drv
+import ssh_lib
+import transcript
+from cmn_lib import trace_setup
+from agni_sim import SimFleet
+
+"""
+Benchmark of the raw (AgniOS) receive loop and the ssh_lib parsers, replayed from a session
+transcript at full speed.
+
+A session running the workflow below is recorded against agni_sim, or taken from --transcript
+when a recording of the same workflow against a real CPE is available. The transcript is then
+replayed --rounds times with no network, so the time measured is the time spent in
+RawResponse, cli_nav, CliSchema and the calibrate_links regexes.
+"""
+
+
+def workflow(ssh):
+    """
+    The commands recorded and replayed
+    :param ssh: An opened SSH session, live or replayed
+    :return: True when every step passed
+    """
+    result = bool(ssh_lib.cli_get_ver(ssh))
+    result &= bool(ssh_lib.cli_get_ana2_tunnel(ssh))
+    result &= bool(ssh_lib.cli_get_ana2_server(ssh))
+    result &= bool(ssh_lib.cli_get_dhcp_prof(ssh, 'dhcp-link1'))
+    result &= ssh.send('show log', True)[0]
+    # calibrate_links prints the commands it would apply
+    with contextlib.redirect_stdout(io.StringIO()):
+        result &= ssh_lib.calibrate_links(ssh)
+    return result
+
+
+def record(path, log_size):
+    with SimFleet(1, log_size=log_size) as sim:
+        start = time.perf_counter()
+        with ssh_drv.SSH() as ssh:
+            ssh.open('127.0.0.1', 'cpe', 'monitor', 'agni123', port=sim.ports[0], role='cpe', transcript=path)
+            result = workflow(ssh)
+        return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transcript', help='replay this recording instead of recording one against agni_sim')
+    parser.add_argument('--rounds', type=int, default=20, help='number of replays')
+    parser.add_argument('--log-size', type=int, default=1024 * 1024, help='bytes returned by show log')
+    args = parser.parse_args()
+
+    trace_setup(level='ERROR')
+    path = args.transcript
+    if not path:
+        path = os.path.join(tempfile.mkdtemp(), 'bench.transcript')
+        result, live = record(path, args.log_size)
+        print(f'recorded live against agni_sim in {live:.3f}s, result {result}')
+
+    meta, frames = transcript.read_transcript(path)
+    received = sum(len(data) for kind, offset, data in frames if kind == transcript.RECV)
+    print(f'{path}: {len(frames)} frames, {received} bytes received, {os.path.getsize(path)} bytes on disk')
+
+    timings = []
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        with ssh_drv.SSH() as ssh:
+            ssh.open(meta.get('host_id', 'replay'), 'cpe', 'monitor', 'agni123', role='cpe', replay=path)
+            result = workflow(ssh)
+        timings.append(time.perf_counter() - start)
+        if not result:
+            print('replay failed')
+            break
+
+    timings.sort()
+    best = timings[0]
+    print(f'replay x{len(timings)}: best {best:.4f}s, median {timings[len(timings) // 2]:.4f}s, '
+          f'{received / best / 1e6:.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
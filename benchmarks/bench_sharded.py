@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from contextlib import contextmanager
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fleet
+import ssh_drv
+import ssh_lib
+from cmn_lib import trace_setup
+from inventory import Target
+from agni_sim import SimFleet
+
+"""
+Benchmark of fleet.run_sharded: the same workflow run with 1, 2, ... --processes worker
+processes, against agni_sim CPEs served from --sim-processes other processes so the simulated
+CPEs don't compete with the fleet for the same core.
+
+Workflows:
+    audit - login, show version/uptime and the parsed ana2-client profile
+    log   - login and a large 'show log', sized with --log-size
+"""
+
+
+def audit(ssh):
+    ssh_lib.cli_get_ver(ssh)
+    return bool(ssh_lib.cli_get_ana2_tunnel(ssh))
+
+
+def log(ssh):
+    result, lines = ssh.send('show log', suppress_logs=True)
+    return result and len(lines) > 0
+
+
+WORKFLOWS = {'audit': audit, 'log': log}
+
+
+@contextmanager
+def bench_task(workflow):
+    def _task(ne):
+        with ssh_drv.SSH() as ssh:
+            if not ssh.open(str(ne), 'cpe', 'monitor', 'agni123', port=ne.overrides['port'], role='cpe',
+                            admin_passwd='agni123'):
+                return {'result': False, 'step': 'connect'}
+            return {'result': WORKFLOWS[workflow](ssh), 'step': workflow}
+
+    yield _task
+
+
+def serve(count, log_size, conn):
+    with SimFleet(count, log_size=log_size) as sim:
+        conn.send(sim.ports)
+        conn.recv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workflow', choices=sorted(WORKFLOWS), default='audit')
+    parser.add_argument('--cpes', type=int, default=64, help='number of simulated CPEs')
+    parser.add_argument('--workers', type=int, default=16, help='fleet workers per process')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='max fleet processes')
+    parser.add_argument('--sim-processes', type=int, default=4, help='processes serving the CPEs')
+    parser.add_argument('--log-size', type=int, default=256 * 1024, help='bytes returned by show log')
+    args = parser.parse_args()
+
+    trace_setup(level='ERROR')
+    context = multiprocessing.get_context('spawn')
+    servers = []
+    ports = []
+    for i in range(args.sim_processes):
+        count = args.cpes // args.sim_processes + (i < args.cpes % args.sim_processes)
+        conn, child_conn = context.Pipe()
+        server = context.Process(target=serve, args=(count, args.log_size, child_conn), daemon=True)
+        server.start()
+        servers.append((server, conn))
+        ports += conn.recv()
+
+    print(f'workflow {args.workflow}: {args.cpes} CPEs, {args.workers} workers per process, '
+          f'{os.cpu_count()} cores')
+    processes = 1
+    while processes <= args.processes:
+        targets = [Target('127.0.0.1', {'port': port}) for port in ports]
+        start = time.perf_counter()
+        run = fleet.run_sharded(targets, partial(bench_task, args.workflow), processes, args.workers,
+                                keep_records=False)
+        elapsed = time.perf_counter() - start
+        print(f'{processes:>3} processes: {run.passed}/{run.total} passed in {elapsed:.2f}s : '
+              f'{run.total / elapsed:.2f} CPE/s')
+        processes *= 2
+
+    for server, conn in servers:
+        conn.send(None)
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
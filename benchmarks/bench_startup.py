@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+"""
+Startup time of the agonyless command line, per subcommand.
+
+Each subcommand is started --rounds times in a fresh interpreter, up to the point where it
+would read its config: the modules it needs are imported, nothing runs. The median wall time is
+reported along with whether paramiko got loaded. The script fails when a subcommand that
+never opens an SSH session loads paramiko, or is slower than --max-ms.
+"""
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# The subcommands that never open an SSH session
+LIGHT = ['help', 'preflight', 'dry-run']
+
+PROBE = '''
+import sys
+sys.path.insert(0, {root!r})
+import cli
+command = {command!r}
+if command == 'help':
+    try:
+        cli.main(['--help'])
+    except SystemExit:
+        pass
+elif command != 'cli':
+    # The import done by the subcommand handler, without running its main
+    __import__({{'rotate': 'agonyless', 'dry-run': 'dry_run'}}.get(command, command))
+print('paramiko' in sys.modules)
+'''
+
+
+def measure(command, rounds):
+    """
+    :return: The sorted wall times in seconds and whether paramiko was loaded
+    """
+    timings = []
+    loaded = False
+    code = PROBE.format(root=ROOT, command=command)
+    for _ in range(rounds):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        timings.append(time.perf_counter() - start)
+        loaded = output.strip().splitlines()[-1] == 'True'
+    return sorted(timings), loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=10, help='interpreter starts per subcommand')
+    parser.add_argument('--max-ms', type=float, default=0,
+                        help='fail when a light subcommand takes longer, 0 for no limit')
+    args = parser.parse_args()
+
+    baseline, _ = measure('cli', args.rounds)
+    print(f'{"import cli":<12} {statistics.median(baseline) * 1000:>8.1f} ms')
+    result = True
+    for command in ['help', 'preflight', 'dry-run', 'audit', 'calibrate', 'rotate']:
+        timings, loaded = measure(command, args.rounds)
+        median = statistics.median(timings) * 1000
+        print(f'{command:<12} {median:>8.1f} ms  paramiko {"loaded" if loaded else "not loaded"}')
+        if command in LIGHT and (loaded or (args.max_ms and median > args.max_ms)):
+            print(f'  regression: {command} should start without paramiko and within {args.max_ms} ms')
+            result = False
+    return result
+
+
+if __name__ == '__main__':
+    exit(0 if main() else 1)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+import os
+import threading
+import time
+from contextlib import contextmanager
+import sinks
+import fact_cache
+import fleet
+import inventory
+import ssh_drv
+import ssh_lib
+import ssh_profile
+from cmn_lib import p_trace, load_config, trace_flush
+
+"""
+Calibration of the underlay links of Adaptiv Networks 7.X CPEs, across the inventory.
+
+A calibration measures the links of a CPE against a nuttcp server (an aux server) for approx
+5 min. Calibrations sharing a server contend for it and skew each other's results, so every
+aux server of the calibration section runs at most its capacity of calibrations at a time,
+and each calibration goes to the least loaded server. The bandwidth commands resulting from a
+calibration are applied to the CPE in one batch, then the config is saved.
+
+A region of N CPEs takes approx N / (total capacity) x 5 min.
+"""
+
+# The columns of every row of the output file
+RECORD_COLUMNS = ['host', 'ts', 'result', 'step', 'error', 'duration', 'aux_srv', 'commands']
+
+
+class AuxServers(object):
+    """
+    The nuttcp servers calibrations run against, each running at most its capacity of
+    calibrations at a time. Shared by every fleet worker.
+    """
+
+    def __init__(self, servers, capacity=1):
+        """
+        :param servers: A list of server addresses, or of dicts with the host and its capacity
+        :param capacity: The capacity of the servers listed without one
+        """
+        self.capacity = {}
+        for server in servers:
+            if isinstance(server, dict):
+                self.capacity[str(server['host'])] = int(server.get('capacity', capacity))
+            else:
+                self.capacity[str(server)] = int(capacity)
+        if not self.capacity or min(self.capacity.values()) < 1:
+            raise ValueError(f'Expected at least one aux server with a capacity of 1 or more, got {servers}')
+        self.active = dict.fromkeys(self.capacity, 0)
+        self.completed = dict.fromkeys(self.capacity, 0)
+        self.condition = threading.Condition()
+
+    @property
+    def total_capacity(self):
+        return sum(self.capacity.values())
+
+    def acquire(self):
+        """
+        Wait for a free slot on any server
+        :return: The least loaded server, its slot taken
+        """
+        with self.condition:
+            while True:
+                free = [host for host in self.capacity if self.active[host] < self.capacity[host]]
+                if free:
+                    host = min(free, key=lambda h: (self.active[h] / self.capacity[h], self.completed[h]))
+                    self.active[host] += 1
+                    return host
+                self.condition.wait()
+
+    def release(self, host):
+        """
+        Free the slot taken on host
+        """
+        with self.condition:
+            self.active[host] -= 1
+            self.completed[host] += 1
+            self.condition.notify()
+
+    @contextmanager
+    def lease(self):
+        """
+        Take a slot for the duration of a with block, eg: with servers.lease() as aux_srv: ...
+        """
+        host = self.acquire()
+        try:
+            yield host
+        finally:
+            self.release(host)
+
+    def summary(self):
+        """
+        :return: A one line human readable summary of the calibrations per server
+        """
+        return 'Calibrations per aux server: ' + ', '.join(f'{host} {count}' for host, count in self.completed.items())
+
+
+def calibrate_cpe(ne, ne_conf, servers, cache=None, save=True):
+    """
+    Calibrate the links of a single CPE and apply the resulting bandwidth commands
+    :param ne: The IP address of the CPE
+    :param ne_conf: The parsed config.yml
+    :param servers: The AuxServers the calibration runs against
+    :param cache: Optional fact_cache.FactCache, the facts of the CPE are dropped once it is changed
+    :param save: When True the config is saved once the commands are applied
+    :return: A dict with the result, the last step reached, the aux server and the number of
+             commands applied, see fleet.run_task
+    """
+    with ssh_drv.SSH() as ssh:
+        # Log in first, so an unreachable CPE never holds an aux server slot
+        if not ssh_lib.open_cpe(ssh, ne, ne_conf, fact_cache=cache):
+            p_trace(f'Unable to log into host {ne}', 'ERROR')
+            return {'result': False, 'step': 'connect'}
+
+        # Only the measurement needs the aux server
+        with servers.lease() as aux_srv:
+            cmds = ssh_lib.cli_get_calibration(ssh, aux_srv)
+        if not cmds:
+            p_trace(f'Calibration of CPE {ne} against {aux_srv} failed', 'ERROR')
+            return {'result': False, 'step': 'calibrate', 'aux_srv': aux_srv}
+
+        if not ssh_lib.cli_apply_cmds(ssh, 'ana2-client', cmds):
+            p_trace(f'Aborting due to failure applying the calibrated bandwidths to CPE {ne}', 'ERROR')
+            return {'result': False, 'step': 'apply', 'aux_srv': aux_srv, 'commands': len(cmds)}
+
+        if save:
+            ssh_lib.cli_save_config(ssh)
+    return {'result': True, 'step': 'saved' if save else 'applied', 'aux_srv': aux_srv, 'commands': len(cmds)}
+
+
+def _confirm(workers, servers):
+    """
+    :return: True when the operator confirmed the calibration. No input, eg stdin closed, is a no.
+    """
+    trace_flush()
+    try:
+        prompt = input(f'About to calibrate and update every CPE of the inventory, {workers} at a time '
+                       f'against {len(servers.capacity)} aux servers. y to continue:\n')
+    except EOFError:
+        prompt = None
+    if prompt != 'y':
+        p_trace('Quitting')
+        return False
+    return True
+
+
+def main(yaml_file='./config.yml'):
+    """
+    :param yaml_file: The config file
+    :return: True or False based on the over all result
+    """
+    ne_conf = load_config(yaml_file)
+
+    calibration_conf = ne_conf.get('calibration', {})
+    try:
+        servers = AuxServers(calibration_conf.get('aux_servers') or ['192.168.110.2'],
+                             calibration_conf.get('capacity', 1))
+        ssh_profile.apply_profile(ne_conf)
+    except ValueError as error:
+        p_trace(str(error), 'ERROR')
+        return False
+
+    # More workers would only wait for an aux server while holding an SSH session
+    workers = servers.total_capacity
+    network_entities = inventory.load_inventory(ne_conf['network_entities'],
+                                                os.path.dirname(os.path.abspath(yaml_file)))
+    output = calibration_conf.get('output')
+    try:
+        sink = sinks.open_sink(output, RECORD_COLUMNS) if output else None
+    except ValueError as error:
+        p_trace(str(error), 'ERROR')
+        return False
+
+    if calibration_conf.get('confirm', True) and not _confirm(workers, servers):
+        if sink:
+            sink.close()
+        return False
+
+    cache = fact_cache.open_cache(ne_conf.get('fact_cache'))
+
+    def on_result(record):
+        if sink:
+            record['host'] = str(record['host'])
+            record['ts'] = time.time()
+            sink.write(record)
+
+    save = calibration_conf.get('save', True)
+    try:
+        run = fleet.run_fleet(network_entities,
+                              lambda ne: calibrate_cpe(ne, ne.conf(ne_conf), servers, cache=cache, save=save),
+                              workers, on_result=on_result, keep_records=False)
+    except ValueError as error:
+        p_trace(f'Calibration aborted - {error}', 'ERROR')
+        return False
+    finally:
+        if sink:
+            sink.close()
+        if cache:
+            cache.close()
+
+    p_trace(servers.summary(), 'PASS' if run.result else 'ERROR')
+    return run.result
+
+
+if __name__ == "__main__":
+
+    result = main()
+    if result:
+        exit(0)
+    else:
+        exit(1)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+import argparse
+import os
+
+"""
+The agonyless command line, eg: agonyless rotate -c ./config.yml
+
+Every subcommand imports the modules it runs only once it was chosen, so --help, preflight
+and dry-run start without loading paramiko. benchmarks/bench_startup.py keeps an eye on it.
+"""
+
+
+def _rotate(config):
+    import agonyless
+    return agonyless.main(config)
+
+
+def _audit(config):
+    import audit
+    return audit.main(config)
+
+
+def _calibrate(config):
+    import calibrate
+    return calibrate.main(config)
+
+
+def _preflight(config):
+    import preflight
+    return preflight.main(config)
+
+
+def _dry_run(config):
+    import dry_run
+    return dry_run.main(config)
+
+
+COMMANDS = {
+    'rotate': (_rotate, 'Update the monitor and admin passwords of every CPE, wave after wave'),
+    'audit': (_audit, 'Gather the facts of every CPE, read only'),
+    'calibrate': (_calibrate, 'Calibrate the underlay links of every CPE and apply the bandwidths'),
+    'preflight': (_preflight, 'Probe the SSH port of every CPE'),
+    'dry-run': (_dry_run, 'Check the config and list the waves of a rotation, without connecting'),
+}
+
+
+def main(argv=None):
+    """
+    :param argv: The command line arguments, sys.argv[1:] when None
+    :return: The exit status, 0 when the command succeeded
+    """
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-c', '--config', default='./config.yml', help='the config file (default: %(default)s)')
+    parser = argparse.ArgumentParser(prog='agonyless', description='Tool to interact with Adaptiv Networks 7.X CPEs')
+    commands = parser.add_subparsers(dest='command', metavar='command', required=True)
+    for name, (handler, description) in COMMANDS.items():
+        commands.add_parser(name, parents=[common], help=description, description=description)
+    args = parser.parse_args(argv)
+    if not os.path.isfile(args.config):
+        parser.error(f'config file {args.config} not found')
+
+    handler = COMMANDS[args.command][0]
+    return 0 if handler(args.config) else 1
+
+
+if __name__ == "__main__":
+
+    exit(main())
@@ -1,14 +1,31 @@
+import atexit
+import contextvars
+import json
+import os
+import queue
+import threading
 import time
-from colorama import Fore
+from collections import OrderedDict
+import yaml
 
+# Rank of each trace level. p_trace drops the levels ranked below the configured minimum.
+TRACE_LEVELS = {'DEBUG2': 5, 'DEBUG': 10, 'INFO': 20, 'SKIPPED': 20, 'TEST_CASE': 20, 'PASS': 20,
+                'WARNING': 30, 'ERROR': 40, 'FAIL': 40}
 
-def p_trace(string, level='INFO'):
+# The host the current thread or asyncio task is working on, used to route its traces
+trace_host = contextvars.ContextVar('trace_host', default=None)
+
+_min_rank = 0
+_min_level = 'DEBUG2'
+_writer = None
+
+
+def _format(string, level):
     """
-    Helper function to standardize look of local script prints
-    :param string: The string to be printed
-    :param level: The trace level
-    :return: natta
+    :return: The string coloured according to its trace level
     """
+    # Only loaded once a trace is printed
+    from colorama import Fore
     out_string = ""
 
     if level == 'ERROR' or level == 'FAIL':
@@ -21,7 +38,252 @@ def p_trace(string, level='INFO'):
         out_string = Fore.GREEN + string + Fore.RESET
     if level == 'INFO':
         out_string = string
+    return out_string
+
+
+def p_trace(string, level='INFO', host=None):
+    """
+    Helper function to standardize look of local script prints
+    :param string: The string to be printed
+    :param level: The trace level
+    :param host: The host the trace relates to, defaults to the one set with set_trace_host
+    :return: natta
+    """
+    if TRACE_LEVELS.get(level, 20) < _min_rank:
+        return
 
+    if _writer:
+        _writer.put((time.time(), level, string, host or trace_host.get()))
+        return
 
     ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-    print(f'{"=====> ":>15} {level} {ts} {out_string}')
+    print(f'{"=====> ":>15} {level} {ts} {_format(string, level)}')
+
+
+def trace_record(record):
+    """
+    Output a trace forwarded by another process, see trace_forward
+    :param record: The (ts, level, string, host) tuple of the trace
+    :return: natta
+    """
+    ts, level, string, host = record
+    if TRACE_LEVELS.get(level, 20) < _min_rank:
+        return
+
+    if _writer:
+        _writer.put(record)
+        return
+
+    ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+    host_str = f'[{host}] ' if host else ''
+    print(f'{"=====> ":>15} {level} {ts} {host_str}{_format(string, level)}')
+
+
+def trace_enabled(level='INFO'):
+    """
+    Lets hot paths skip building trace strings that p_trace would drop anyway
+    :param level: The trace level
+    :return: True when traces of that level are output
+    """
+    return TRACE_LEVELS.get(level, 20) >= _min_rank
+
+
+def set_trace_host(host):
+    """
+    Tag the traces of the current thread or asyncio task with host
+    :param host: The host being worked on, None to clear it
+    :return: A token for trace_host.reset
+    """
+    return trace_host.set(host)
+
+
+def trace_setup(level='DEBUG2', background=False, log_dir=None, json_lines=False, console=True):
+    """
+    Configure the p_trace backend. By default every trace is printed synchronously.
+    :param level: The lowest trace level output, see TRACE_LEVELS
+    :param background: When True traces are queued and written by a background thread
+    :param log_dir: When set, traces are also written to one file per host in this directory.
+                    Traces not related to a host go to agonyless.log.
+    :param json_lines: When True the log files hold one JSON object per trace
+    :param console: When False nothing is printed to the screen
+    :return: natta
+    """
+    global _min_rank, _min_level, _writer
+
+    if level not in TRACE_LEVELS:
+        raise ValueError(f'Unknown trace level {level}, expected one of {list(TRACE_LEVELS)}')
+    _min_rank = TRACE_LEVELS[level]
+    _min_level = level
+
+    if _writer:
+        _writer.close()
+        _writer = None
+    if background or log_dir or not console:
+        _writer = TraceWriter(log_dir, json_lines, console)
+
+
+def load_config(yaml_file, log_files=True):
+    """
+    Load config.yml and set the traces up from its logging section
+    :param yaml_file: The config file
+    :param log_files: When False the traces are only printed, eg for a dry run
+    :return: The parsed config
+    """
+    with open(yaml_file, 'r') as agony_yml:
+        ne_conf = yaml.load(agony_yml, Loader=getattr(yaml, 'CFullLoader', yaml.FullLoader))
+
+    log_conf = ne_conf.get('logging', {})
+    if log_files:
+        trace_setup(level=log_conf.get('level', 'DEBUG2'), background=log_conf.get('background', False),
+                    log_dir=log_conf.get('log_dir'), json_lines=log_conf.get('json_lines', False),
+                    console=log_conf.get('console', True))
+    else:
+        trace_setup(level=log_conf.get('level', 'DEBUG2'), console=log_conf.get('console', True))
+    return ne_conf
+
+
+def trace_forward(put, level='DEBUG2'):
+    """
+    Hand every trace to put rather than outputting it, eg in the worker processes of a sharded
+    fleet run, whose traces are output by the coordinator with trace_record
+    :param put: A callable taking the (ts, level, string, host) tuple of a trace
+    :param level: The lowest trace level forwarded, see trace_level
+    :return: natta
+    """
+    global _min_rank, _min_level, _writer
+
+    _min_rank = TRACE_LEVELS[level]
+    _min_level = level
+    if _writer:
+        _writer.close()
+    _writer = TraceForwarder(put)
+
+
+def trace_level():
+    """
+    :return: The lowest trace level output, as set with trace_setup
+    """
+    return _min_level
+
+
+def trace_flush():
+    """
+    Wait until every queued trace has been written, eg before prompting the user
+    """
+    if _writer:
+        _writer.flush()
+
+
+class TraceForwarder(object):
+    """
+    Hands the traces to a callable instead of writing them
+    """
+
+    def __init__(self, put):
+        self.put = put
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TraceWriter(object):
+    """
+    Writes queued traces from a background thread, one batch at a time
+    """
+
+    def __init__(self, log_dir=None, json_lines=False, console=True, max_files=64, batch=512):
+        """
+        :param log_dir: The directory of the per host log files, None for no files
+        :param json_lines: When True the log files hold one JSON object per trace
+        :param console: When True traces are printed to the screen
+        :param max_files: The number of per host log files kept open at once
+        :param batch: The max number of traces written between flushes
+        """
+        self.log_dir = log_dir
+        self.json_lines = json_lines
+        self.console = console
+        self.max_files = max_files
+        self.batch = batch
+        self.files = OrderedDict()
+        self.queue = queue.Queue()
+        self.last_sec = None
+        self.last_ts = ''
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name='p_trace', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def put(self, record):
+        self.queue.put(record)
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        for log_file in self.files.values():
+            log_file.close()
+        self.files.clear()
+
+    def _timestamp(self, ts):
+        # Consecutive traces mostly fall in the same second
+        sec = int(ts)
+        if sec != self.last_sec:
+            self.last_sec = sec
+            self.last_ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sec))
+        return self.last_ts
+
+    def _file(self, host):
+        name = f'{host}.log' if host else 'agonyless.log'
+        log_file = self.files.get(name)
+        if log_file is None:
+            if len(self.files) >= self.max_files:
+                self.files.popitem(last=False)[1].close()
+            log_file = open(os.path.join(self.log_dir, name), 'a')
+            self.files[name] = log_file
+        else:
+            self.files.move_to_end(name)
+        return log_file
+
+    def _run(self):
+        stop = False
+        while not stop:
+            records = [self.queue.get()]
+            while len(records) < self.batch:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            out = []
+            used = set()
+            for record in records:
+                if record is None:
+                    stop = True
+                    continue
+                ts, level, string, host = record
+                ts_str = self._timestamp(ts)
+                if self.console:
+                    host_str = f'[{host}] ' if host else ''
+                    out.append(f'{"=====> ":>15} {level} {ts_str} {host_str}{_format(string, level)}\n')
+                if self.log_dir:
+                    log_file = self._file(host)
+                    if self.json_lines:
+                        log_file.write(json.dumps({'ts': ts, 'level': level, 'host': host, 'msg': string}) + '\n')
+                    else:
+                        log_file.write(f'{level} {ts_str} {string}\n')
+                    used.add(log_file)
+
+            if out:
+                print(''.join(out), end='', flush=True)
+            for log_file in used:
+                if not log_file.closed:
+                    log_file.flush()
+            for _ in records:
+                self.queue.task_done()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+import os
+import inventory
+import journal
+import rollout
+from cmn_lib import p_trace, load_config
+
+"""
+A dry run of agonyless.py: what a rotation would do, without connecting to any CPE.
+
+The config is checked, the inventory is expanded and the CPEs are split into the waves of the
+rollout section. With fleet.resume set, the CPEs the journal has as done are left out, as the
+rotation would. The CPEs are listed at the DEBUG trace level.
+"""
+
+
+def main(yaml_file='./config.yml'):
+    """
+    :param yaml_file: The config file
+    :return: True when the config is valid
+    """
+    # Nothing is written to the log files of a real run
+    ne_conf = load_config(yaml_file, log_files=False)
+
+    missing = [f'{section}.{key}' for section, keys in [('credentials', ['uname', 'monitor', 'admin', 'port', 'role']),
+                                                         ('new_passwords', ['monitor', 'admin'])]
+               for key in keys if key not in (ne_conf.get(section) or {})]
+    if missing or not ne_conf.get('network_entities'):
+        p_trace(f'config.yml misses {missing or ["network_entities"]}', 'ERROR')
+        return False
+
+    try:
+        waves = rollout.Rollout.from_conf(ne_conf.get('rollout'))
+        if ne_conf.get('ssh_profile'):
+            # Checked against the algorithms paramiko supports, only loaded when there is a profile
+            import ssh_profile
+            ssh_profile.ConnectionProfile.from_conf(ne_conf['ssh_profile'])
+    except ValueError as error:
+        p_trace(str(error), 'ERROR')
+        return False
+
+    network_entities = inventory.load_inventory(ne_conf['network_entities'],
+                                                os.path.dirname(os.path.abspath(yaml_file)))
+    fleet_conf = ne_conf.get('fleet', {})
+    path = fleet_conf.get('journal')
+    if path and fleet_conf.get('resume') and os.path.exists(path):
+        key = journal.fingerprint(ne_conf['new_passwords']['monitor'], ne_conf['new_passwords']['admin'])
+        try:
+            # Opened for appending, nothing is written
+            with journal.RunJournal(path, True, key) as run_journal:
+                done = set(host for host, step in run_journal.steps.items() if step == journal.STEPS[-1])
+        except ValueError as error:
+            p_trace(str(error), 'ERROR')
+            return False
+        network_entities = (ne for ne in network_entities if ne.key not in done)
+
+    total = 0
+    try:
+        for index, wave in enumerate(waves.waves(network_entities), 1):
+            total += len(wave)
+            p_trace(f'Wave {index}: {len(wave)} CPEs, {wave[0]} to {wave[-1]}')
+            for ne in wave:
+                p_trace(f'  {ne} port {ne.conf(ne_conf)["credentials"]["port"]}', 'DEBUG')
+    except ValueError as error:
+        p_trace(f'Invalid inventory - {error}', 'ERROR')
+        return False
+
+    p_trace(f'{total} CPEs would be updated by {fleet_conf.get("processes", 1)} x {fleet_conf.get("workers", 1)} '
+            f'workers', 'PASS')
+    return True
+
+
+if __name__ == "__main__":
+
+    result = main()
+    if result:
+        exit(0)
+    else:
+        exit(1)
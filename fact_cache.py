@@ -0,0 +1,164 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from cmn_lib import p_trace
+
+"""
+This file contains the on-disk cache of the facts gathered from CPEs, eg the version, the
+profile names and the parsed profiles.
+
+Facts are kept in an SQLite database, per host. A fact expires ttl seconds after it was
+gathered, and the least recently used facts are evicted once the cache holds more than
+max_entries. The time a CPE booted is derived from its uptime: when a later session sees
+another boot time, the CPE rebooted and all its facts are dropped.
+
+The ssh_lib helpers consult the cache of the session, see SSH.open(..., fact_cache=...).
+A helper changing what a fact describes must invalidate the facts of the host.
+"""
+
+# eg ' 9:41AM  up 12 days,  3:04, 1 user, load averages: 0.10, 0.08, 0.05' or 'up 1 day, 10 mins,'
+_UPTIME = re.compile(r'\bup\s+(?:(?P<days>\d+) days?,?\s*)?'
+                     r'(?:(?P<hours>\d+):(?P<mins>\d+)|(?P<value>\d+) (?P<unit>hr|min|sec)s?)?')
+
+_UNITS = {'hr': 3600, 'min': 60, 'sec': 1}
+
+
+def parse_uptime(line):
+    """
+    :param line: The output of show uptime
+    :return: The uptime in seconds, None when it can't be read from line
+    """
+    m = _UPTIME.search(line or '')
+    if not m or not (m.group('days') or m.group('hours') or m.group('value')):
+        return None
+    seconds = int(m.group('days') or 0) * 86400
+    if m.group('hours'):
+        seconds += int(m.group('hours')) * 3600 + int(m.group('mins')) * 60
+    elif m.group('value'):
+        seconds += int(m.group('value')) * _UNITS[m.group('unit')]
+    return seconds
+
+
+def open_cache(cache_conf):
+    """
+    :param cache_conf: The fact_cache section of config.yml, may be None
+    :return: The FactCache it describes, None when it has no path
+    """
+    cache_conf = cache_conf or {}
+    if not cache_conf.get('path'):
+        return None
+    return FactCache(cache_conf['path'], ttl=cache_conf.get('ttl', 86400),
+                     max_entries=cache_conf.get('max_entries', 100000))
+
+
+class FactCache(object):
+    """
+    Host facts persisted in SQLite, shared by the sessions of all the fleet workers
+    """
+
+    def __init__(self, path, ttl=86400, max_entries=100000, reboot_tolerance=300):
+        """
+        :param path: The SQLite database file
+        :param ttl: Seconds a fact is valid for after it was gathered
+        :param max_entries: Number of facts above which the least recently used ones are evicted
+        :param reboot_tolerance: Seconds two boot times derived from uptimes may differ by, as an
+                                 uptime is only reported to the minute
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.reboot_tolerance = reboot_tolerance
+        self.lock = threading.Lock()
+        self.puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS facts (host TEXT, fact TEXT, value TEXT, stored REAL, '
+                            'used REAL, PRIMARY KEY (host, fact))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS boots (host TEXT PRIMARY KEY, boot REAL)')
+        self.evict()
+
+    def get(self, host, fact):
+        """
+        :param host: The CPE
+        :param fact: The name of the fact
+        :return: The cached value, None when the fact is not cached or has expired
+        """
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute('SELECT value FROM facts WHERE host = ? AND fact = ? AND stored > ?',
+                                  (host, fact, now - self.ttl)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.db.execute('UPDATE facts SET used = ? WHERE host = ? AND fact = ?', (now, host, fact))
+        return json.loads(row[0])
+
+    def put(self, host, fact, value):
+        """
+        :param host: The CPE
+        :param fact: The name of the fact
+        :param value: The value, anything json can serialize
+        """
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO facts VALUES (?, ?, ?, ?, ?)',
+                            (host, fact, json.dumps(value), now, now))
+            self.puts += 1
+        if self.puts % 1000 == 0:
+            self.evict()
+
+    def check_boot(self, host, uptime):
+        """
+        Drop the facts of host when it rebooted since they were gathered
+        :param host: The CPE
+        :param uptime: The uptime of the CPE in seconds, None when unknown
+        :return: True when the cached facts of host are still valid
+        """
+        with self.lock, self.db:
+            row = self.db.execute('SELECT boot FROM boots WHERE host = ?', (host,)).fetchone()
+            boot = time.time() - uptime if uptime is not None else None
+            if row and boot is not None and abs(boot - row[0]) <= self.reboot_tolerance:
+                return True
+
+            if row:
+                p_trace(f'CPE {host} rebooted since its facts were cached', 'DEBUG')
+            self.db.execute('DELETE FROM facts WHERE host = ?', (host,))
+            if boot is None:
+                self.db.execute('DELETE FROM boots WHERE host = ?', (host,))
+            else:
+                self.db.execute('INSERT OR REPLACE INTO boots VALUES (?, ?)', (host, boot))
+        return False
+
+    def invalidate(self, host):
+        """
+        Drop every fact of host
+        :param host: The CPE
+        """
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM facts WHERE host = ?', (host,))
+
+    def evict(self):
+        """
+        Drop the expired facts, then the least recently used ones above max_entries
+        """
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM facts WHERE stored <= ?', (time.time() - self.ttl,))
+            excess = self.db.execute('SELECT COUNT(*) FROM facts').fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.db.execute('DELETE FROM facts WHERE rowid IN '
+                                '(SELECT rowid FROM facts ORDER BY used LIMIT ?)', (excess,))
+
+    def close(self):
+        self.evict()
+        self.db.close()
+        p_trace(f'Fact cache closed: {self.hits} hits, {self.misses} misses', 'DEBUG2')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
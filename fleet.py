@@ -0,0 +1,416 @@
+import queue
+import threading
+import time
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from cmn_lib import p_trace, set_trace_host, trace_host, trace_forward, trace_level, trace_record
+
+"""
+This file contains the fleet executor used to run a per-CPE workflow across many
+network entities at once.
+
+Each CPE is handled by a task callable running in its own worker thread. The task is
+expected to create its own ssh_drv.SSH instances, so no session state is ever shared
+between hosts. Every task returns a result record, which is collected into a FleetRun.
+
+paramiko and the parsing of the CPE output are pure Python, so the threads of one process
+share a single core. run_sharded spreads the CPEs over several worker processes, each
+running its own threads, and merges their traces and records back. A ShardPool keeps its
+processes for several runs.
+"""
+
+
+class FleetRun(object):
+    """
+    Collects the per-host result records of a fleet run and keeps the aggregate counters
+    """
+
+    def __init__(self, keep_records=True):
+        """
+        :param keep_records: When False only the aggregate counters are kept, which keeps
+                             memory flat on very large runs.
+        """
+        self.keep_records = keep_records
+        self.records = []
+        self.total = 0
+        self.passed = 0
+        self.failed = 0
+        self.failed_hosts = []
+        # The CPEs that were never processed, their worker process failed or died
+        self.unprocessed = 0
+        # The failures of worker processes, as opposed to the failures of CPEs
+        self.errors = []
+        self.stopped = False
+        self.start_time = time.time()
+        self.duration = 0
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        """
+        Add a per-host result record to the run
+        :param record: A dict as returned by run_task
+        :return: natta
+        """
+        with self.lock:
+            self.total += 1
+            if record['result']:
+                self.passed += 1
+            else:
+                self.failed += 1
+                self.failed_hosts.append(record['host'])
+            if self.keep_records:
+                self.records.append(record)
+            self.duration = time.time() - self.start_time
+
+    @property
+    def result(self):
+        return self.failed == 0 and self.unprocessed == 0 and not self.errors
+
+    def summary(self):
+        """
+        :return: A one line human readable summary of the run
+        """
+        rate = self.total / self.duration if self.duration else 0
+        unprocessed = f' / {self.unprocessed} not processed' if self.unprocessed else ''
+        return (f'{self.total} CPEs processed in {self.duration:.1f}s ({rate:.2f} CPE/s) : '
+                f'{self.passed} passed / {self.failed} failed{unprocessed}')
+
+
+def run_task(task, target):
+    """
+    Run the per-host task and turn its outcome into a result record.
+    An exception raised by the task only fails that host, never the whole fleet.
+    :param task: A callable taking the target and returning a dict with at least the 'result' key
+    :param target: The network entity handed to the task
+    :return: record - a dict with the keys host, result, step, error and duration
+    """
+    record = {'host': target, 'result': False, 'step': None, 'error': None, 'duration': 0}
+    start = time.time()
+    # Tag every trace of this worker with the CPE it is working on
+    token = set_trace_host(target)
+    try:
+        record.update(task(target))
+    except Exception as error:
+        record['result'] = False
+        record['error'] = f'{type(error).__name__}: {error}'
+        p_trace(f'Unhandled error while processing {target} - {record["error"]}', 'ERROR')
+    finally:
+        trace_host.reset(token)
+    record['duration'] = time.time() - start
+    return record
+
+
+def run_fleet(targets, task, workers=1, gate=None, on_result=None, keep_records=True):
+    """
+    Run task against every target using a bounded pool of worker threads.
+
+    Targets are consumed lazily, at most `workers` tasks are in flight at any time.
+    :param targets: An iterable of network entities
+    :param task: A callable taking a target and returning a dict with at least the 'result' key
+    :param workers: The maximum number of CPEs processed concurrently
+    :param gate: Optional callable taking the next target, returning False to stop submitting work
+    :param on_result: Optional callable invoked with each record as soon as its host completes
+    :param keep_records: When False the FleetRun only keeps aggregate counters
+    :return: run - the FleetRun holding the records and the aggregate result
+    """
+    run = FleetRun(keep_records)
+    workers = max(1, int(workers))
+    pending = set()
+
+    def _collect(done):
+        for future in done:
+            record = future.result()
+            run.add(record)
+            if on_result:
+                on_result(record)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fleet') as executor:
+        for target in targets:
+            if len(pending) >= workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _collect(done)
+            if gate and not gate(target):
+                p_trace('Fleet run stopped before all CPEs were processed', 'WARNING')
+                run.stopped = True
+                break
+            pending.add(executor.submit(run_task, task, target))
+
+        done, pending = wait(pending)
+        _collect(done)
+
+    _report(run)
+    return run
+
+
+def _report(run):
+    p_trace(run.summary(), 'PASS' if run.result else 'ERROR')
+    for error in run.errors:
+        p_trace(f'  {error}', 'ERROR')
+    for host in run.failed_hosts:
+        p_trace(f'  Failed: {host}', 'ERROR')
+
+
+def _shard(index, task_setup, workers, level, inbox, outbox):
+    """
+    The main of a worker process of a ShardPool. Runs the targets it is handed on inbox, never
+    more than workers at a time, and sends the traces and records to outbox. A process that
+    fails, eg in task_setup, reports it with a 'failed' message and takes no more targets.
+    """
+    trace_forward(lambda record: outbox.put(('trace', record)), level)
+
+    def _done(future):
+        outbox.put(('result', (index, future.result())))
+
+    try:
+        with task_setup() as task, \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'shard{index}') as executor:
+            while True:
+                target = inbox.get()
+                if target is None:
+                    break
+                executor.submit(run_task, task, target).add_done_callback(_done)
+    except Exception as error:
+        outbox.put(('failed', f'Worker process {index} failed - {type(error).__name__}: {error}'))
+    finally:
+        outbox.put(('done', index))
+
+
+class ShardPool(object):
+    """
+    Worker processes running a task, each up to `workers` targets at a time in threads. The
+    processes and their task setup last for the whole pool, so several runs, eg the waves of a
+    rollout, are handed to the same processes. Use as a context manager.
+
+    Each process has its own inbox, and is handed a target only while it runs fewer than
+    workers. So the targets of a process that dies are known, and counted as unprocessed.
+    """
+
+    def __init__(self, task_setup, processes=1, workers=1):
+        """
+        :param task_setup: A picklable callable returning a context manager that yields the task, eg a
+                           functools.partial of a module level contextlib.contextmanager function. It is
+                           entered once per process, so each process has its own fact cache connection etc.
+        :param processes: The number of worker processes. With 1 the task runs in this process, see run_fleet
+        :param workers: The maximum number of CPEs processed concurrently by each process
+        """
+        self.task_setup = task_setup
+        self.processes = max(1, int(processes))
+        self.workers = max(1, int(workers))
+        self.stack = None
+        self.task = None
+        self.shards = []
+        self.inboxes = []
+        self.outbox = None
+        self.alive = set()
+        # The targets handed to each process without a result yet
+        self.pending = []
+        self.condition = threading.Condition()
+        self.current = None
+        self.on_result = None
+
+    def __enter__(self):
+        if self.processes <= 1:
+            self.stack = ExitStack()
+            self.task = self.stack.enter_context(self.task_setup())
+            return self
+
+        import multiprocessing
+
+        # Processes are started afresh rather than forked from this multi-threaded one
+        context = multiprocessing.get_context('spawn')
+        self.inboxes = [context.Queue() for _ in range(self.processes)]
+        self.outbox = context.Queue()
+        self.shards = [context.Process(target=_shard, name=f'shard{i}', daemon=True,
+                                       args=(i, self.task_setup, self.workers, trace_level(), self.inboxes[i],
+                                             self.outbox))
+                       for i in range(self.processes)]
+        for shard in self.shards:
+            shard.start()
+        self.alive = set(range(self.processes))
+        self.pending = [0] * self.processes
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _gone(self, index, error=None):
+        """
+        Account for a process that takes no more targets. The targets it holds have no result.
+        """
+        with self.condition:
+            self.alive.discard(index)
+            lost = self.pending[index]
+            self.pending[index] = 0
+            self.condition.notify_all()
+        if self.current is None:
+            return
+        if error:
+            # A process that failed reported its error already
+            p_trace(f'{error}, the {lost} CPEs it was processing have no result', 'ERROR')
+            self.current.errors.append(error)
+        if error or lost:
+            self.current.stopped = True
+
+    def _handle(self, kind, payload):
+        if kind == 'trace':
+            trace_record(payload)
+        elif kind == 'result':
+            index, record = payload
+            with self.condition:
+                self.pending[index] -= 1
+                self.condition.notify_all()
+            if self.current is not None:
+                self.current.add(record)
+                if self.on_result:
+                    self.on_result(record)
+        elif kind == 'failed':
+            p_trace(payload, 'ERROR')
+            if self.current is not None:
+                self.current.errors.append(payload)
+                self.current.stopped = True
+        elif kind == 'done':
+            self._gone(payload)
+
+    def _check_dead(self):
+        """
+        A process that was killed, eg out of memory, never reports
+        """
+        dead = [i for i in list(self.alive) if self.shards[i].exitcode is not None]
+        if not dead:
+            return
+        # Handle what they sent before they died first
+        while True:
+            try:
+                self._handle(*self.outbox.get(timeout=0.1))
+            except queue.Empty:
+                break
+        for i in dead:
+            if i in self.alive:
+                self._gone(i, f'Worker process {i} died with exit code {self.shards[i].exitcode}')
+
+    def _idle(self):
+        with self.condition:
+            return not any(self.pending[i] for i in self.alive)
+
+    def run(self, targets, gate=None, on_result=None, keep_records=True):
+        """
+        Run the task against every target. Targets are consumed lazily and handed to whichever
+        process has a free worker thread first. The traces and result records of the processes
+        are output and collected by this process.
+        :param targets: An iterable of network entities, they must be picklable
+        :param gate: Optional callable taking the next target, returning False to stop submitting work
+        :param on_result: Optional callable invoked with each record as soon as its host completes
+        :param keep_records: When False the FleetRun only keeps aggregate counters
+        :return: run - the FleetRun holding the records and the aggregate result. When a process
+                 failed or died, it holds the error, stopped is set and the CPEs left without a
+                 result are counted as unprocessed.
+        """
+        if self.processes <= 1:
+            return run_fleet(targets, self.task, self.workers, gate, on_result, keep_records)
+
+        run = FleetRun(keep_records)
+        self.current = run
+        self.on_result = on_result
+        stop = threading.Event()
+        fed_all = threading.Event()
+        errors = []
+        # The targets handed to the processes, and those left over once every process is gone
+        fed = [0, 0]
+        targets = iter(targets)
+
+        def _hand(target):
+            """
+            :return: False when no process is left to take target
+            """
+            with self.condition:
+                while not stop.is_set() and self.alive:
+                    free = [i for i in self.alive if self.pending[i] < self.workers]
+                    if free:
+                        index = min(free, key=lambda i: self.pending[i])
+                        self.pending[index] += 1
+                        break
+                    self.condition.wait(1)
+                else:
+                    return False
+            self.inboxes[index].put(target)
+            return True
+
+        def _feed():
+            try:
+                for target in targets:
+                    if gate and not gate(target):
+                        p_trace('Fleet run stopped before all CPEs were processed', 'WARNING')
+                        run.stopped = True
+                        break
+                    if not _hand(target):
+                        # Every process is gone, count what they never got to
+                        fed[1] = 1 + sum(1 for _ in targets)
+                        return
+                    fed[0] += 1
+            except Exception as error:
+                # Raised again by run, eg a bad inventory entry
+                errors.append(error)
+            finally:
+                fed_all.set()
+
+        feeder = threading.Thread(target=_feed, name='fleet-feeder', daemon=True)
+        feeder.start()
+        try:
+            while self.alive and not (fed_all.is_set() and self._idle()):
+                try:
+                    self._handle(*self.outbox.get(timeout=1))
+                except queue.Empty:
+                    self._check_dead()
+        finally:
+            stop.set()
+            feeder.join()
+            self.current = None
+            self.on_result = None
+
+        if errors:
+            raise errors[0]
+        if not self.alive:
+            run.stopped = True
+        run.unprocessed += max(0, fed[0] - run.total) + fed[1]
+        _report(run)
+        return run
+
+    def close(self):
+        """
+        Stop the worker processes once they are done, or the task setup of this process
+        """
+        if self.stack is not None:
+            self.stack.close()
+            self.stack = None
+            return
+
+        for i in self.alive:
+            self.inboxes[i].put(None)
+        while self.alive:
+            try:
+                self._handle(*self.outbox.get(timeout=1))
+            except queue.Empty:
+                self._check_dead()
+        for shard in self.shards:
+            shard.join()
+        # The targets and sentinels of dead processes are never read, don't wait on them at exit
+        for inbox in self.inboxes:
+            inbox.cancel_join_thread()
+        self.shards = []
+
+
+def run_sharded(targets, task_setup, processes=1, workers=1, gate=None, on_result=None, keep_records=True):
+    """
+    Run a task against every target across worker processes, each running up to `workers`
+    tasks in threads. A ShardPool for a single run, see ShardPool.run.
+    :param targets: An iterable of network entities, they must be picklable
+    :param task_setup: A picklable callable returning a context manager that yields the task, see ShardPool
+    :param processes: The number of worker processes. With 1 the task runs in this process, see run_fleet
+    :param workers: The maximum number of CPEs processed concurrently by each process
+    :param gate: Optional callable taking the next target, returning False to stop submitting work
+    :param on_result: Optional callable invoked with each record as soon as its host completes
+    :param keep_records: When False the FleetRun only keeps aggregate counters
+    :return: run - the FleetRun holding the records and the aggregate result
+    """
+    with ShardPool(task_setup, processes, workers) as shards:
+        return shards.run(targets, gate, on_result, keep_records)
@@ -0,0 +1,358 @@
+import bisect
+import csv
+import ipaddress
+import os
+import yaml
+from cmn_lib import p_trace
+
+"""
+This file contains the inventory loader, which turns the network_entities of config.yml
+into the stream of CPEs a fleet run works on.
+
+An entry of network_entities is one of:
+    - an IP address or host name                     164.153.181.8
+    - a CIDR block, all its host addresses           10.20.0.0/24
+    - a range, in full or of the last octet          10.20.1.10-10.20.1.99 or 10.20.1.10-99
+    - a host, CIDR block or range with overrides     {host: 10.20.2.0/28, port: 22, credentials: {admin: xyz}}
+    - an inventory file                              {file: cpes.csv}
+
+Inventory files are read as they are consumed, so the first CPE is worked on before a large
+inventory has been parsed, and memory stays flat whatever the size of the inventory:
+    - .csv: a header row naming the host column, other columns are overrides. The uname,
+      monitor and admin columns override the credentials.
+    - .yml/.yaml: a list of entries, or a mapping holding them under network_entities. It is
+      parsed event by event, with the libyaml parser when available.
+    - anything else: one entry per line, # starts a comment.
+
+Hosts listed more than once are only returned the first time, with the overrides of that
+first entry. A host listed again with another port override is another CPE, eg one more CPE
+behind the same NAT address, and is returned as well. Its key, in the journal, is host:port.
+"""
+
+# The libyaml (C) parser is an order of magnitude faster, when PyYAML was built with it
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_yaml_constructor = yaml.constructor.SafeConstructor()
+_yaml_resolver = yaml.resolver.Resolver()
+
+_CREDENTIALS = ('uname', 'monitor', 'admin')
+
+
+class Target(str):
+    """
+    A CPE host name or IP address, along with the overrides of its inventory entry.
+    Being a str, a Target is used wherever a host is.
+    """
+
+    def __new__(cls, host, overrides=None):
+        target = super().__new__(cls, host)
+        target.overrides = overrides
+        return target
+
+    @property
+    def port(self):
+        """
+        :return: The port override of the entry, None when the port of config.yml applies
+        """
+        return _port(self.overrides)
+
+    @property
+    def key(self):
+        """
+        :return: The host, followed by the port override if any. Unique per CPE of the inventory.
+        """
+        port = self.port
+        return self if port is None else f'{self}:{port}'
+
+    def conf(self, ne_conf):
+        """
+        :param ne_conf: The parsed config.yml
+        :return: ne_conf with the overrides of the target applied
+        """
+        if not self.overrides:
+            return ne_conf
+        # port and role are part of the credentials section, like the passwords
+        credentials = dict(ne_conf['credentials'])
+        for name, value in self.overrides.items():
+            if name == 'credentials':
+                credentials.update(value)
+            else:
+                credentials[name] = value
+        return dict(ne_conf, credentials=credentials)
+
+
+def load_inventory(entries, base_dir='.', dedup=True):
+    """
+    Lazily expand the entries of network_entities into targets
+    :param entries: An iterable of entries, see the module doc
+    :param base_dir: The directory relative inventory file paths are relative to
+    :param dedup: When False hosts listed more than once are returned every time, and nothing
+                  is remembered about the hosts returned
+    :return: A generator of Target
+    """
+    # One _Seen per port override, the same host on another port being another CPE
+    seen = {} if dedup else None
+    for entry in entries:
+        if isinstance(entry, dict) and 'file' in entry:
+            path = os.path.join(base_dir, entry['file'])
+            p_trace(f'Loading inventory {path}', 'DEBUG')
+            yield from _expand_all(_file_entries(path), seen)
+        else:
+            yield from _expand(entry, seen)
+
+    duplicates = sum(port_seen.duplicates for port_seen in seen.values()) if seen else 0
+    if duplicates:
+        p_trace(f'{duplicates} duplicate hosts in the inventory were skipped', 'WARNING')
+
+
+def _expand_all(entries, seen):
+    for entry in entries:
+        yield from _expand(entry, seen)
+
+
+def _expand(entry, seen):
+    """
+    :param entry: An entry, other than an inventory file
+    :param seen: The _Seen of the inventory by port override, None when not deduplicating
+    :return: A generator of the targets of the entry
+    """
+    overrides = None
+    if isinstance(entry, dict):
+        overrides = {name: value for name, value in entry.items() if name != 'host'} or None
+        entry = entry['host']
+    entry = str(entry).strip()
+    if seen is not None:
+        port = _port(overrides)
+        seen = seen.get(port) or seen.setdefault(port, _Seen())
+
+    first, last = _parse_range(entry)
+    if first is None:
+        # A host name or an IP address
+        if seen is None or seen.add(entry):
+            yield Target(entry, overrides)
+        return
+
+    if seen is not None and seen.covered(first, last):
+        seen.duplicates += last - first + 1
+        return
+
+    address_class = ipaddress.IPv4Address if ipaddress.ip_address(first).version == 4 else ipaddress.IPv6Address
+    for address in range(first, last + 1):
+        if seen is None or seen.add_address(address):
+            yield Target(str(address_class(address)), overrides)
+    if seen is not None:
+        seen.add_range(first, last)
+
+
+def _port(overrides):
+    """
+    :param overrides: The overrides of an entry, or None
+    :return: The port override, at the top of the entry or in its credentials, None when there is none
+    """
+    if not overrides:
+        return None
+    port = overrides.get('port')
+    if port is None:
+        port = (overrides.get('credentials') or {}).get('port')
+    return None if port is None else int(port)
+
+
+def _parse_range(entry):
+    """
+    :param entry: A CIDR block, a range, or anything else
+    :return: The first and last address of the block or range as ints, (None, None) for anything else
+    """
+    if '/' in entry:
+        try:
+            network = ipaddress.ip_network(entry, strict=False)
+        except ValueError as error:
+            raise ValueError(f'Invalid inventory entry {entry} - {error}')
+        if network.num_addresses <= 2:
+            return int(network[0]), int(network[-1])
+        # Skip the network and broadcast addresses
+        return int(network[0]) + 1, int(network[-1]) - 1
+
+    if '-' in entry:
+        start, end = (part.strip() for part in entry.split('-', 1))
+        try:
+            first = ipaddress.ip_address(start)
+        except ValueError:
+            # A host name
+            return None, None
+        if '.' not in end and ':' not in end:
+            # Range of the last octet
+            end = f'{start.rsplit(".", 1)[0]}.{end}'
+        try:
+            last = ipaddress.ip_address(end)
+        except ValueError as error:
+            raise ValueError(f'Invalid inventory entry {entry} - {error}')
+        if last.version != first.version or int(last) < int(first):
+            raise ValueError(f'Invalid inventory entry {entry} - the range ends before it starts')
+        return int(first), int(last)
+
+    return None, None
+
+
+class _Seen(object):
+    """
+    The hosts returned so far. Ranges are kept as merged intervals rather than one address
+    at a time, so a large CIDR block costs next to nothing.
+    """
+
+    def __init__(self):
+        self.hosts = set()
+        self.starts = []
+        self.ends = []
+        self.duplicates = 0
+
+    def _in_ranges(self, address):
+        i = bisect.bisect_right(self.starts, address) - 1
+        return i >= 0 and address <= self.ends[i]
+
+    def add(self, host):
+        """
+        :return: True when host was not seen before
+        """
+        try:
+            key = int(ipaddress.ip_address(host))
+            if self._in_ranges(key):
+                self.duplicates += 1
+                return False
+        except ValueError:
+            key = host
+        if key in self.hosts:
+            self.duplicates += 1
+            return False
+        self.hosts.add(key)
+        return True
+
+    def add_address(self, address):
+        """
+        :param address: An address of the range being expanded, as an int
+        :return: True when the address was not seen before
+        """
+        if self._in_ranges(address) or address in self.hosts:
+            self.duplicates += 1
+            return False
+        return True
+
+    def covered(self, first, last):
+        """
+        :return: True when every address from first to last was already returned as part of a range
+        """
+        i = bisect.bisect_right(self.starts, first) - 1
+        return i >= 0 and last <= self.ends[i]
+
+    def add_range(self, first, last):
+        """
+        Record the expanded range first to last, merging it with the ranges it overlaps or touches
+        """
+        i = bisect.bisect_left(self.ends, first - 1)
+        j = bisect.bisect_right(self.starts, last + 1)
+        if i < j:
+            first = min(first, self.starts[i])
+            last = max(last, self.ends[j - 1])
+        self.starts[i:j] = [first]
+        self.ends[i:j] = [last]
+
+
+def _file_entries(path):
+    """
+    :param path: An inventory file
+    :return: A generator of the entries of the file
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='' if extension == '.csv' else None) as inventory_file:
+        if extension == '.csv':
+            yield from _csv_entries(inventory_file)
+        elif extension in ('.yml', '.yaml'):
+            yield from _yaml_entries(inventory_file)
+        else:
+            for line in inventory_file:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    yield line
+
+
+def _csv_entries(inventory_file):
+    reader = csv.DictReader(inventory_file)
+    for row in reader:
+        # DictReader puts the fields in excess of the header under None, eg a comma in a password
+        if None in row:
+            raise ValueError(f'Invalid inventory {inventory_file.name} line {reader.line_num} - '
+                             f'{len(reader.fieldnames) + len(row[None])} fields, the header has '
+                             f'{len(reader.fieldnames)}')
+        host = (row.pop('host', None) or '').strip()
+        if not host:
+            continue
+        entry = {'host': host}
+        credentials = {}
+        for name, value in row.items():
+            if value is None or not value.strip():
+                continue
+            value = value.strip()
+            if name == 'port':
+                try:
+                    value = int(value)
+                except ValueError:
+                    raise ValueError(f'Invalid inventory {inventory_file.name} line {reader.line_num} - '
+                                     f'port {value} is not a number')
+            if name in _CREDENTIALS:
+                credentials[name] = value
+            else:
+                entry[name] = value
+        if credentials:
+            entry['credentials'] = credentials
+        yield entry
+
+
+def _yaml_entries(inventory_file):
+    """
+    Stream the entries of a YAML inventory, without building the whole document
+    """
+    events = yaml.parse(inventory_file, Loader=_YAML_LOADER)
+    for event in events:
+        if isinstance(event, yaml.SequenceStartEvent):
+            yield from _yaml_items(events)
+            return
+        if isinstance(event, yaml.MappingStartEvent):
+            for key in events:
+                if isinstance(key, yaml.MappingEndEvent):
+                    return
+                value = next(events)
+                if _yaml_build(key, events) == 'network_entities' and isinstance(value, yaml.SequenceStartEvent):
+                    yield from _yaml_items(events)
+                else:
+                    _yaml_build(value, events)
+
+
+def _yaml_items(events):
+    for event in events:
+        if isinstance(event, yaml.SequenceEndEvent):
+            return
+        yield _yaml_build(event, events)
+
+
+def _yaml_build(event, events):
+    """
+    :param event: The first event of a node
+    :param events: The events that follow
+    :return: The python value of the node
+    """
+    if isinstance(event, yaml.ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = _yaml_resolver.resolve(yaml.ScalarNode, event.value, event.implicit)
+        # Straight to the constructor of the tag, construct_object would keep every node it built
+        construct = _yaml_constructor.yaml_constructors.get(tag)
+        if construct is None:
+            return event.value
+        return construct(_yaml_constructor, yaml.ScalarNode(tag, event.value, style=event.style))
+    if isinstance(event, yaml.SequenceStartEvent):
+        return list(_yaml_items(events))
+    if isinstance(event, yaml.MappingStartEvent):
+        mapping = {}
+        for key in events:
+            if isinstance(key, yaml.MappingEndEvent):
+                return mapping
+            mapping[_yaml_build(key, events)] = _yaml_build(next(events), events)
+    raise ValueError(f'Unsupported YAML in the inventory: {event}')
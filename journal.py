@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from cmn_lib import p_trace
+
+"""
+This file contains the run journal, which lets an interrupted fleet run be resumed.
+
+Every step a CPE completes is appended to the journal file as one JSON line and synced to
+disk before the run moves on, so the journal survives the script being killed or the
+machine going down. Resuming a run loads the journal: CPEs that saved their config are
+skipped, the others carry on from the step after the last one they completed, logging in
+with the passwords that step left in place.
+
+The journal holds no password. Its header keeps a fingerprint of the new passwords, and a
+journal written for other new passwords is never resumed.
+"""
+
+# The steps of a password rotation, in order
+STEPS = ('connected', 'monitor_password', 'admin_password', 'verified', 'saved')
+
+
+def fingerprint(*secrets):
+    """
+    :return: A digest identifying the secrets, without revealing them
+    """
+    return hashlib.sha256('\0'.join(secrets).encode('utf-8')).hexdigest()[:16]
+
+
+class RunJournal(object):
+    """
+    Append only record of the steps each CPE completed. Use as a context manager to close
+    the journal file on exit.
+    """
+
+    def __init__(self, path, resume=False, key=None, verbose=True):
+        """
+        :param path: The journal file
+        :param resume: When True the steps of the existing journal are loaded and appended to,
+                       otherwise the journal is started afresh
+        :param key: A fingerprint of what the run applies, eg fingerprint(new passwords).
+                    Resuming a journal written with another key raises ValueError.
+        :param verbose: When False the progress loaded from the journal is not traced, eg when the
+                        worker processes of a sharded run append to the journal of their coordinator
+        """
+        self.path = path
+        self.key = key
+        self.steps = {}
+        self.verbose = verbose
+        self.lock = threading.Lock()
+
+        if resume and os.path.exists(path):
+            complete = self._load()
+            self.file = open(path, 'a')
+            if not complete:
+                # End the line cut short, the next entry would be lost with it otherwise
+                self.file.write('\n')
+        else:
+            self.file = open(path, 'w')
+            self._append({'ts': time.time(), 'key': key})
+
+    def _load(self):
+        """
+        Load the steps of the journal file
+        :return: False when its last line was cut short
+        """
+        line = ''
+        with open(self.path) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short when the previous run died
+                    continue
+                if 'key' in entry:
+                    if entry['key'] != self.key:
+                        raise ValueError(f'{self.path} was written for other new passwords, it can not be resumed')
+                elif entry['step'] is None:
+                    self.steps.pop(entry['host'], None)
+                elif not self.passed(entry['host'], entry['step']):
+                    self.steps[entry['host']] = entry['step']
+
+        if self.verbose:
+            done = sum(1 for step in self.steps.values() if step == STEPS[-1])
+            p_trace(f'Resuming {self.path}: {done} CPEs done, {len(self.steps) - done} partially done', 'INFO')
+        return not line or line.endswith('\n')
+
+    def _append(self, entry):
+        # One write per entry to a file opened for appending, so processes sharing the journal don't interleave
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def record(self, host, step):
+        """
+        Record that host completed step
+        :param host: The CPE
+        :param step: One of STEPS
+        """
+        with self.lock:
+            if self.passed(host, step):
+                return
+            self.steps[host] = step
+            self._append({'ts': time.time(), 'host': host, 'step': step})
+
+    def reset(self, host):
+        """
+        Forget the steps of host, eg when the CPE lost its unsaved changes
+        :param host: The CPE
+        """
+        with self.lock:
+            self.steps.pop(host, None)
+            self._append({'ts': time.time(), 'host': host, 'step': None})
+
+    def step(self, host):
+        """
+        :return: The last step host completed, None when it has not started
+        """
+        return self.steps.get(host)
+
+    def passed(self, host, step):
+        """
+        :return: True when host completed step
+        """
+        last = self.steps.get(host)
+        return last is not None and STEPS.index(last) >= STEPS.index(step)
+
+    def done(self, host):
+        """
+        :return: True when host completed every step
+        """
+        return self.steps.get(host) == STEPS[-1]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,154 @@
+import mmap
+import tempfile
+from array import array
+
+"""
+This file contains the buffer the output lines of a command are collected in, see SSH.send.
+
+An OutputBuffer behaves like the list of lines SSH.send used to return: it can be indexed,
+sliced, iterated, measured and tested for emptiness. Small outputs are kept in memory. Once an
+output grows past the spill threshold its lines are moved to an anonymous temporary file and
+the lines that follow are appended to it, so a large 'show log' costs a few bytes of memory
+per line rather than the whole text. Spilled lines are read back through a memory map, one
+line at a time, when they are indexed or iterated.
+"""
+
+# Bytes of output above which the lines are spilled to disk
+SPILL_BYTES = 1024 * 1024
+# Bytes of spilled lines decoded at a time when iterating
+READ_CHUNK = 256 * 1024
+
+
+class OutputBuffer(object):
+    """
+    The output lines of a command, in memory or spilled to a temporary file
+    """
+
+    def __init__(self, spill=SPILL_BYTES, spill_dir=None):
+        """
+        :param spill: Bytes of output above which the lines are spilled to disk, None to never spill
+        :param spill_dir: The directory of the temporary file, the system default when None
+        """
+        self.spill = spill
+        self.spill_dir = spill_dir
+        self.lines = []
+        self.size = 0
+        self.file = None
+        # Start of each spilled line in the file, the lines are separated by a new line
+        self.offsets = array('Q')
+        # Whether a spilled line holds a new line itself, then lines are told apart by offsets only
+        self.newlines = False
+        self.map = None
+
+    @property
+    def spilled(self):
+        return self.file is not None
+
+    def append(self, line):
+        """
+        :param line: The next output line
+        """
+        if self.file is None:
+            self.lines.append(line)
+            self.size += len(line) + 1
+            if self.spill is not None and self.size > self.spill:
+                self._spill()
+            return
+
+        data = line.encode('utf-8', 'replace') + b'\n'
+        if '\n' in line:
+            self.newlines = True
+        self.offsets.append(self.size)
+        self.file.write(data)
+        self.size += len(data)
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def _spill(self):
+        self.file = tempfile.TemporaryFile(prefix='agonyless-', dir=self.spill_dir)
+        lines = self.lines
+        self.lines = []
+        self.size = 0
+        self.extend(lines)
+
+    def _mapped(self):
+        """
+        :return: A memory map of the spilled lines, remapped when lines were appended since
+        """
+        if self.map is None or len(self.map) < self.size:
+            self.file.flush()
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    def _line(self, data, index):
+        end = self.offsets[index + 1] if index + 1 < len(self.offsets) else self.size
+        return data[self.offsets[index]:end - 1].decode('utf-8', 'replace')
+
+    def __len__(self):
+        return len(self.offsets) if self.file is not None else len(self.lines)
+
+    def __getitem__(self, index):
+        if self.file is None:
+            return self.lines[index]
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('OutputBuffer index out of range')
+        return self._line(self._mapped(), index)
+
+    def __iter__(self):
+        if self.file is None:
+            yield from self.lines
+            return
+        data = self._mapped()
+        if self.newlines:
+            for index in range(len(self.offsets)):
+                yield self._line(data, index)
+            return
+        # Decoded a chunk of whole lines at a time, every spilled line ends with a new line
+        start = 0
+        size = self.size
+        while start < size:
+            end = data.rfind(b'\n', start, min(start + READ_CHUNK, size)) + 1
+            if end <= start:
+                # A line longer than a chunk
+                end = data.find(b'\n', start, size) + 1
+            yield from data[start:end - 1].decode('utf-8', 'replace').split('\n')
+            start = end
+
+    def __eq__(self, other):
+        if isinstance(other, (list, OutputBuffer)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        if self.file is None:
+            return repr(self.lines)
+        return f'<{len(self)} lines, {self.size} bytes spilled to disk>'
+
+    def close(self):
+        """
+        Release the temporary file, its lines are gone
+        """
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.offsets = array('Q')
+            self.newlines = False
+        self.lines = []
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
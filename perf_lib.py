@@ -0,0 +1,197 @@
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from cmn_lib import p_trace, trace_host
+
+"""
+This file contains the timing instrumentation of a run.
+
+ssh_drv and ssh_lib wrap their phases (TCP connect, SSH handshake, banner wait, each send
+round trip, cli_nav, save config) in spans. Spans cost nothing until enable_profiling is
+called. Durations are then collected per phase, per host and per command, and
+RunProfile.report summarises where the time of a fleet run went.
+
+The durations of a phase or a command are aggregated as they come: count, total, max and a
+fixed size random sample the percentiles are taken from. Commands are grouped by their verb,
+so however long the run, the profile holds a bounded number of durations per host.
+"""
+
+_profile = None
+
+# The number of durations sampled per phase or command for the percentiles
+SAMPLES = 1024
+
+
+def span(phase, host=None, cmd=None):
+    """
+    Time a phase, eg: with span('send', host, cmd): ...
+    :param phase: The name of the phase
+    :param host: The host, defaults to the one the traces are tagged with (see cmn_lib.set_trace_host)
+    :param cmd: The command, for phases that relate to one
+    :return: A Span context manager
+    """
+    return Span(phase, host, cmd)
+
+
+class Span(object):
+    """
+    Context manager timing one phase, only while profiling is enabled
+    """
+    __slots__ = ('phase', 'host', 'cmd', 'start')
+
+    def __init__(self, phase, host=None, cmd=None):
+        self.phase = phase
+        self.host = host
+        self.cmd = cmd
+        self.start = None
+
+    def __enter__(self):
+        if _profile is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.start is not None and _profile is not None:
+            end = time.perf_counter()
+            _profile.add(self.phase, self.host or trace_host.get(), self.start, end, self.cmd)
+
+
+def enable_profiling():
+    """
+    Start collecting spans
+    :return: The RunProfile the spans are collected in
+    """
+    global _profile
+    _profile = RunProfile()
+    return _profile
+
+
+def disable_profiling():
+    """
+    Stop collecting spans
+    :return: The RunProfile the spans were collected in, None if profiling was not enabled
+    """
+    global _profile
+    profile = _profile
+    _profile = None
+    return profile
+
+
+def percentile(durations, pct):
+    """
+    :param durations: A sorted list of durations
+    :param pct: The percentile, between 0 and 100
+    :return: The duration at that percentile (nearest rank)
+    """
+    if not durations:
+        return 0
+    return durations[max(0, math.ceil(pct / 100 * len(durations)) - 1)]
+
+
+def command_verb(cmd):
+    """
+    :param cmd: A command sent to a CPE
+    :return: Its first two words, eg 'show version' or 'set password'. The arguments, eg names,
+             values or passwords, are left out.
+    """
+    return ' '.join(cmd.split()[:2])
+
+
+class Durations(object):
+    """
+    The count, total and max of a series of durations, and a reservoir sample of them
+    """
+    __slots__ = ('count', 'total', 'max', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        if len(self.samples) < SAMPLES:
+            self.samples.append(duration)
+        else:
+            # Every duration so far has the same chance to be in the sample
+            i = random.randrange(self.count)
+            if i < SAMPLES:
+                self.samples[i] = duration
+
+
+class RunProfile(object):
+    """
+    The durations of the spans of a run, per phase, per host and per command
+    """
+
+    # Phases that are one round trip to the remote system
+    ROUND_TRIPS = ('send', 'send_batch')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = defaultdict(Durations)
+        self.commands = defaultdict(Durations)
+        self.hosts = {}
+        self.round_trips = defaultdict(int)
+
+    def add(self, phase, host, start, end, cmd=None):
+        duration = end - start
+        if cmd is not None:
+            # Keeps the passwords out of the report as well
+            cmd = command_verb(cmd)
+        with self.lock:
+            self.phases[phase].add(duration)
+            if cmd is not None:
+                self.commands[cmd].add(duration)
+            if phase in self.ROUND_TRIPS:
+                self.round_trips[host] += 1
+            first, last = self.hosts.get(host, (start, end))
+            self.hosts[host] = (min(first, start), max(last, end))
+
+    def report(self, slowest=10):
+        """
+        :param slowest: The number of slowest hosts and commands listed
+        :return: The run profile summary as a string
+        """
+        with self.lock:
+            header = f'{"count":>8} {"p50 (s)":>10} {"p95 (s)":>10} {"max (s)":>10} {"total (s)":>12}'
+            lines = [f'{"phase":<28} {header}']
+            for phase, durations in sorted(self.phases.items(), key=lambda item: -item[1].total):
+                lines.append(self._row(phase, durations))
+
+            lines += ['', f'{"command":<28} {header}']
+            commands = sorted(self.commands.items(), key=lambda item: -item[1].total)
+            for cmd, durations in commands[:slowest]:
+                lines.append(self._row(cmd, durations))
+
+            lines += ['', f'{"slowest hosts":<28} {"wall (s)":>10} {"round trips":>12}']
+            walls = sorted(((last - first, host) for host, (first, last) in self.hosts.items()), reverse=True)
+            for wall, host in walls[:slowest]:
+                lines.append(f'{str(host):<28} {wall:>10.3f} {self.round_trips.get(host, 0):>12}')
+
+            trips = sorted(self.round_trips.values())
+            if trips:
+                lines += ['', f'round trips per CPE: mean {sum(trips) / len(trips):.1f} / '
+                              f'p50 {percentile(trips, 50)} / p95 {percentile(trips, 95)} / max {trips[-1]}']
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _row(name, durations):
+        samples = sorted(durations.samples)
+        name = name if len(name) <= 28 else name[:25] + '...'
+        return (f'{name:<28} {durations.count:>8} {percentile(samples, 50):>10.3f} '
+                f'{percentile(samples, 95):>10.3f} {durations.max:>10.3f} {durations.total:>12.3f}')
+
+    def write(self, path):
+        """
+        Write the run profile summary to a file
+        :param path: The file to write
+        """
+        with open(path, 'w') as report_file:
+            report_file.write(self.report())
+        p_trace(f'Run profile written to {path}', 'PASS')
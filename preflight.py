@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import sinks
+import inventory
+from cmn_lib import p_trace, load_config
+
+"""
+A pre-flight reachability scan of Adaptiv Networks 7.X CPEs.
+
+The SSH port of every CPE of the inventory is probed with a plain TCP connect, many CPEs at
+a time, and each CPE is classed as reachable, slow (connected, but not within the slow
+threshold) or unreachable. agonyless.py runs the scan ahead of the logins when
+preflight.enabled is set, so dead CPEs cost one short probe instead of SSH timeouts and
+retries. Run standalone, the results are written to preflight.output.
+"""
+
+REACHABLE = 'reachable'
+SLOW = 'slow'
+UNREACHABLE = 'unreachable'
+
+
+class Preflight(object):
+    """
+    Probes the SSH port of CPEs and keeps the outcome. Only the slow and unreachable hosts
+    are listed, reachable ones are counted.
+    """
+
+    def __init__(self, timeout=3, slow=1.0, workers=256):
+        """
+        :param timeout: Max seconds to wait for a TCP connection
+        :param slow: Seconds above which a connection is reported as slow
+        :param workers: The maximum number of probes in flight
+        """
+        self.timeout = timeout
+        self.slow = slow
+        self.workers = max(1, int(workers))
+        self.reachable = 0
+        self.slow_hosts = []
+        self.unreachable_hosts = []
+
+    def probe(self, host, port):
+        """
+        :param host: The CPE
+        :param port: Its SSH port
+        :return: A tuple of the status, the seconds the probe took and the error, None when none
+        """
+        start = time.perf_counter()
+        try:
+            with socket.create_connection((host, int(port)), timeout=self.timeout):
+                pass
+        except OSError as error:
+            return UNREACHABLE, time.perf_counter() - start, str(error) or type(error).__name__
+        seconds = time.perf_counter() - start
+        return (SLOW if seconds >= self.slow else REACHABLE), seconds, None
+
+    def scan(self, targets, port_of):
+        """
+        Probe targets concurrently. Targets are consumed lazily, and results are returned as
+        probes complete, so the scan can feed a fleet run directly.
+        :param targets: An iterable of CPEs
+        :param port_of: A callable returning the SSH port of a target
+        :return: A generator of (target, status, seconds, error) tuples
+        """
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='preflight') as executor:
+            for target in targets:
+                if len(pending) >= self.workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield self._record(*future.result())
+                future = executor.submit(lambda t: (t, *self.probe(t, port_of(t))), target)
+                pending.add(future)
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield self._record(*future.result())
+
+    def _record(self, target, status, seconds, error):
+        if status == REACHABLE:
+            self.reachable += 1
+        elif status == SLOW:
+            self.slow_hosts.append(target)
+            p_trace(f'CPE {target} is slow to connect: {seconds:.2f}s', 'WARNING', host=target)
+        else:
+            self.unreachable_hosts.append(target)
+            p_trace(f'CPE {target} is unreachable - {error}', 'WARNING', host=target)
+        return target, status, seconds, error
+
+    def reachable_targets(self, targets, port_of):
+        """
+        :return: A generator of the targets that accept a TCP connection, slow ones included
+        """
+        for target, status, seconds, error in self.scan(targets, port_of):
+            if status != UNREACHABLE:
+                yield target
+
+    def summary(self):
+        """
+        :return: A one line human readable summary of the scan
+        """
+        return (f'Pre-flight: {self.reachable} reachable / {len(self.slow_hosts)} slow / '
+                f'{len(self.unreachable_hosts)} unreachable')
+
+
+def port_of(ne_conf):
+    """
+    :param ne_conf: The parsed config.yml
+    :return: A callable returning the SSH port of a target, overrides included
+    """
+    return lambda target: target.conf(ne_conf)['credentials']['port']
+
+
+def main(yaml_file='./config.yml'):
+    """
+    :param yaml_file: The config file
+    :return: True when every CPE is reachable
+    """
+    ne_conf = load_config(yaml_file)
+
+    preflight_conf = ne_conf.get('preflight', {})
+    scanner = Preflight(preflight_conf.get('timeout', 3), preflight_conf.get('slow', 1.0),
+                        preflight_conf.get('workers', 256))
+    network_entities = inventory.load_inventory(ne_conf['network_entities'],
+                                                os.path.dirname(os.path.abspath(yaml_file)))
+    output = preflight_conf.get('output')
+    try:
+        sink = sinks.open_sink(output, ['host', 'status', 'seconds', 'error']) if output else None
+    except ValueError as error:
+        p_trace(str(error), 'ERROR')
+        return False
+
+    try:
+        for target, status, seconds, error in scanner.scan(network_entities, port_of(ne_conf)):
+            if sink:
+                sink.write({'host': str(target), 'status': status, 'seconds': round(seconds, 3), 'error': error})
+    except ValueError as error:
+        p_trace(f'Pre-flight aborted - {error}', 'ERROR')
+        return False
+    finally:
+        if sink:
+            sink.close()
+
+    p_trace(scanner.summary(), 'PASS' if not scanner.unreachable_hosts else 'ERROR')
+    return not scanner.unreachable_hosts
+
+
+if __name__ == "__main__":
+
+    result = main()
+    if result:
+        exit(0)
+    else:
+        exit(1)
@@ -0,0 +1,137 @@
+import math
+from itertools import islice
+import fleet
+from cmn_lib import p_trace, trace_flush
+
+"""
+This file contains the wave scheduler of changes rolled out across the inventory.
+
+The CPEs are taken from the inventory in waves: a canary wave first, then waves growing
+geometrically, eg 1, 4, 16, 64... CPEs, up to max_wave. The waves run through one
+fleet.ShardPool, so the worker processes and their task setup serve every wave. The rollout
+halts as soon as a wave fails on more than max_failure_rate of its CPEs, or a wave could not
+be processed at all. Optionally
+the operator confirms each wave, having seen how the previous one went, so a fleet of
+thousands of CPEs is supervised in a handful of steps.
+"""
+
+# The default max number of CPEs of a wave. A wave is held in memory as a list.
+MAX_WAVE = 1000
+
+
+class Rollout(object):
+    """
+    Runs a task across the inventory wave after wave
+    """
+
+    def __init__(self, canary=1, growth=4, max_wave=MAX_WAVE, max_failure_rate=0.0, confirm=True):
+        """
+        :param canary: The number of CPEs of the first wave
+        :param growth: The factor each wave grows by over the previous one
+        :param max_wave: The max number of CPEs of a wave
+        :param max_failure_rate: The share of failed CPEs, between 0 and 1, above which a wave halts the rollout
+        :param confirm: When True the operator is prompted before each wave
+        """
+        if canary < 1 or growth < 1 or max_wave is None or max_wave < 1:
+            raise ValueError(f'Invalid rollout waves: canary {canary}, growth {growth}, max_wave {max_wave}')
+        if not isinstance(max_failure_rate, (int, float)) or not 0 <= max_failure_rate <= 1:
+            raise ValueError(f'Invalid rollout max_failure_rate {max_failure_rate}, expected a share between 0 and 1')
+        self.canary = int(canary)
+        self.growth = growth
+        self.max_wave = int(max_wave)
+        self.max_failure_rate = max_failure_rate
+        self.confirm = confirm
+        self.waves_done = 0
+        self.halted = False
+
+    @classmethod
+    def from_conf(cls, conf):
+        """
+        :param conf: The rollout section of config.yml, may be None
+        :return: The Rollout it describes
+        """
+        conf = conf or {}
+        return cls(canary=conf.get('canary', 1), growth=conf.get('growth', 4),
+                   max_wave=conf.get('max_wave') or MAX_WAVE, max_failure_rate=conf.get('max_failure_rate', 0.0),
+                   confirm=conf.get('confirm', True))
+
+    def sizes(self):
+        """
+        :return: A generator of the wave sizes, without end
+        """
+        size = self.canary
+        while True:
+            yield min(size, self.max_wave)
+            size = min(math.ceil(size * self.growth), self.max_wave)
+
+    def waves(self, targets):
+        """
+        :param targets: An iterable of network entities, consumed one wave at a time
+        :return: A generator of the waves, each a list of targets
+        """
+        targets = iter(targets)
+        for size in self.sizes():
+            wave = list(islice(targets, size))
+            if not wave:
+                return
+            yield wave
+
+    def _confirm(self, index, wave, run):
+        trace_flush()
+        done = f'{run.passed} passed / {run.failed} failed so far. ' if run.total else ''
+        try:
+            prompt = input(f'{done}About to update wave {index} of {len(wave)} CPEs, {wave[0]} first. '
+                           f'y to continue:\n')
+        except EOFError:
+            # No operator, eg stdin closed
+            prompt = None
+        if prompt != 'y':
+            p_trace('Quitting')
+            return False
+        return True
+
+    def run(self, targets, task_setup, processes=1, workers=1, on_result=None):
+        """
+        Run the task across targets, wave after wave, until they are all done or the rollout halts
+        :param targets: An iterable of network entities
+        :param task_setup: The task setup, entered once per process for every wave, see fleet.ShardPool
+        :param processes: The number of worker processes
+        :param workers: The maximum number of CPEs processed concurrently per process
+        :param on_result: Optional callable invoked with each record as soon as its host completes
+        :return: run - a FleetRun counting every CPE of the rollout. stopped is set when it halted.
+        """
+        run = fleet.FleetRun(keep_records=False)
+
+        def _add(record):
+            run.add(record)
+            if on_result:
+                on_result(record)
+
+        with fleet.ShardPool(task_setup, processes, workers) as shards:
+            for index, wave in enumerate(self.waves(targets), 1):
+                if self.confirm and not self._confirm(index, wave, run):
+                    run.stopped = True
+                    break
+
+                p_trace(f'Wave {index}: {len(wave)} CPEs', 'INFO')
+                wave_run = shards.run(wave, on_result=_add, keep_records=False)
+                self.waves_done = index
+                run.unprocessed += wave_run.unprocessed
+                run.errors.extend(wave_run.errors)
+                if wave_run.stopped or wave_run.errors or wave_run.total < len(wave):
+                    p_trace(f'Halting the rollout, only {wave_run.total} of the {len(wave)} CPEs of wave {index} '
+                            f'were processed', 'ERROR')
+                    self.halted = True
+                    run.stopped = True
+                    break
+                failure_rate = wave_run.failed / len(wave)
+                if failure_rate > self.max_failure_rate:
+                    p_trace(f'Halting the rollout, {wave_run.failed} of the {len(wave)} CPEs of wave {index} '
+                            f'failed, above the max failure rate of {self.max_failure_rate:.0%}', 'ERROR')
+                    self.halted = True
+                    run.stopped = True
+                    break
+
+        p_trace(f'Rollout of {self.waves_done} waves - {run.summary()}',
+                'PASS' if run.result and not run.stopped else 'ERROR')
+        return run
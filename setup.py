@@ -1,5 +1,5 @@
 
-from setuptools import setup, find_packages
+from setuptools import setup
 
 with open('README.md') as f:
     readme = f.read()
@@ -16,6 +16,9 @@ setup(
     author_email='sjackson@adaptiv-networks.com',
     url='https://github.com/TeloipInc/AgonyLess',
     license=f_license,
-    packages=find_packages(),
-    install_requires=['paramiko', 'pyyaml', 'colorama']
+    py_modules=['agonyless', 'async_ssh_drv', 'async_ssh_lib', 'audit', 'calibrate', 'cli', 'cmn_lib', 'dry_run',
+                'fact_cache', 'fleet', 'inventory', 'journal', 'output_buffer', 'perf_lib', 'preflight', 'rollout',
+                'sinks', 'ssh_drv', 'ssh_lib', 'ssh_profile', 'transcript'],
+    install_requires=['paramiko', 'pyyaml', 'colorama'],
+    entry_points={'console_scripts': ['agonyless = cli:main']}
 )
@@ -0,0 +1,103 @@
+import csv
+import json
+import os
+import sqlite3
+
+"""
+This file contains the sinks the per CPE records of a fleet run are written to, eg by audit.py.
+
+A sink writes each record as it is handed over and keeps nothing in memory, so the size of
+the fleet does not matter. The format follows the extension of the output file: .csv, .jsonl
+or .db/.sqlite (SQLite, appended to, so successive runs can be compared).
+"""
+
+
+class CsvSink(object):
+    """
+    Writes the rows to a CSV file, the header row first
+    """
+
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, record):
+        self.writer.writerow([record.get(column) for column in self.columns])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class JsonLinesSink(object):
+    """
+    Writes the rows to a file, one JSON object per line
+    """
+
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.file = open(path, 'w')
+
+    def write(self, record):
+        self.file.write(json.dumps({column: record.get(column) for column in self.columns}) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SqliteSink(object):
+    """
+    Appends the rows to the audit table of an SQLite database, adding the columns it misses
+    """
+
+    def __init__(self, path, columns, batch=100):
+        """
+        :param batch: The number of rows written per transaction
+        """
+        self.columns = columns
+        self.batch = batch
+        self.rows = []
+        self.db = sqlite3.connect(path)
+        quoted = [self._quote(column) for column in columns]
+        self.db.execute(f'CREATE TABLE IF NOT EXISTS audit ({", ".join(quoted)})')
+        existing = {row[1] for row in self.db.execute('PRAGMA table_info(audit)')}
+        for column, quoted_column in zip(columns, quoted):
+            if column not in existing:
+                self.db.execute(f'ALTER TABLE audit ADD COLUMN {quoted_column}')
+        self.insert = f'INSERT INTO audit ({", ".join(quoted)}) VALUES ({", ".join("?" * len(columns))})'
+
+    @staticmethod
+    def _quote(column):
+        return '"' + column.replace('"', '""') + '"'
+
+    def write(self, record):
+        self.rows.append(tuple(record.get(column) for column in self.columns))
+        if len(self.rows) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        with self.db:
+            self.db.executemany(self.insert, self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+
+SINKS = {'.csv': CsvSink, '.jsonl': JsonLinesSink, '.db': SqliteSink, '.sqlite': SqliteSink}
+
+
+def open_sink(path, columns):
+    """
+    :param path: The output file, its extension selects the format
+    :param columns: The columns of the rows
+    :return: The sink the rows are written to
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SINKS:
+        raise ValueError(f'Unsupported output {path}, expected one of {list(SINKS)}')
+    return SINKS[extension](path, columns)
@@ -1,8 +1,13 @@
 import paramiko
+import codecs
+import select
+import socket
 import time
 import re
-import pdb
-from cmn_lib import p_trace
+import transcript
+from output_buffer import OutputBuffer, SPILL_BYTES
+from cmn_lib import p_trace, trace_enabled
+from perf_lib import span
 
 """
 This file contains the class that implements the ssh interface to a
@@ -14,6 +19,237 @@ in a different location, chain the commands together. Eg 'cd /new/dir ; ls -al'
 """
 
 
+# Maximum number of bytes read from the raw channel per recv call
+RECV_BUFSIZE = 65536
+
+# Cap of the exponential backoff between connection attempts, in seconds
+MAX_RETRY_DELAY = 30
+
+# Matchers used by RawResponse, compiled once
+_RAW_EVENT = re.compile(r'Admin Password|\(Yes/No\) \?|saveconfig')
+_PROMPT_END = re.compile(r'(?:# |> |#    )$')
+_BANNER_PROMPT = re.compile(r'\r\n([^\r\n]*)>\s*$')
+
+
+class LineSplitter(object):
+    """
+    Splits a stream of bytes into lines as chunks of it arrive. Lines end with a new line, a
+    carriage return before it is dropped, like readline did.
+    """
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.partial = ''
+        self.lines = []
+
+    def feed(self, data):
+        """
+        :param data: The next chunk of bytes
+        """
+        text = self.partial + self.decoder.decode(data)
+        lines = text.split('\n')
+        # What follows the last new line is completed by the next chunk
+        self.partial = lines.pop()
+        self.lines.extend(line.rstrip('\r') for line in lines)
+
+    def flush(self):
+        """
+        Turn what follows the last new line into a line, once the stream is complete
+        """
+        text = self.partial + self.decoder.decode(b'', True)
+        if text:
+            self.lines.append(text.rstrip('\r'))
+        self.partial = ''
+
+    def pop(self):
+        """
+        :return: The complete lines received since the last call
+        """
+        lines = self.lines
+        self.lines = []
+        return lines
+
+
+def _is_interactive(cmd):
+    """
+    :return: True when cmd can be answered by a password challenge or a confirmation
+    """
+    return cmd in ['admin', 'level3', 'diag', '/diag'] or 'set password' in cmd or cmd.startswith('save ')
+
+
+class RawResponse(object):
+    """
+    Incremental parser for the output of a single command sent over the raw (AgniOS) channel.
+
+    Data is fed in whatever chunks the channel returns. Complete lines are split off as they
+    arrive, and password challenges, confirmations and the closing prompt are only searched
+    for in the data that has not been scanned yet.
+    """
+
+    def __init__(self, ssh, cmd, next_cmd=None, lines=None):
+        """
+        :param ssh: The SSH instance the command was sent on, used for passwords and the prompt
+        :param cmd: The command that was sent
+        :param next_cmd: The command typed ahead after cmd by send_batch. Its echo right after
+                         the prompt also ends the output of cmd.
+        :param lines: What the output lines are appended to, eg an OutputBuffer. A list when None.
+        """
+        self.ssh = ssh
+        self.cmd = cmd
+        self.next_cmd = next_cmd
+        self.remainder = ''
+        self.lines = lines if lines is not None else []
+        self.result = True
+        self.done = False
+        self.skip_fst_line = True
+        self.buf = ''
+        self.scanned = 0
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    def feed(self, data, more_pending=False):
+        """
+        Consume a chunk of data received from the channel
+        :param data: The bytes received
+        :param more_pending: True when the channel already holds more data. A trailing prompt
+                             look-alike is then part of the output rather than the prompt.
+        :return: replies - a list of strings to be sent back to the channel, in order
+        """
+        replies = []
+        buf = self.buf + self.decoder.decode(data).replace('\t', '    ')
+        start = 0
+        # Everything before scan_from was already searched by a previous call
+        scan_from = max(0, self.scanned - 14)
+
+        while True:
+            eol = buf.find('\r\n', start)
+            end = eol if eol >= 0 else len(buf)
+
+            if buf.startswith('Password:', start, end):
+                replies.append(self._answer_passwd(buf[start:start + 9]))
+                start = scan_from = start + 9
+                continue
+
+            m = _RAW_EVENT.search(buf, max(start, scan_from), end)
+            if m:
+                if m.group() == 'Admin Password':
+                    replies.append(self._answer_passwd(buf[start:m.end()]))
+                elif m.group() == 'saveconfig':
+                    replies.append('yes\n')
+                else:
+                    replies.append('y\n')
+                start = scan_from = m.end()
+                continue
+
+            if eol < 0:
+                break
+
+            line = buf[start:eol]
+            if self.next_cmd and line.endswith(self.next_cmd) and \
+                    _PROMPT_END.search(line, 0, len(line) - len(self.next_cmd)):
+                # Prompt followed by the echo of the typed ahead command
+                self._set_prompt(line[:-len(self.next_cmd)])
+                self.done = True
+                self.remainder = buf[eol - len(self.next_cmd):]
+                self.buf = ''
+                return replies
+
+            start = scan_from = eol + 2
+            if line:
+                if self.skip_fst_line:
+                    self.skip_fst_line = False
+                else:
+                    self.lines.append(line)
+                # Look for errors
+                if line.startswith('% '):
+                    self.result = False
+
+        self.buf = buf[start:]
+        self.scanned = len(self.buf)
+        if not more_pending and _PROMPT_END.search(self.buf):
+            self._set_prompt(self.buf)
+            self.done = True
+        return replies
+
+    def _answer_passwd(self, challenge):
+        """
+        :param challenge: The text of the password challenge
+        :return: The password matching the command that triggered the challenge
+        """
+        cmd = self.cmd
+        password = 'unknown'
+        if cmd == 'admin' or 'set password' in cmd:
+            password = self.ssh.admin_passwd
+        elif cmd == 'level3':
+            password = self.ssh.l3_password
+        elif cmd == 'diag' or cmd == '/diag':
+            password = self.ssh.diag_passwd
+
+        p_trace(f'  <--  {challenge}')
+        p_trace(f"  -->  '{password}' to {self.ssh.sys_name} ({self.ssh.host_id})")
+        return f'{password}\n'
+
+    def _set_prompt(self, line):
+        """
+        Record the prompt that ended the command output on the SSH instance
+        :param line: The trailing partial line holding the prompt
+        """
+        line = line.replace(' ', '')
+        # non diag prompts
+        m = re.search(f'(.*)({self.ssh.sys_name}.*)', line)
+        if m:
+            self.ssh.prompt = m.group(2)
+        # diag (bsd shell) prompt
+        if 'root@' in line:
+            self.ssh.prompt = line
+        self.ssh._update_cli_state()
+
+
+class CommandStream(object):
+    """
+    Iterates over the output lines of one command as they are received, see SSH.stream
+    """
+
+    def __init__(self, ssh, cmd, suppress_logs=False):
+        self.ssh = ssh
+        self.cmd = cmd
+        self.suppress_logs = suppress_logs
+        self.result = None
+
+    def __iter__(self):
+        ssh = self.ssh
+        if ssh.io_mode == 'standard':
+            self.result, lines = ssh.send(self.cmd, self.suppress_logs)
+            yield from lines or []
+            return
+
+        p_trace(f"  -->  '{self.cmd}' to {ssh.sys_name} ({ssh.host_id})")
+        log_lines = not self.suppress_logs and trace_enabled()
+        ssh.channel.setblocking(1)
+        ssh.channel.send(f'{self.cmd}\n')
+        response = RawResponse(ssh, self.cmd)
+
+        while not response.done:
+            data = ssh.channel.recv(RECV_BUFSIZE)
+            if not data:
+                p_trace(f'Channel to {ssh.host_id} closed before the prompt was received', 'ERROR')
+                response.result = False
+                break
+            for reply in response.feed(data, ssh.channel.recv_ready()):
+                ssh.channel.send(reply)
+
+            # Hand over the complete lines received so far, without keeping them
+            lines = response.lines
+            response.lines = []
+            for line in lines:
+                if log_lines:
+                    p_trace(f'  <--  {line}')
+                yield line
+
+        if self.suppress_logs:
+            p_trace('  <--  output of last cmd intentionally suppressed')
+        self.result = response.result
+
+
 class SSH(object):
     """
     Establishes an SSH session to a remote system, and then handles commands and command output
@@ -36,6 +272,21 @@ class SSH(object):
         self.admin_passwd = 'agni123'
         self.l3_password = 'c4n4d4DRY'
         self.diag_passwd = 'dp9747ST'
+        self.banner_timeout = 30
+        self.connect_timeout = 10
+        self.auth_timeout = 30
+        self.retries = 2
+        self.retry_delay = 1
+        self.cli_state = None
+        self.diag_return = None
+        self.nav_count = 0
+        self.transcript = None
+        self.replay = None
+        self.replay_speed = 0
+        self.fact_cache = None
+        self.boot_checked = False
+        self.profile = None
+        self.output_spill = SPILL_BYTES
 
     def open(self, host_id, sys_name, user_name, password, **kwargs):
         """
@@ -47,6 +298,45 @@ class SSH(object):
         :param kwargs: Optional args are:
                         port - the SSHD port
                         role - When <cpe|cc|rs> implies Adaptiv based host (Agnios is an app and must use raw output)
+                        banner_timeout - Max seconds to wait for the SSH banner, and for the AgniOS welcome
+                                         banner and prompt
+                        connect_timeout - Max seconds to wait for the TCP connection
+                        auth_timeout - Max seconds to wait for the authentication
+                        retries - Number of times a connection failing other than on authentication is retried
+                        retry_delay - Seconds before the first retry, doubled at each retry
+                        transcript - A file the raw (AgniOS) session is recorded to, see transcript.py
+                        replay - A transcript file replayed instead of connecting to host_id
+                        replay_speed - 0 to replay as fast as possible (default), 1 for the recorded timing
+                        fact_cache - A fact_cache.FactCache the ssh_lib helpers take facts from
+                        profile - A ssh_profile.ConnectionProfile: known hosts, auth and algorithm preferences
+                        output_spill - Bytes of command output above which it is spilled to disk, None to never spill
+        :return: True or False based on success of establishing ssh connection
+        """
+        result = self._connect(host_id, sys_name, user_name, password, **kwargs)
+
+        if result:
+            if self.role != 'cpe' and self.role != 'cc':
+                self._detect_os()
+            else:
+                # Adaptiv AgniShell
+                self.os = 'AgniOS'
+                self.cpu = '64Bit'
+                self.io_mode = 'raw'
+                self.channel = self._record(self.fh_ssh.invoke_shell(), password)
+
+                # Wait for the complete welcome banner, which ends with the monitor prompt
+                with span('banner_wait', host_id):
+                    m_prompt, welcome_msg = self.expect(_BANNER_PROMPT, self.banner_timeout)
+                self._parse_banner(m_prompt, welcome_msg)
+
+            log_string = f'SSH connection established with {host_id} ({sys_name}) : {self.os}/{self.cpu}'
+            p_trace(log_string, 'PASS')
+        # p_trace(log_string)
+        return result
+
+    def _connect(self, host_id, sys_name, user_name, password, **kwargs):
+        """
+        Unpacks the optional args of open and establishes the authenticated SSH connection
         :return: True or False based on success of establishing ssh connection
         """
         self.host_id = host_id
@@ -65,81 +355,224 @@ class SSH(object):
                 self.monitor_passwd = value
             if name == 'admin_passwd':
                 self.admin_passwd = value
+            if name == 'banner_timeout':
+                self.banner_timeout = value
+            if name == 'connect_timeout':
+                self.connect_timeout = value
+            if name == 'auth_timeout':
+                self.auth_timeout = value
+            if name == 'retries':
+                self.retries = value
+            if name == 'retry_delay':
+                self.retry_delay = value
+            if name == 'transcript':
+                self.transcript = value
+            if name == 'replay':
+                self.replay = value
+            if name == 'replay_speed':
+                self.replay_speed = value
+            if name == 'fact_cache':
+                self.fact_cache = value
+            if name == 'profile':
+                self.profile = value
+            if name == 'output_spill':
+                self.output_spill = value
 
         p_trace(f'Attempting to establish ssh connection to '
                 f'{host_id}:{self.port} as {user_name} / {password}', 'DEBUG')
 
+        attempt = 0
+        while True:
+            try:
+                if self.replay:
+                    self.fh_ssh = transcript.ReplayClient(self.replay, self.replay_speed)
+                else:
+                    self.fh_ssh = self._new_client(host_id, user_name, password)
+            except paramiko.AuthenticationException:
+                log_string = f'Authentication failed when connecting to {host_id} as {user_name} / {password}'
+                p_trace(log_string, 'ERROR')
+                result = False
+            except paramiko.BadHostKeyException:
+                log_string = 'The host key given by the SSH server did not match what we were expecting'
+                p_trace(log_string, 'ERROR')
+                result = False
+            except (OSError, EOFError, paramiko.SSHException) as error:
+                # Unreachable, timed out or dropped, worth another attempt
+                if attempt < self.retries:
+                    delay = min(self.retry_delay * 2 ** attempt, MAX_RETRY_DELAY)
+                    p_trace(f'Connection to {host_id}:{self.port} failed - {error or type(error).__name__}, '
+                            f'retrying in {delay}s', 'WARNING')
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                log_string = f'Unable to connect to {host_id}:{self.port} after {attempt + 1} attempts - ' \
+                             f'{error or type(error).__name__}'
+                p_trace(log_string, 'ERROR')
+                result = False
+            break
+
+        return result
+
+    def _new_client(self, host_id, user_name, password):
+        """
+        :return: A new SSHClient connected and authenticated to host_id
+        """
+        with span('tcp_connect', host_id):
+            sock = socket.create_connection((host_id, int(self.port)), timeout=self.connect_timeout)
+        client = paramiko.SSHClient()
+        connect_args = {}
+        if self.profile:
+            client.set_missing_host_key_policy(self.profile.policy())
+            connect_args = self.profile.connect_args(host_id, self.port)
+        else:
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         try:
-            self.fh_ssh = paramiko.SSHClient()
-            self.fh_ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            self.fh_ssh.connect(host_id, port=self.port, username=user_name, password=password, timeout=60)
-        except paramiko.AuthenticationException:
-            log_string = f'Authentication failed when connecting to {host_id} as {user_name} / {password}'
-            p_trace(log_string, 'ERROR')
-            result = False
-        except paramiko.BadHostKeyException:
-            log_string = 'The host key given by the SSH server did not match what we were expecting'
-            p_trace(log_string, 'ERROR')
-            result = False
+            # Key exchange and authentication over the connected socket
+            with span('ssh_handshake', host_id):
+                client.connect(host_id, port=self.port, username=user_name, password=password,
+                               timeout=self.connect_timeout, banner_timeout=self.banner_timeout,
+                               auth_timeout=self.auth_timeout, sock=sock, **connect_args)
+        except Exception:
+            sock.close()
+            raise
+        return client
 
-        if result:
-            if self.role != 'cpe' and self.role != 'cc':
-                # Determine host OS and CPU
-                uname = self.send('uname -a')[1][0]
-                if re.search(r'^Linux', uname):
-                    self.os = 'Linux'
-                    if re.search('x86_64', uname):
-                        self.cpu = '64Bit'
-                    else:
-                        self.cpu = '32Bit'
-                elif re.search('CYGWIN_NT-6.1-WOW64', uname):
-                    # Applies to Windows 7 and SRV 2008 R1
-                    self.os = 'Windows7'
-                    self.cpu = '64Bit'
-                elif re.search('CYGWIN_NT-6.3-WOW64', uname):
-                    # Applies to SRV 2012 R2
-                    self.cpu = '64Bit'
-                    self.os = 'Server2012R2'
-                elif re.search('CYGWIN_NT-6.2-WOW64', uname):
-                    self.os = 'Windows8.0'
-                    self.cpu = '64Bit'
-                elif re.search('CYGWIN_NT-6.3', uname):
-                    self.os = 'Windows8.1'
-                    self.cpu = '64Bit'
-                elif re.search('CYGWIN_NT-6.4-WOW64', uname):
-                    self.os = 'Windows10'
-                    self.cpu = '64Bit'
-                elif re.search('CYGWIN_NT-10.0', uname):
-                    self.os = 'Windows10'
-                    self.cpu = '64Bit'
-                elif re.search('CYGWIN_NT-6.1', uname):
-                    self.os = 'Windows7'
-                    self.cpu = '32Bit'
-            else:
-                # Adaptiv AgniShell
-                self.os = 'AgniOS'
+    def _record(self, channel, password):
+        """
+        :param channel: The raw channel just opened
+        :param password: The password the session logged in with, masked in the transcript
+        :return: channel, wrapped in a transcript.TranscriptRecorder when the session is recorded
+        """
+        if not self.transcript:
+            return channel
+        return transcript.TranscriptRecorder(
+            channel, self.transcript, {'host_id': self.host_id, 'port': self.port, 'sys_name': self.sys_name},
+            [password, self.monitor_passwd, self.admin_passwd, self.l3_password, self.diag_passwd])
+
+    def close(self):
+        """
+        Close the session and its connection
+        """
+        if self.channel:
+            self.channel.close()
+            self.channel = None
+        if self.fh_ssh:
+            self.fh_ssh.close()
+            self.fh_ssh = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _detect_os(self):
+        """
+        Determine host OS and CPU of a non Adaptiv host
+        """
+        # Not self.send, which is a coroutine on an AsyncSSH running this in an executor
+        uname = SSH.send(self, 'uname -a')[1][0]
+        if re.search(r'^Linux', uname):
+            self.os = 'Linux'
+            if re.search('x86_64', uname):
                 self.cpu = '64Bit'
-                self.io_mode = 'raw'
-                self.channel = self.fh_ssh.invoke_shell()
-
-                time.sleep(1)
-                welcome_msg = self.channel.recv(9999).decode("ascii")
-                m_ver = re.search('(Version )(\\d.\\d.\\d-RELEASE)', welcome_msg)
-                m_prompt = re.search('(\r\n)(.*)(>)', welcome_msg)
-                if m_prompt:
-                    self.prompt = f'{m_prompt.group(2)}{m_prompt.group(3)}'
-                    # Overwrite callers sysname - used later to fish out the prompt
-                    self.sys_name = m_prompt.group(2)
-                else:
-                    p_trace('Unable to determine prompt, needed to know when commands complete', 'ERROR')
-                if m_ver:
-                    self.os = f'AgniOS-{m_ver.group(2)}'
-                p_trace(welcome_msg)
+            else:
+                self.cpu = '32Bit'
+        elif re.search('CYGWIN_NT-6.1-WOW64', uname):
+            # Applies to Windows 7 and SRV 2008 R1
+            self.os = 'Windows7'
+            self.cpu = '64Bit'
+        elif re.search('CYGWIN_NT-6.3-WOW64', uname):
+            # Applies to SRV 2012 R2
+            self.cpu = '64Bit'
+            self.os = 'Server2012R2'
+        elif re.search('CYGWIN_NT-6.2-WOW64', uname):
+            self.os = 'Windows8.0'
+            self.cpu = '64Bit'
+        elif re.search('CYGWIN_NT-6.3', uname):
+            self.os = 'Windows8.1'
+            self.cpu = '64Bit'
+        elif re.search('CYGWIN_NT-6.4-WOW64', uname):
+            self.os = 'Windows10'
+            self.cpu = '64Bit'
+        elif re.search('CYGWIN_NT-10.0', uname):
+            self.os = 'Windows10'
+            self.cpu = '64Bit'
+        elif re.search('CYGWIN_NT-6.1', uname):
+            self.os = 'Windows7'
+            self.cpu = '32Bit'
 
-            log_string = f'SSH connection established with {host_id} ({sys_name}) : {self.os}/{self.cpu}'
-            p_trace(log_string, 'PASS')
-        # p_trace(log_string)
-        return result
+    def _parse_banner(self, m_prompt, welcome_msg):
+        """
+        Memo the prompt, system name and AgniOS version from the welcome banner
+        :param m_prompt: The match of _BANNER_PROMPT on the banner, None when no prompt was seen
+        :param welcome_msg: The complete welcome banner
+        """
+        m_ver = re.search('(Version )(\\d.\\d.\\d-RELEASE)', welcome_msg)
+        if m_prompt:
+            self.prompt = f'{m_prompt.group(1)}>'
+            # Overwrite callers sysname - used later to fish out the prompt
+            self.sys_name = m_prompt.group(1)
+            self._update_cli_state()
+        else:
+            p_trace('Unable to determine prompt, needed to know when commands complete', 'ERROR')
+        if m_ver:
+            self.os = f'AgniOS-{m_ver.group(2)}'
+        p_trace(welcome_msg)
+
+    def _update_cli_state(self):
+        """
+        Derive the position in the AgniOS CLI hierarchy from the prompt. cli_state is one of
+        'diag', 'monitor', 'Admin' or the name of a node, None when the prompt is not recognised.
+        """
+        prompt = self.prompt or ''
+        if 'root@' in prompt:
+            state = 'diag'
+        elif prompt.endswith('>'):
+            state = 'monitor'
+        elif f'{self.sys_name}-' in prompt:
+            state = prompt.split(f'{self.sys_name}-', 1)[1].rstrip('#')
+        else:
+            state = None
+
+        if state == 'diag' and self.cli_state != 'diag':
+            # exit from diag returns to where it was entered
+            self.diag_return = self.cli_state
+        self.cli_state = state
+
+    def expect(self, pattern, timeout):
+        """
+        Read from the raw channel until the received text matches pattern, or until the
+        deadline passes. Returns as soon as the match is seen.
+        :param pattern: A compiled regex searched for in all the text received so far
+        :param timeout: The max number of seconds to wait for the match
+        :return: A tuple of the match object (None when not found) and the text received
+        """
+        deadline = time.time() + timeout
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        text = ''
+        m = None
+
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                p_trace(f'Timed out after {timeout}s waiting for {pattern.pattern!r} from {self.host_id}', 'WARNING')
+                break
+            self.channel.settimeout(remaining)
+            try:
+                data = self.channel.recv(RECV_BUFSIZE)
+            except socket.timeout:
+                continue
+            if not data:
+                p_trace(f'Channel to {self.host_id} closed while waiting for {pattern.pattern!r}', 'ERROR')
+                break
+            text += decoder.decode(data)
+            m = pattern.search(text)
+            if m:
+                break
+
+        self.channel.settimeout(None)
+        return m, text
 
     def send(self, cmd, suppress_logs=False):
         """
@@ -147,129 +580,162 @@ class SSH(object):
         usable list format.
         :param cmd: The command to execute on the remote system
         :param suppress_logs: When True, the stdout will be suppressed and not printed to screen or the log file
-        :return: ssh_response - a tuple consisting of the cmd result <True|False> and a
-                 list consisting of stdout or stderr of the provided command
+        :return: ssh_response - a tuple consisting of the cmd result <True|False> and an
+                 OutputBuffer, a list-like of the stdout or stderr lines of the provided command.
+                 Outputs larger than output_spill bytes are held on disk.
         """
         cmd_result = True
         p_trace(f"  -->  '{cmd}' to {self.sys_name} ({self.host_id})")
+        # Skip building the per line traces when they would be dropped
+        log_lines = not suppress_logs and trace_enabled()
 
-        ssh_response = []
-        if self.io_mode == 'standard':
-            try:
-                stdin, stdout, stderr = self.fh_ssh.exec_command(cmd)
-            except ValueError as error:
-                root_logger.exception(f'SendSSH command failed - {error}')
-                ssh_result = (False, False)
-                return ssh_result
-
-            while True:
-                standard_out = stdout.readline()
-                standard_error = stderr.readline()
-
-                # Format the response data
-                if standard_out:
-                    line = standard_out
-                    # Strip out initial blank space, new lines and carriage returns
-                    line = re.sub(r'\r', '', line)
-                    line_rgx = re.search(r"(.*)(\n)", line)
-                    line2 = line_rgx.group(1)
-                    ssh_response.append(line2)
-                    if not suppress_logs:
-                        p_trace('  <--  %s' % line2)
-
-                if standard_error:
-                    line = standard_error
-                    line_rgx = re.search(r"(.*)(\r|\n)", line)
-                    line = line_rgx.group(1)
-                    ssh_response.append(line)
-                    # This is odd, but sometimes psutils sends stdout to stderror
-                    # Suppress to keep the logs clean
-                    if re.search(r'pstools', cmd) and not suppress_logs:
-                        p_trace(line)
-                    else:
-                        p_trace(line, 'ERROR')
-                        cmd_result = False
+        with span('send', self.host_id, cmd):
+            ssh_response = OutputBuffer(self.output_spill)
+            if self.io_mode == 'standard':
+                try:
+                    stdin, stdout, stderr = self.fh_ssh.exec_command(cmd)
+                except (ValueError, paramiko.SSHException) as error:
+                    p_trace(f'SendSSH command failed - {error}', 'ERROR')
+                    ssh_result = (False, False)
+                    return ssh_result
 
-                if not standard_out and not standard_error:
-                    p_trace('  <--  previous command returned no output')
-                    break
+                # Drain both streams as data arrives on either of them, until the command exits
+                channel = stdout.channel
+                out_lines = LineSplitter()
+                err_lines = LineSplitter()
+                done = False
+                while not done:
+                    if channel.recv_ready():
+                        out_lines.feed(channel.recv(RECV_BUFSIZE))
+                    elif channel.recv_stderr_ready():
+                        err_lines.feed(channel.recv_stderr(RECV_BUFSIZE))
+                    elif (channel.eof_received or channel.closed or channel.exit_status_ready()) and \
+                            not channel.recv_ready() and not channel.recv_stderr_ready():
+                        # Everything sent before the exit status or EOF has been drained
+                        out_lines.flush()
+                        err_lines.flush()
+                        done = True
+                    else:
+                        # The channel fileno is readable once data arrives on either stream or it closes
+                        select.select([channel], [], [], 1)
 
-            if suppress_logs:
-                p_trace('  <--  output of last cmd intentionally suppressed')
+                    # Format the response data
+                    for line in out_lines.pop():
+                        ssh_response.append(line)
+                        if log_lines:
+                            p_trace(f'  <--  {line}')
 
-        else:
-            # RAW CHANNEL MODE required for Adaptiv AgniOS
-            self.channel.setblocking(1)
-            self.channel.send(f'{cmd}\n')
-            lines = []
-            line = ''
-            skip_fst_line = True
-
-            while True:
-                #line += self.channel.recv(1).decode('ascii')
-                t = 1
-                if 'set password' in cmd:
-                    t = 10
-                line += self.channel.recv(t).decode('utf-8')
-
-                line = line.replace('\t', '    ')
-                password = 'unknown'
-
-                if line.startswith('Password:') or 'Admin Password' in line:
-                    if cmd == 'admin' or 'set password' in cmd:
-                        password = self.admin_passwd
-                    elif cmd == 'level3':
-                        password = self.l3_password
-                    elif cmd == 'diag' or cmd == '/diag':
-                        password = self.diag_passwd
-
-                    p_trace(f'  <--  {line}')
-                    p_trace(f"  -->  '{password}' to {self.sys_name} ({self.host_id})")
-                    self.channel.send(f'{password}\n')
-                    line = ''
-
-                elif line.endswith('(Yes/No) ?'):
-                    self.channel.send(f'y\n')
-                    line = ''
-
-                elif 'saveconfig' in line:
-                    self.channel.send(f'yes\n')
-                    line = ''
-
-                elif line.endswith('\r\n'):
-                    if len(line) > 2:
-                        line = line.replace('\r\n', '')
-                        if skip_fst_line:
-                            skip_fst_line = False
+                    for line in err_lines.pop():
+                        ssh_response.append(line)
+                        # This is odd, but sometimes psutils sends stdout to stderror
+                        # Suppress to keep the logs clean
+                        if 'pstools' in cmd and not suppress_logs:
+                            p_trace(line)
                         else:
-                            lines += [line]
-                        # Look for errors
-                        if line.startswith('% '):
+                            p_trace(line, 'ERROR')
                             cmd_result = False
-                        line = ''
-
-                elif line.endswith('# ') or line.endswith('> ') or line.endswith('#    '):
-                    line = line.replace('\r\n', '')
-                    line = line.replace(' ', '')
-                    # non diag prompts
-                    m = re.search(f'(.*)({self.sys_name}.*)', line)
-                    if m:
-                        self.prompt = m.group(2)
-                    # diag (bsd shell) prompt
-                    m2 = re.search(f'(root@)', line)
-                    if m2:
-                        self.prompt = line
-                    break
-
-            if not suppress_logs:
-                for line in lines:
-                    ssh_response.append(line)
-                    p_trace(f'  <--  {line}')
+
+                if not ssh_response:
+                    p_trace('  <--  previous command returned no output')
+                if suppress_logs:
+                    p_trace('  <--  output of last cmd intentionally suppressed')
+
             else:
-                for line in lines:
-                    ssh_response.append(line)
-                p_trace('  <--  output of last cmd intentionally suppressed')
+                # RAW CHANNEL MODE required for Adaptiv AgniOS
+                self.channel.setblocking(1)
+                self.channel.send(f'{cmd}\n')
+                # The lines are appended to ssh_response as they arrive
+                response = RawResponse(self, cmd, lines=ssh_response)
+                self._raw_receive(response)
+                cmd_result = response.result
 
+                if log_lines:
+                    for line in ssh_response:
+                        p_trace(f'  <--  {line}')
+                elif suppress_logs:
+                    p_trace('  <--  output of last cmd intentionally suppressed')
 
         ssh_result = (cmd_result, ssh_response)
         return ssh_result
+
+    def _raw_receive(self, response):
+        """
+        Feed the raw channel to response until its closing prompt is seen
+        :param response: The RawResponse of the command in flight
+        """
+        if response.buf:
+            # Left over from the previous command of a batch
+            for reply in response.feed(b'', self.channel.recv_ready()):
+                self.channel.send(reply)
+
+        while not response.done:
+            data = self.channel.recv(RECV_BUFSIZE)
+            if not data:
+                p_trace(f'Channel to {self.host_id} closed before the prompt was received', 'ERROR')
+                response.result = False
+                break
+            for reply in response.feed(data, self.channel.recv_ready()):
+                self.channel.send(reply)
+
+    def stream(self, cmd, suppress_logs=False):
+        """
+        Send a command and iterate over its output lines as they arrive, instead of waiting
+        for the prompt. Meant for long running commands.
+        :param cmd: The command to execute on the remote system
+        :param suppress_logs: When True, the output is not printed to screen or the log file
+        :return: A CommandStream yielding the output lines. Its result attribute holds the
+                 cmd result <True|False> once the iteration is complete.
+        """
+        return CommandStream(self, cmd, suppress_logs)
+
+    def send_batch(self, cmds, suppress_logs=False):
+        """
+        Send several commands over the raw (AgniOS) channel with as few round trips as possible.
+
+        Commands are written back to back, and the output is split on the prompt that precedes
+        the echo of the next command. A command that can raise a password challenge or a
+        confirmation is always the last one written before waiting, so the typed ahead commands
+        are never taken as the answer.
+        :param cmds: A list of commands to execute, in order
+        :param suppress_logs: When True, the output is not printed to screen or the log file
+        :return: A list with one (cmd result, output lines) tuple per command, like send
+        """
+        if self.io_mode == 'standard':
+            return [self.send(cmd, suppress_logs) for cmd in cmds]
+
+        self.channel.setblocking(1)
+        log_lines = not suppress_logs and trace_enabled()
+        results = []
+        leftover = None
+        first = 0
+        while first < len(cmds):
+            # Write up to and including the next interactive command
+            last = first
+            while last < len(cmds) - 1 and not _is_interactive(cmds[last]):
+                last += 1
+            group = cmds[first:last + 1]
+            for cmd in group:
+                p_trace(f"  -->  '{cmd}' to {self.sys_name} ({self.host_id})")
+
+            with span('send_batch', self.host_id, ' ; '.join(group)):
+                self.channel.send(''.join(f'{cmd}\n' for cmd in group))
+                responses = []
+                for i in range(first, last + 1):
+                    next_cmd = cmds[i + 1] if i < last else None
+                    response = RawResponse(self, cmds[i], next_cmd, OutputBuffer(self.output_spill))
+                    if leftover:
+                        response.buf, response.decoder = leftover
+                    self._raw_receive(response)
+                    leftover = (response.remainder, response.decoder)
+                    responses.append(response)
+
+            for response in responses:
+                if log_lines:
+                    for line in response.lines:
+                        p_trace(f'  <--  {line}')
+                elif suppress_logs:
+                    p_trace('  <--  output of last cmd intentionally suppressed')
+                results.append((response.result, response.lines))
+            first = last + 1
+
+        return results
@@ -1,8 +1,10 @@
 import datetime
 import time
 import re
-import pdb
+from collections import deque
 from cmn_lib import p_trace
+from perf_lib import span
+from fact_cache import parse_uptime
 
 """
 This library is meant to be used in conjunction with ssh_drv instances.
@@ -12,35 +14,103 @@ are performed on the local host.
 """
 
 
+def open_cpe(fh_ssh, ne, ne_conf, monitor_passwd=None, admin_passwd=None, **kwargs):
+    """
+    Open a session to a CPE with the credentials and the connection section of the config
+    :param fh_ssh: A new SSH instance, or AsyncSSH in which case the coroutine is returned
+    :param ne: The IP address of the CPE
+    :param ne_conf: The parsed config.yml, with the overrides of the CPE applied
+    :param monitor_passwd: The monitor password logged in with, the credentials one when None
+    :param admin_passwd: The admin password, the credentials one when None
+    :param kwargs: More optional args of SSH.open, eg fact_cache or transcript
+    :return: The result of fh_ssh.open
+    """
+    credentials = ne_conf['credentials']
+    monitor_passwd = monitor_passwd or credentials['monitor']
+    admin_passwd = admin_passwd or credentials['admin']
+    return fh_ssh.open(ne, credentials['role'], credentials['uname'], monitor_passwd, port=credentials['port'],
+                       role=credentials['role'], monitor_passwd=monitor_passwd, admin_passwd=admin_passwd,
+                       **dict(ne_conf.get('connection') or {}, **kwargs))
+
+
+def _cli_moves(cli_state, cli_node, diag_return):
+    """
+    The navigation commands available at a position of the CLI hierarchy
+    :return: A dict of command -> the position reached by that command
+    """
+    if cli_state == 'diag':
+        # exit from diag returns to where it was entered
+        return {'exit': diag_return or 'Admin'}
+    if cli_state == 'monitor':
+        return {'admin': 'Admin'}
+    if cli_state == 'Admin':
+        moves = {'exit': 'monitor'}
+        if cli_node != 'Admin':
+            moves[cli_node] = cli_node
+        return moves
+    # Any other node
+    return {'exit': 'Admin'}
+
+
+def cli_nav_plan(cli_state, cli_node, diag_return=None):
+    """
+    Plan the shortest list of commands moving between two positions of the CLI hierarchy.
+    :param cli_state: The current position - 'diag', 'monitor', 'Admin' or a node name
+    :param cli_node: The position to navigate to - 'Admin' or a node name
+    :param diag_return: The position diag was entered from, see SSH.diag_return
+    :return: A list of commands, empty when already there, or None when no path is known
+    """
+    if cli_state is None:
+        return None
+
+    came_from = {cli_state: None}
+    queue = deque([cli_state])
+    while queue:
+        state = queue.popleft()
+        if state == cli_node:
+            plan = []
+            while came_from[state]:
+                state, cmd = came_from[state]
+                plan.append(cmd)
+            return plan[::-1]
+        for cmd, next_state in _cli_moves(state, cli_node, diag_return).items():
+            if next_state not in came_from:
+                came_from[next_state] = (state, cmd)
+                queue.append(next_state)
+
+    return None
+
+
 def cli_nav(fh_ssh, cli_node):
     """
     Navigate to the correct user level and node in the CLI hierarchy to issue a specific command.
+
+    The position tracked by the SSH session (fh_ssh.cli_state) is used to plan the shortest path,
+    and the planned commands are sent as one batch. fh_ssh.nav_count counts the navigation
+    commands sent over the life of the session.
     :param fh_ssh: SSH session created via previous call to SSH.open
     :param cli_node: The string that matches which node to navigate to in order to execute
                      a given command.
     :return: True or False if the requested node could be navigated to
     """
-
-    # Exit diag level if required
-    if 'root@' in fh_ssh.prompt:
-        fh_ssh.send('exit')
-    # Enter admin level if required
-    if fh_ssh.prompt.endswith('>'):
-        fh_ssh.send('admin')
-
-    crnt_node = fh_ssh.prompt.split(f'{fh_ssh.sys_name}-')[1][:-1]
-    if cli_node in crnt_node:
+    plan = cli_nav_plan(fh_ssh.cli_state, cli_node, fh_ssh.diag_return)
+    if plan is None:
+        p_trace(f'Unable to find a path from prompt {fh_ssh.prompt} to cli node {cli_node}', 'ERROR')
+        return False
+    if not plan:
         return True
-    else:
-        # Drop to base cli node
-        if 'Admin' not in crnt_node:
-            fh_ssh.send('exit')
 
-        if cli_node != 'Admin':
-            result = fh_ssh.send(cli_node)
-            if not result[0]:
-                p_trace(f'Unable to navigate to requested cli node {cli_node} - {result[1]}', 'ERROR')
-                return False
+    fh_ssh.nav_count += len(plan)
+    with span('cli_nav', fh_ssh.host_id):
+        results = fh_ssh.send_batch(plan)
+    for result in results:
+        if not result[0]:
+            p_trace(f'Unable to navigate to requested cli node {cli_node} - {result[1]}', 'ERROR')
+            return False
+
+    if fh_ssh.cli_state != cli_node:
+        p_trace(f'Unable to navigate to requested cli node {cli_node} - prompt is {fh_ssh.prompt}', 'ERROR')
+        return False
 
     return True
 
@@ -51,15 +121,136 @@ def cli_get_ver(fh_ssh):
     :param fh_ssh: SSH session created via previous call to SSH.open
     :return: version - a string matching the vesrion string obtained by a show version
     """
+    cache = fh_ssh.fact_cache
+    if cache is not None and fh_ssh.boot_checked:
+        version = cache.get(fh_ssh.host_id, 'version')
+        if version is not None:
+            return version
+
     cli_nav(fh_ssh, 'system')
-    output = fh_ssh.send('show version')
-    version = output[1][0]
-    output = fh_ssh.send('show uptime')
-    uptime = output[1][0]
+    output = fh_ssh.send_batch(['show version', 'show uptime'])
+    version = output[0][1][0]
+    uptime = output[1][1][0]
     p_trace(f"{fh_ssh.sys_name} is running:  '{version}'  / System uptime: {uptime}")
+    if cache is not None:
+        # The uptime came for free, validate the cached facts with it
+        if not fh_ssh.boot_checked:
+            cache.check_boot(fh_ssh.host_id, parse_uptime(uptime))
+            fh_ssh.boot_checked = True
+        cache.put(fh_ssh.host_id, 'version', version)
     return version
 
 
+def _fact_cache(fh_ssh):
+    """
+    :param fh_ssh: SSH session created via previous call to SSH.open
+    :return: The fact cache of the session, once the facts it holds for the CPE are known to
+             predate no reboot. None when the session has no fact cache.
+    """
+    cache = fh_ssh.fact_cache
+    if cache is not None and not fh_ssh.boot_checked:
+        cli_nav(fh_ssh, 'system')
+        output = fh_ssh.send('show uptime')
+        cache.check_boot(fh_ssh.host_id, parse_uptime(output[1][0]) if output[0] and output[1] else None)
+        fh_ssh.boot_checked = True
+    return cache
+
+
+_SQUARE_BRACKETS = str.maketrans('[]', '  ')
+
+
+class CliSchema(object):
+    """
+    The object names of an agni cli show cmd output, with their patterns compiled once.
+    A schema is never modified by parsing, so it can be shared by any number of parsers.
+    """
+
+    def __init__(self, obj_names):
+        """
+        :param obj_names: The full list of object names returned by the command, in order
+        """
+        self.obj_names = tuple(obj_names)
+        self.patterns = tuple(re.compile(f'{re.escape(obj)} *:(.*)') for obj in self.obj_names)
+
+    def parser(self):
+        """
+        :return: A new CliParser for one command output
+        """
+        return CliParser(self)
+
+    def parse(self, lines):
+        """
+        Parse a complete command output in a single pass
+        :param lines: The output lines of the command
+        :return: output_parsed - A dict of objects and values based the cmd output
+        """
+        parser = CliParser(self)
+        for line in lines:
+            parser.feed(line)
+        return parser.output_parsed
+
+
+class CliParser(object):
+    """
+    Incremental parser of one command output. Lines can be fed as they arrive, and
+    output_parsed is up to date after every line.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.next_obj = 0
+        self.obj_data = None
+        self.output_parsed = {}
+
+    def feed(self, line):
+        """
+        Parse the next output line
+        :param line: A line of the command output
+        """
+        if line.startswith('---'):
+            return
+        # Remove square brackets and white space
+        line = line.translate(_SQUARE_BRACKETS).strip()
+
+        i = self.next_obj
+        if i < len(self.schema.obj_names) and line.startswith(self.schema.obj_names[i]):
+            # The start of the next object
+            self.next_obj += 1
+            self.obj_data = []
+            self.output_parsed[self.schema.obj_names[i]] = self.obj_data
+            m = self.schema.patterns[i].match(line)
+            value = m.group(1) if m else line
+        elif self.obj_data is None:
+            # Nothing before the first object is data
+            return
+        elif line.startswith(': '):
+            # Data continued from the previous line
+            value = line[2:]
+        else:
+            value = line
+
+        if len(value) > 0:
+            self.obj_data.append(value.strip())
+
+
+ANA2_TUNNEL_SCHEMA = CliSchema(
+    ['Profile Name', 'Status', 'Link1', 'Link2', 'Username', 'Password',
+     'Keepalive', 'Link-detection', 'QoE-check', 'IPDE-QoE', 'Compress', 'VJCOMP', 'Tcpmss',
+     'Frag-seq-sync', 'DNS', 'Mtu', 'Route(s)', 'Interface', 'NAT', 'Failsafe', 'Latency',
+     'Lmtu', 'Lmru', 'Lmrru', 'MDPS', 'QoE-MDPS', 'Weight', 'Bandwidth', 'ANA-Int-Filter',
+     'APD-Bypass', 'IPDE-LJA', 'MINIDEQUEUE', 'FRAG-TIMER', 'RLA-Bandwidth', 'RLA-Reserve',
+     'RLA-Bypass', 'RLA-On-demand', 'IPDE-QUEUE', 'Log(s)'])
+
+ANA2_SERVER_SCHEMA = CliSchema(
+    ['Profile', 'Type', 'Bundlesize', 'Version', 'Status', 'Keepalive', 'Authentication',
+     'Pool(s)', 'Link1', 'Link2', 'Link3', 'Link4', 'Link5', 'Link6', 'Link7', 'Link8',
+     'DNS', 'Proxy', 'Protocomp', 'Mtu', 'Mrru', 'Radius', 'Log(s)'])
+
+DHCP_PROF_SCHEMA = CliSchema(
+    ['Profile Name', 'Status', 'Interface', 'Hostname', 'DNS', 'DDNS',
+     'Default-gateway', 'Loopback', 'Hostname-lookup', 'Routes'])
+
+
 def cli_get_resp(fh_ssh, cli_node, cli_cmd, obj_names):
     """
     A generic helper function that executes a given agni cli show cmd,
@@ -71,49 +262,27 @@ def cli_get_resp(fh_ssh, cli_node, cli_cmd, obj_names):
     :param fh_ssh: SSH session created via previous call to SSH.open
     :param cli_node: The node under which the command is located
     :param cli_cmd: The cli command to be executed
-    :param obj_names: The full list of object names returned by the command.
+    :param obj_names: A CliSchema, or the full list of object names returned by the command.
                       This list is used to build up the dict, as well as screen scrape delimiter.
     :return: output_parsed - A dict of objects and values based the cmd output,
              or False in case of error
     """
+    cache = _fact_cache(fh_ssh)
+    fact = f'{cli_node}: {cli_cmd}'
+    if cache is not None:
+        output_parsed = cache.get(fh_ssh.host_id, fact)
+        if output_parsed is not None:
+            return output_parsed
+
     if not cli_nav(fh_ssh, cli_node):
         p_trace(f'Unable to navigate to requested CLI node - {cli_node}', 'ERROR')
         return False
-    output_parsed = {}
-    output = fh_ssh.send(cli_cmd, True)
-
-    for line in output[1]:
-        if line.startswith('---'):
-            continue
-        # Remove square brackets and white space
-        line = re.sub(r'([\[\]])', ' ', line)
-        line = line.strip()
-        for obj in obj_names:
-            obj_key = obj
-            if line.startswith(obj):
-                obj_data = []
-                update = True
-                obj_names.pop(0)
-                break
-            else:
-                update = False
-                break
-
-        # Escape brackets () for regexp, otherwise entire line used as data
-        obj = re.sub(r'([\(\)])', r'\\\1', obj)
-        m = re.search(f'(^{obj} *:)(.*)', line)
-        if m:
-            # A match implies the start of a new object
-            value = m.group(m.lastindex)
-        else:
-            # No match means data continued to the next line
-            value = re.sub(r'(^: )', '', line)
-
-        if len(value) > 0:
-            obj_data.append(value.strip())
-        if update:
-            output_parsed.update({obj_key: obj_data})
 
+    schema = obj_names if isinstance(obj_names, CliSchema) else CliSchema(obj_names)
+    output = fh_ssh.send(cli_cmd, True)
+    output_parsed = schema.parse(output[1])
+    if cache is not None and output[0] and output_parsed:
+        cache.put(fh_ssh.host_id, fact, output_parsed)
     return output_parsed
 
 
@@ -125,12 +294,22 @@ def cli_get_profile_names(fh_ssh, cli_node):
     :return: output_parsed -A dict of objects and values based the cmd output
     """
 
+    cache = _fact_cache(fh_ssh)
+    fact = f'{cli_node}: show profile all'
+    if cache is not None:
+        profiles = cache.get(fh_ssh.host_id, fact)
+        if profiles is not None:
+            return profiles
+
     if not cli_nav(fh_ssh, cli_node):
         p_trace(f'Unable to navigate to requested CLI node - {cli_node}', 'ERROR')
         return False
 
     profiles = fh_ssh.send('show profile all')
-    return profiles[1]
+    names = list(profiles[1]) if profiles[1] is not False else False
+    if cache is not None and profiles[0] and names:
+        cache.put(fh_ssh.host_id, fact, names)
+    return names
 
 
 def cli_get_ana2_tunnel(fh_ssh):
@@ -140,16 +319,9 @@ def cli_get_ana2_tunnel(fh_ssh):
     :param fh_ssh: SSH session created via previous call to SSH.open
     :return: output_parsed -A dict of objects and values based the cmd output
     """
-    obj_names = ['Profile Name', 'Status', 'Link1', 'Link2', 'Username', 'Password',
-                 'Keepalive', 'Link-detection', 'QoE-check', 'IPDE-QoE', 'Compress', 'VJCOMP', 'Tcpmss',
-                 'Frag-seq-sync', 'DNS', 'Mtu', 'Route(s)', 'Interface', 'NAT', 'Failsafe', 'Latency',
-                 'Lmtu', 'Lmru', 'Lmrru', 'MDPS', 'QoE-MDPS', 'Weight', 'Bandwidth', 'ANA-Int-Filter',
-                 'APD-Bypass', 'IPDE-LJA', 'MINIDEQUEUE', 'FRAG-TIMER', 'RLA-Bandwidth', 'RLA-Reserve',
-                 'RLA-Bypass', 'RLA-On-demand', 'IPDE-QUEUE', 'Log(s)']
-
     profiles = cli_get_profile_names(fh_ssh, 'ana2-client')
     p_name = profiles[0]
-    output_parsed = cli_get_resp(fh_ssh, 'ana2-client', f'show profile {p_name}', obj_names)
+    output_parsed = cli_get_resp(fh_ssh, 'ana2-client', f'show profile {p_name}', ANA2_TUNNEL_SCHEMA)
     return output_parsed
 
 
@@ -161,10 +333,7 @@ def cli_get_dhcp_prof(fh_ssh, link_id):
     :return: output_parsed -A dict of objects and values based the cmd output
     """
     cmd = f'show profile {link_id}'
-    obj_names = ['Profile Name', 'Status', 'Interface', 'Hostname', 'DNS', 'DDNS',
-                 'Default-gateway', 'Loopback', 'Hostname-lookup', 'Routes']
-
-    output_parsed = cli_get_resp(fh_ssh, 'dhcp-client', cmd, obj_names)
+    output_parsed = cli_get_resp(fh_ssh, 'dhcp-client', cmd, DHCP_PROF_SCHEMA)
     return output_parsed
 
 
@@ -178,12 +347,7 @@ def cli_get_ana2_server(fh_ssh):
     """
     profiles = cli_get_profile_names(fh_ssh, 'ana2-server')
     p_name = profiles[0]
-
-    obj_names = ['Profile', 'Type', 'Bundlesize', 'Version', 'Status', 'Keepalive', 'Authentication',
-                 'Pool(s)', 'Link1', 'Link2', 'Link3', 'Link4', 'Link5', 'Link6', 'Link7', 'Link8',
-                 'DNS', 'Proxy', 'Protocomp', 'Mtu', 'Mrru', 'Radius', 'Log(s)']
-
-    output_parsed = cli_get_resp(fh_ssh, 'ana2-server', f'show profile {p_name}', obj_names)
+    output_parsed = cli_get_resp(fh_ssh, 'ana2-server', f'show profile {p_name}', ANA2_SERVER_SCHEMA)
     return output_parsed
 
 
@@ -226,52 +390,135 @@ def cli_update_password(fh_ssh, uname, passwd_old, passwd_new):
 
 
 def cli_save_config(fh_ssh):
-    cli_nav(fh_ssh, 'Admin')
-    fh_ssh.send(f'save config all')
+    with span('save_config', fh_ssh.host_id):
+        cli_nav(fh_ssh, 'Admin')
+        fh_ssh.send(f'save config all')
     return True
 
 
-def calibrate_links(fh_ssh, aux_srv='192.168.110.2'):
-    """
-    Perform the manual step of calibrating the underlay links based on the
-    output of the calibrate debug-qoe cli cmd.
-    :param fh_ssh: SSH session created via previous call to SSH.open()
-    :param aux_srv: The IP address of the server hosting nuttcp
-    :return: True or False based on success
-
-    sh /usr/local/cli/scripts/lib.ana2c.sh set ANA amos link{0} both {1} debug
-    """
+_CALIBRATE_MAX = re.compile(r'(Max )(upload|download)( bandwidth established for )(link\d)( = )(\d+)( Kbps)')
+_CALIBRATE_RLA = re.compile(r'(\d+)( Kbps)( +)(95%)( +)(\d+\.\d+%)')
 
-    cli_nav(fh_ssh, 'ana2-client')
-    cmd = f'set profile-ana2-client ANA calibrate {aux_srv} debug-qoe'
-    p_trace('Be patient for approx 5 min, performing manual ana2-client link calibration')
 
-    bw_cmds = []
-    rla_cmds = []
-    link = False
-    direction = False
+class CalibrationParser(object):
+    """
+    Collects the bandwidth commands matching the results of a calibration, as its output lines
+    are fed. Shared by cli_get_calibration and its async_ssh_lib namesake.
+    """
 
-    response = fh_ssh.send(cmd)
-    for line in response[1]:
-        m_max = re.search(r'(Max )(upload|download)( bandwidth established for )(link\d)( = )(\d+)( Kbps)', line)
+    def __init__(self, sys_name):
+        """
+        :param sys_name: The name of the CPE being calibrated, for the logs
+        """
+        self.sys_name = sys_name
+        self.bw_cmds = []
+        self.rla_cmds = []
+        self.link = False
+        self.direction = False
+
+    def feed(self, line):
+        """
+        Parse the next output line of the calibration
+        :param line: A line of the command output
+        """
+        m_max = _CALIBRATE_MAX.search(line)
         if m_max:
-            link = m_max.group(4)
+            self.link = m_max.group(4)
             max_bps = int(m_max.group(6)) * 1000
-            direction = 'in'
+            self.direction = 'in'
             if m_max.group(2) == 'upload':
-                direction = 'out'
-            bw_cmds.append(f'set profile-ana2-client ANA bandwidth {link} {max_bps} {direction}')
-        m_rla = re.search(r'(\d+)( Kbps)( +)(95%)( +)(\d+\.\d+%)', line)
+                self.direction = 'out'
+            self.bw_cmds.append(f'set profile-ana2-client ANA bandwidth {self.link} {max_bps} {self.direction}')
+            p_trace(f'{self.sys_name} calibrated {self.link} {m_max.group(2)} at {max_bps} bps', 'PASS')
+        m_rla = _CALIBRATE_RLA.search(line)
         if m_rla:
             rlx_bps = int(m_rla.group(1)) * 1000
             # loss = float(m_rla.group(6))
             # if str(num_links) in link:
-            rla_cmds.append(f'set profile-ana2-client ANA ipde-rla bandwidth {link} {rlx_bps} {direction}')
+            self.rla_cmds.append(f'set profile-ana2-client ANA ipde-rla bandwidth {self.link} {rlx_bps} '
+                                 f'{self.direction}')
+
+    def cmds(self):
+        """
+        :return: The bandwidth and ipde-rla bandwidth commands matching the results
+        """
+        return self.bw_cmds + self.rla_cmds
+
+
+def calibration_cmd(aux_srv):
+    """
+    :param aux_srv: The IP address of the server hosting nuttcp
+    :return: The command calibrating the underlay links against aux_srv
+    """
+    return f'set profile-ana2-client ANA calibrate {aux_srv} debug-qoe'
 
-    for cmd in bw_cmds:
-        # bw_resp = fh_ssh.send(cmd)
-        print(cmd)
 
-    for cmd in rla_cmds:
-        # rla_resp = fh_ssh.send(cmd)
+def cli_get_calibration(fh_ssh, aux_srv):
+    """
+    Calibrate the underlay links against a nuttcp server with the calibrate debug-qoe cli cmd,
+    which takes approx 5 min.
+    :param fh_ssh: SSH session created via previous call to SSH.open()
+    :param aux_srv: The IP address of the server hosting nuttcp
+    :return: The bandwidth and ipde-rla bandwidth commands matching the results, False when
+             the calibration failed
+
+    sh /usr/local/cli/scripts/lib.ana2c.sh set ANA amos link{0} both {1} debug
+    """
+
+    if not cli_nav(fh_ssh, 'ana2-client'):
+        return False
+    p_trace(f'Be patient for approx 5 min, performing ana2-client link calibration against {aux_srv}')
+
+    # Parse the results as they are reported rather than once the calibration completes
+    parser = CalibrationParser(fh_ssh.sys_name)
+    stream = fh_ssh.stream(calibration_cmd(aux_srv))
+    for line in stream:
+        parser.feed(line)
+
+    if not stream.result:
+        return False
+    return parser.cmds()
+
+
+def cli_apply_cmds(fh_ssh, cli_node, cmds):
+    """
+    Helper function to apply config commands to a cli node, sent as one batch
+    :param fh_ssh: SSH session created via previous call to SSH.open
+    :param cli_node: The cli node the commands are issued in
+    :param cmds: The list of commands, in order
+    :return: True or False based on success
+    """
+    if not cli_nav(fh_ssh, cli_node):
+        return False
+    with span('apply_cmds', fh_ssh.host_id):
+        results = fh_ssh.send_batch(cmds)
+    # The cached facts may describe the config that was just changed
+    if fh_ssh.fact_cache is not None:
+        fh_ssh.fact_cache.invalidate(fh_ssh.host_id)
+
+    result = True
+    for cmd, output in zip(cmds, results):
+        if not output[0] or any(line.startswith('%') for line in output[1]):
+            p_trace(f"'{cmd}' failed on {fh_ssh.sys_name} - {output[1]}", 'ERROR')
+            result = False
+    return result
+
+
+def calibrate_links(fh_ssh, aux_srv='192.168.110.2', apply=False):
+    """
+    Perform the manual step of calibrating the underlay links based on the
+    output of the calibrate debug-qoe cli cmd.
+    :param fh_ssh: SSH session created via previous call to SSH.open()
+    :param aux_srv: The IP address of the server hosting nuttcp
+    :param apply: When True the resulting bandwidth commands are applied, otherwise they are printed
+    :return: True or False based on success
+    """
+    cmds = cli_get_calibration(fh_ssh, aux_srv)
+    if cmds is False:
+        return False
+
+    if apply:
+        return cli_apply_cmds(fh_ssh, 'ana2-client', cmds)
+    for cmd in cmds:
         print(cmd)
+    return True
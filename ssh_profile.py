@@ -0,0 +1,178 @@
+import os
+import threading
+import paramiko
+from cmn_lib import p_trace
+
+"""
+This file contains the connection profile of ssh_drv.SSH, ie how the SSH connections to the
+CPEs are negotiated and authenticated.
+
+A profile holds:
+    - a known hosts file, shared by every session and every run. A CPE's host key is saved
+      the first time it is seen, and a CPE later presenting another key of that type is
+      refused. The key types already known for a CPE are offered first, so the CPE keeps
+      presenting the same key.
+    - password only authentication, which skips the local keys and the ssh agent that paramiko
+      otherwise tries first, one failed round trip each.
+    - the preferred key exchange, cipher and MAC algorithms, offered ahead of the others.
+    - compression, worth it on slow links only.
+
+Pass a profile to SSH.open(..., profile=...).
+"""
+
+# The algorithms paramiko offers, per SecurityOptions attribute
+_ALGORITHMS = {'kex': paramiko.Transport._preferred_kex, 'ciphers': paramiko.Transport._preferred_ciphers,
+               'digests': paramiko.Transport._preferred_macs}
+
+# The host key algorithms negotiating a key of a given type, RSA keys being signed with SHA-2 first
+_KEY_ALGORITHMS = {'ssh-rsa': ['rsa-sha2-512', 'rsa-sha2-256', 'ssh-rsa']}
+
+
+class KnownHosts(object):
+    """
+    A known hosts file (OpenSSH format) loaded once and appended to as new host keys are seen
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The known hosts file, created when missing
+        """
+        self.path = os.path.expanduser(path)
+        self.host_keys = paramiko.HostKeys()
+        self.lock = threading.Lock()
+        if os.path.exists(self.path):
+            self.host_keys.load(self.path)
+
+    def __getstate__(self):
+        # Handed to the worker processes of a sharded fleet run, which load the file afresh
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def key_types(self, hostname):
+        """
+        :param hostname: The host name as paramiko names it, ie [host]:port when the port is not 22
+        :return: The types of the keys known for hostname
+        """
+        with self.lock:
+            keys = self.host_keys.lookup(hostname)
+            return list(keys.keys()) if keys else []
+
+    def check(self, hostname, key):
+        """
+        Accept and save the key of a new host, or of a new key type of a known host.
+        :param hostname: The host name as paramiko names it
+        :param key: The host key presented by the server
+        :raise BadHostKeyException: When another key of that type is known for hostname
+        """
+        with self.lock:
+            keys = self.host_keys.lookup(hostname)
+            known = keys.get(key.get_name()) if keys else None
+            if known is not None:
+                if known != key:
+                    raise paramiko.BadHostKeyException(hostname, key, known)
+                return
+            self.host_keys.add(hostname, key.get_name(), key)
+            with open(self.path, 'a') as known_hosts:
+                known_hosts.write(f'{hostname} {key.get_name()} {key.get_base64()}\n')
+        p_trace(f'Saved the {key.get_name()} host key of {hostname} to {self.path}', 'DEBUG')
+
+
+class _KnownHostsPolicy(paramiko.MissingHostKeyPolicy):
+    """
+    Checks the host keys against a KnownHosts. SSHClient's own host keys are left empty, so
+    every key goes through the policy.
+    """
+
+    def __init__(self, known_hosts):
+        self.known_hosts = known_hosts
+
+    def missing_host_key(self, client, hostname, key):
+        self.known_hosts.check(hostname, key)
+
+
+class ConnectionProfile(object):
+    """
+    How SSH connections are negotiated and authenticated, shared by any number of sessions
+    """
+
+    def __init__(self, known_hosts=None, password_only=False, kex=None, ciphers=None, macs=None, compress=False):
+        """
+        :param known_hosts: The known hosts file, None to accept any host key without saving it
+        :param password_only: When True only the password is tried, not the local keys nor the agent
+        :param kex: The key exchange algorithms offered first, in order
+        :param ciphers: The ciphers offered first, in order
+        :param macs: The MAC algorithms offered first, in order
+        :param compress: When True zlib compression is negotiated
+        """
+        self.known_hosts = KnownHosts(known_hosts) if known_hosts else None
+        self.password_only = password_only
+        self.compress = compress
+        self.preferred = {}
+        # The config keys, and the names paramiko gives the algorithm types
+        for key, option, names in [('kex', 'kex', kex), ('ciphers', 'ciphers', ciphers), ('macs', 'digests', macs)]:
+            unknown = [name for name in names or [] if name not in _ALGORITHMS[option]]
+            if unknown:
+                raise ValueError(f'Unsupported ssh_profile.{key} {unknown}, '
+                                 f'expected some of {list(_ALGORITHMS[option])}')
+            if names:
+                self.preferred[option] = list(names)
+
+    @classmethod
+    def from_conf(cls, conf):
+        """
+        :param conf: The ssh_profile section of config.yml, may be None
+        :return: The ConnectionProfile it describes
+        """
+        conf = conf or {}
+        return cls(known_hosts=conf.get('known_hosts'), password_only=conf.get('password_only', False),
+                   kex=conf.get('kex'), ciphers=conf.get('ciphers'), macs=conf.get('macs'),
+                   compress=conf.get('compress', False))
+
+    def policy(self):
+        """
+        :return: The missing host key policy of the SSHClient
+        """
+        if self.known_hosts:
+            return _KnownHostsPolicy(self.known_hosts)
+        return paramiko.AutoAddPolicy()
+
+    def connect_args(self, host_id, port):
+        """
+        :param host_id: The host connected to
+        :param port: Its SSH port
+        :return: The keyword arguments of SSHClient.connect applying the profile
+        """
+        hostname = host_id if int(port) == 22 else f'[{host_id}]:{port}'
+        preferred = dict(self.preferred)
+        if self.known_hosts:
+            key_types = self.known_hosts.key_types(hostname)
+            if key_types:
+                preferred['key_types'] = [name for key_type in key_types
+                                          for name in _KEY_ALGORITHMS.get(key_type, [key_type])]
+
+        def transport_factory(sock, **kwargs):
+            transport = paramiko.Transport(sock, **kwargs)
+            options = transport.get_security_options()
+            for option, names in preferred.items():
+                current = getattr(options, option)
+                # Only reorder, the remaining algorithms are still offered
+                setattr(options, option, [name for name in names if name in current] +
+                        [name for name in current if name not in names])
+            return transport
+
+        return {'look_for_keys': not self.password_only, 'allow_agent': not self.password_only,
+                'compress': self.compress, 'transport_factory': transport_factory}
+
+
+def apply_profile(ne_conf):
+    """
+    Add the ConnectionProfile of the ssh_profile section to the connection section of ne_conf,
+    so every session opened from ne_conf shares it
+    :param ne_conf: The parsed config.yml, updated in place
+    :return: The ConnectionProfile
+    """
+    profile = ConnectionProfile.from_conf(ne_conf.get('ssh_profile'))
+    ne_conf['connection'] = dict(ne_conf.get('connection') or {}, profile=profile)
+    return profile
@@ -0,0 +1,79 @@
+import pytest
+import inventory
+
+
+def _load(entries, tmp_path=None, **kwargs):
+    return list(inventory.load_inventory(entries, str(tmp_path or '.'), **kwargs))
+
+
+def test_csv_overrides(tmp_path):
+    (tmp_path / 'cpes.csv').write_text('host,port,admin,site\n10.0.0.1,2222,secret,montreal\n,22,,\n10.0.0.2,,,\n')
+    targets = _load([{'file': 'cpes.csv'}], tmp_path)
+    assert targets == ['10.0.0.1', '10.0.0.2']
+    assert targets[0].overrides == {'port': 2222, 'site': 'montreal', 'credentials': {'admin': 'secret'}}
+    assert targets[1].overrides is None
+
+
+def test_csv_extra_fields(tmp_path):
+    (tmp_path / 'cpes.csv').write_text('host,admin\n10.0.0.1,secret\n10.0.0.2,se,cret\n')
+    with pytest.raises(ValueError, match='line 3'):
+        _load([{'file': 'cpes.csv'}], tmp_path)
+
+
+def test_csv_bad_port(tmp_path):
+    (tmp_path / 'cpes.csv').write_text('host,port\n10.0.0.1,ssh\n')
+    with pytest.raises(ValueError, match='line 2'):
+        _load([{'file': 'cpes.csv'}], tmp_path)
+
+
+def test_ranges():
+    assert _load(['10.0.0.1-3']) == ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+    assert _load(['10.0.0.254-10.0.1.1']) == ['10.0.0.254', '10.0.0.255', '10.0.1.0', '10.0.1.1']
+
+
+@pytest.mark.parametrize('entry', ['10.0.0.5-3', '10.0.0.1-300', '10.0.0.1-::2', '10.0.0.0/33'])
+def test_invalid_ranges(entry):
+    with pytest.raises(ValueError, match='Invalid inventory entry'):
+        _load([entry])
+
+
+def test_cidr():
+    assert _load(['10.0.0.0/30']) == ['10.0.0.1', '10.0.0.2']
+    assert _load(['10.0.0.0/31']) == ['10.0.0.0', '10.0.0.1']
+    assert len(_load(['10.0.0.0/22'])) == 1022
+
+
+def test_duplicates():
+    entries = ['10.0.0.2', '10.0.0.0/29', '10.0.0.3-5', {'host': '10.0.0.4', 'port': 2222}, 'cpe1', 'cpe1']
+    targets = _load(entries)
+    assert targets == ['10.0.0.2', '10.0.0.1', '10.0.0.3', '10.0.0.4', '10.0.0.5', '10.0.0.6', '10.0.0.4', 'cpe1']
+    assert [target.key for target in targets[-2:]] == ['10.0.0.4:2222', 'cpe1']
+    assert len(_load(entries, dedup=False)) == 13
+
+
+def test_duplicate_port_overrides():
+    entries = [{'host': 'cpe1', 'port': 2201}, {'host': 'cpe1', 'credentials': {'port': 2201}},
+               {'host': 'cpe1', 'port': 2202}, 'cpe1']
+    assert [target.key for target in _load(entries)] == ['cpe1:2201', 'cpe1:2202', 'cpe1']
+
+
+def test_target_conf():
+    ne_conf = {'credentials': {'uname': 'cpe', 'port': 22, 'admin': 'a'}}
+    target = _load([{'host': 'cpe1', 'port': 2222, 'credentials': {'admin': 'b'}}])[0]
+    assert target.conf(ne_conf)['credentials'] == {'uname': 'cpe', 'port': 2222, 'admin': 'b'}
+    assert ne_conf['credentials']['port'] == 22
+
+
+def test_yaml_file(tmp_path):
+    (tmp_path / 'cpes.yml').write_text('logging: {level: INFO}\nnetwork_entities:\n  - 10.0.0.1\n'
+                                       '  - {host: 10.0.0.8/30, port: 2222}\n')
+    targets = _load([{'file': 'cpes.yml'}], tmp_path)
+    assert targets == ['10.0.0.1', '10.0.0.9', '10.0.0.10']
+    assert targets[1].overrides == {'port': 2222}
+    (tmp_path / 'cpes.yml').write_text('- 10.0.0.1\n- cpe1\n')
+    assert _load([{'file': 'cpes.yml'}], tmp_path) == ['10.0.0.1', 'cpe1']
+
+
+def test_text_file(tmp_path):
+    (tmp_path / 'cpes.txt').write_text('# Montreal\n10.0.0.1  # core\n\n10.0.0.2-3\n')
+    assert _load([{'file': 'cpes.txt'}, '10.0.0.3'], tmp_path) == ['10.0.0.1', '10.0.0.2', '10.0.0.3']
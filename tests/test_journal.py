@@ -0,0 +1,51 @@
+import pytest
+import journal
+
+
+def test_resume(tmp_path):
+    path = str(tmp_path / 'run.journal')
+    key = journal.fingerprint('monitor', 'admin')
+    with journal.RunJournal(path, key=key) as run_journal:
+        for step in journal.STEPS:
+            run_journal.record('10.0.0.1', step)
+        run_journal.record('10.0.0.2', 'admin_password')
+        run_journal.record('10.0.0.2', 'connected')
+        run_journal.record('10.0.0.3', 'monitor_password')
+        run_journal.reset('10.0.0.3')
+        run_journal.record('10.0.0.4:2222', 'verified')
+    # The previous run died halfway through a line
+    with open(path, 'a') as journal_file:
+        journal_file.write('{"ts": 1, "host": "10.0.0.5", "st')
+
+    with journal.RunJournal(path, True, key) as run_journal:
+        assert run_journal.done('10.0.0.1')
+        assert run_journal.step('10.0.0.2') == 'admin_password'
+        assert run_journal.passed('10.0.0.2', 'monitor_password')
+        assert not run_journal.passed('10.0.0.2', 'verified')
+        assert run_journal.step('10.0.0.3') is None
+        assert run_journal.step('10.0.0.4:2222') == 'verified'
+        assert run_journal.step('10.0.0.5') is None
+        run_journal.record('10.0.0.2', 'saved')
+
+    with journal.RunJournal(path, True, key) as run_journal:
+        assert run_journal.done('10.0.0.2')
+
+
+def test_fresh_start(tmp_path):
+    path = str(tmp_path / 'run.journal')
+    with journal.RunJournal(path, key='k') as run_journal:
+        run_journal.record('10.0.0.1', 'saved')
+    # Without resume the journal is started afresh
+    with journal.RunJournal(path, key='k') as run_journal:
+        assert run_journal.steps == {}
+    with journal.RunJournal(path, True, key='k') as run_journal:
+        assert run_journal.steps == {}
+
+
+def test_fingerprint_mismatch(tmp_path):
+    path = str(tmp_path / 'run.journal')
+    with journal.RunJournal(path, key=journal.fingerprint('monitor', 'admin')) as run_journal:
+        run_journal.record('10.0.0.1', 'connected')
+    assert journal.fingerprint('monitor', 'admin') != journal.fingerprint('monitor', 'other')
+    with pytest.raises(ValueError, match='other new passwords'):
+        journal.RunJournal(path, True, journal.fingerprint('monitor', 'other'))
@@ -0,0 +1,48 @@
+import pytest
+import output_buffer
+from output_buffer import OutputBuffer
+
+LINES = [f'line {i} é{"x" * (i % 7)}' for i in range(200)]
+
+
+def test_below_spill():
+    with OutputBuffer(spill=100000) as buffer:
+        buffer.extend(LINES)
+        assert not buffer.spilled
+        assert buffer == LINES
+        assert buffer[-1] == LINES[-1] and buffer[3:6] == LINES[3:6]
+
+
+def test_never_spill():
+    with OutputBuffer(spill=None) as buffer:
+        buffer.extend(LINES * 100)
+        assert not buffer.spilled and len(buffer) == len(LINES) * 100
+
+
+@pytest.mark.parametrize('read_chunk', [7, 64, output_buffer.READ_CHUNK])
+def test_above_spill(tmp_path, monkeypatch, read_chunk):
+    # Small chunks make lines straddle them, and some lines longer than a chunk
+    monkeypatch.setattr(output_buffer, 'READ_CHUNK', read_chunk)
+    with OutputBuffer(spill=500, spill_dir=str(tmp_path)) as buffer:
+        buffer.extend(LINES[:10])
+        assert not buffer.spilled
+        buffer.extend(LINES[10:100])
+        assert buffer.spilled
+        assert list(buffer) == LINES[:100]
+        # Appended after the lines were read back, the map is renewed
+        buffer.extend(LINES[100:])
+        assert buffer == LINES
+        assert len(buffer) == len(LINES) and bool(buffer)
+        assert buffer[0] == LINES[0] and buffer[-1] == LINES[-1] and buffer[150] == LINES[150]
+        assert buffer[5:200:20] == LINES[5:200:20]
+        with pytest.raises(IndexError):
+            buffer[len(LINES)]
+    assert len(buffer) == 0 and not buffer.spilled
+
+
+def test_spilled_new_lines():
+    lines = ['first', 'two\nlines', '', 'last ✓']
+    with OutputBuffer(spill=0) as buffer:
+        buffer.extend(lines)
+        assert buffer.spilled
+        assert list(buffer) == lines and buffer[1] == 'two\nlines'
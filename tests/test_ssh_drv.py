@@ -0,0 +1,78 @@
+import random
+import pytest
+from ssh_drv import LineSplitter, RawResponse, SSH
+
+
+def test_line_splitter():
+    splitter = LineSplitter()
+    for chunk in [b'one\r', b'\ntwo\x0cthree\n\nfour\r\nfi', 'vé'.encode()[:-1], 'vé'.encode()[-1:], b'\n']:
+        splitter.feed(chunk)
+    # Only new lines end a line, a form feed is part of it
+    assert splitter.pop() == ['one', 'two\x0cthree', '', 'four', 'fivé']
+    splitter.feed(b'six\r')
+    assert splitter.pop() == []
+    splitter.flush()
+    assert splitter.pop() == ['six']
+
+
+def _session():
+    ssh = SSH()
+    ssh.host_id = '127.0.0.1'
+    ssh.sys_name = 'CPE0000'
+    ssh.admin_passwd = 'secret'
+    return ssh
+
+
+def _chunkings(data, rng, count=50):
+    """
+    :return: count random splits of data, down to a byte at a time
+    """
+    yield [data[i:i + 1] for i in range(len(data))]
+    for _ in range(count):
+        cuts = sorted(rng.sample(range(1, len(data)), rng.randint(1, min(40, len(data) - 1))))
+        yield [data[start:end] for start, end in zip([0] + cuts, cuts + [len(data)])]
+
+
+def _feed(response, chunks):
+    replies = []
+    for i, chunk in enumerate(chunks):
+        assert not response.done
+        replies += response.feed(chunk, i < len(chunks) - 1)
+    return replies
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_raw_response_chunking(seed):
+    lines = ['Version 7.2.1', 'Café, naïve, 日本語 ✓', '\tindented', '% not an error here', 'CPE0000> quoted']
+    data = ('show info\r\n' + '\r\n'.join(lines) + '\r\n\r\nCPE0000(system)# ').encode('utf-8')
+    rng = random.Random(seed)
+    for chunks in _chunkings(data, rng):
+        ssh = _session()
+        response = RawResponse(ssh, 'show info')
+        assert _feed(response, chunks) == []
+        assert response.done
+        assert response.lines == [line.replace('\t', '    ') for line in lines]
+        # A line starting with % marks the command as failed
+        assert response.result is False
+        assert ssh.prompt == 'CPE0000(system)#'
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_raw_response_password(seed):
+    data = 'admin\r\nPassword:\r\nWelcome, administrateur é\r\nCPE0000# '.encode('utf-8')
+    rng = random.Random(seed)
+    for chunks in _chunkings(data, rng):
+        response = RawResponse(_session(), 'admin')
+        assert _feed(response, chunks) == ['secret\n']
+        assert response.done and response.result
+        assert response.lines == ['Welcome, administrateur é']
+
+
+def test_raw_response_prompt_look_alike():
+    response = RawResponse(_session(), 'show log')
+    # More data pending, so the trailing '> ' is part of the output
+    assert response.feed(b'show log\r\nstep 1 > ', True) == []
+    assert not response.done
+    response.feed(b'done\r\nCPE0000> ')
+    assert response.done
+    assert response.lines == ['step 1 > done']
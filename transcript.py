@@ -0,0 +1,269 @@
+import gzip
+import json
+import re
+import socket
+import struct
+import sys
+import time
+from collections import deque
+
+"""
+This file contains the session transcripts of the raw (AgniOS) channel.
+
+TranscriptRecorder wraps the channel of an ssh_drv.SSH session and writes every chunk
+received and sent, and every answer of recv_ready, to a gzip compressed transcript along
+with its time offset. ReplayClient and ReplayChannel stand in for the paramiko client and
+channel, and feed a transcript back to the same send / RawResponse code with no network.
+Open a session with SSH.open(..., transcript=path) to record it, and with
+SSH.open(..., replay=path) to replay it.
+
+A transcript file holds the MAGIC line, a JSON line of metadata, then one frame per event:
+a struct FRAME header (event kind, seconds since the start of the session, data length)
+followed by the data. Passwords are masked in the recorded data, the replay does not need them.
+A chunk ending with what may be the start of a password or of a set password command is
+recorded up to there, and its tail with the next chunk of the same kind, so a password split
+across two chunks is masked as well.
+"""
+
+MAGIC = b'AGTR1\n'
+FRAME = struct.Struct('<cdI')
+
+# Event kinds
+RECV = b'r'
+SEND = b's'
+READY = b'Q'
+NOT_READY = b'q'
+
+_PASSWD_ARGS = re.compile(rb'(set password \S+) \S+ \S+')
+_SET_PASSWORD = b'set password '
+# Max bytes carried over to the next chunk, a longer tail is recorded as is
+_MAX_CARRY = 1024
+
+
+def read_transcript(path):
+    """
+    :param path: The transcript file
+    :return: A tuple of the metadata dict and the list of (kind, offset, data) frames
+    """
+    with gzip.open(path, 'rb') as transcript:
+        if transcript.readline() != MAGIC:
+            raise ValueError(f'{path} is not a session transcript')
+        meta = json.loads(transcript.readline())
+        frames = []
+        while True:
+            header = transcript.read(FRAME.size)
+            if len(header) < FRAME.size:
+                break
+            kind, offset, length = FRAME.unpack(header)
+            frames.append((kind, offset, transcript.read(length)))
+    return meta, frames
+
+
+class TranscriptRecorder(object):
+    """
+    Wraps a paramiko Channel and records the data going through it. Everything not
+    recorded is passed on to the channel.
+    """
+
+    def __init__(self, channel, path, meta=None, secrets=()):
+        """
+        :param channel: The channel of the session
+        :param path: The transcript file written
+        :param meta: Optional dict saved in the transcript, eg the host and system name
+        :param secrets: The passwords masked in the recorded data
+        """
+        self.channel = channel
+        self.path = path
+        self.secrets = [secret.encode('utf-8') for secret in secrets if secret]
+        # The tail of the last chunk of each kind, not recorded yet
+        self.carry = {}
+        self.start = time.perf_counter()
+        self.file = gzip.open(path, 'wb')
+        self.file.write(MAGIC)
+        self.file.write(json.dumps(dict(meta or {}, start=time.time())).encode('utf-8') + b'\n')
+
+    def _unfinished(self, data):
+        """
+        :return: The index from which data may end with the start of a password, or of a set
+                 password command, that the next chunk completes. len(data) when it does not.
+        """
+        index = len(data)
+        for prefix in self.secrets + [_SET_PASSWORD]:
+            for length in range(min(len(prefix) - 1, len(data)), 0, -1):
+                if data.endswith(prefix[:length]):
+                    index = min(index, len(data) - length)
+                    break
+        cmd = data.rfind(_SET_PASSWORD)
+        if cmd >= 0:
+            m = _PASSWD_ARGS.match(data, cmd)
+            # The new password runs up to a white space
+            if not m or m.end() == len(data):
+                index = min(index, cmd)
+        return index if len(data) - index <= _MAX_CARRY else len(data)
+
+    def _record(self, kind, data=b''):
+        if self.file.closed:
+            return
+        if data:
+            data = self.carry.pop(kind, b'') + data
+            index = self._unfinished(data)
+            if index < len(data):
+                self.carry[kind] = data[index:]
+                data = data[:index]
+            data = self._mask(data)
+        self._write(kind, data)
+
+    def _mask(self, data):
+        data = _PASSWD_ARGS.sub(rb'\1 *** ***', data)
+        for secret in self.secrets:
+            data = data.replace(secret, b'***')
+        return data
+
+    def _write(self, kind, data):
+        self.file.write(FRAME.pack(kind, time.perf_counter() - self.start, len(data)))
+        self.file.write(data)
+
+    def recv(self, nbytes):
+        data = self.channel.recv(nbytes)
+        self._record(RECV, data)
+        return data
+
+    def recv_ready(self):
+        ready = self.channel.recv_ready()
+        self._record(READY if ready else NOT_READY)
+        return ready
+
+    def send(self, data):
+        sent = self.channel.send(data)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._record(SEND, data[:sent])
+        return sent
+
+    def close(self):
+        self.channel.close()
+        if not self.file.closed:
+            for kind, data in self.carry.items():
+                self._write(kind, self._mask(data))
+            self.carry = {}
+            self.file.close()
+
+    def __getattr__(self, name):
+        return getattr(self.channel, name)
+
+
+class ReplayChannel(object):
+    """
+    Stands in for a paramiko Channel, serving the received data of a transcript.
+
+    The replay follows the session as recorded: recv returns the next received chunk,
+    send consumes the next sent one and recv_ready answers as it did during the recording.
+    Once the transcript is exhausted the channel behaves as closed.
+    """
+
+    def __init__(self, path, speed=0):
+        """
+        :param path: The transcript file replayed
+        :param speed: 0 to replay as fast as possible, 1 for the recorded timing, 2 for twice as fast...
+        """
+        self.meta, frames = read_transcript(path)
+        self.frames = deque(frames)
+        self.speed = speed
+        self.start = time.perf_counter()
+        self.timeout = None
+        self.closed = False
+
+    def _pace(self, offset):
+        # Hold the data until it is due at the requested speed
+        if self.speed:
+            delay = self.start + offset / self.speed - time.perf_counter()
+            if delay > 0:
+                if self.timeout is not None and delay > self.timeout:
+                    time.sleep(self.timeout)
+                    raise socket.timeout()
+                time.sleep(delay)
+
+    def recv(self, nbytes):
+        frames = self.frames
+        # Sends and readiness checks the replayed code skipped are dropped
+        while frames and frames[0][0] != RECV:
+            frames.popleft()
+        if not frames:
+            self.closed = True
+            return b''
+
+        kind, offset, data = frames[0]
+        self._pace(offset)
+        frames.popleft()
+        if len(data) > nbytes:
+            frames.appendleft((kind, offset, data[nbytes:]))
+            data = data[:nbytes]
+        return data
+
+    def recv_ready(self):
+        frames = self.frames
+        if frames and frames[0][0] in (READY, NOT_READY):
+            return frames.popleft()[0] == READY
+        return bool(frames) and frames[0][0] == RECV
+
+    def send(self, data):
+        frames = self.frames
+        while frames and frames[0][0] in (READY, NOT_READY):
+            frames.popleft()
+        if frames and frames[0][0] == SEND:
+            frames.popleft()
+        return len(data)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def setblocking(self, flag):
+        self.timeout = None if flag else 0.0
+
+    def close(self):
+        self.closed = True
+
+
+class ReplayClient(object):
+    """
+    Stands in for a connected paramiko SSHClient, its shell being the replay of a transcript
+    """
+
+    def __init__(self, path, speed=0):
+        """
+        :param path: The transcript file replayed
+        :param speed: See ReplayChannel
+        """
+        self.path = path
+        self.speed = speed
+
+    def invoke_shell(self):
+        return ReplayChannel(self.path, self.speed)
+
+    def exec_command(self, cmd):
+        raise ValueError('Transcripts only hold raw (AgniOS) channel sessions')
+
+    def get_transport(self):
+        return None
+
+    def close(self):
+        pass
+
+
+def dump(path, out=sys.stdout):
+    """
+    Print a transcript in a readable form, one event per line
+    :param path: The transcript file
+    :param out: The file written to
+    """
+    meta, frames = read_transcript(path)
+    out.write(f'{json.dumps(meta)}\n')
+    for kind, offset, data in frames:
+        if kind in (RECV, SEND):
+            direction = '<--' if kind == RECV else '-->'
+            out.write(f'{offset:10.4f} {direction} {data.decode("utf-8", "replace")!r}\n')
+
+
+if __name__ == '__main__':
+    for arg in sys.argv[1:]:
+        dump(arg)